@@ -1,5 +1,6 @@
 from pathlib import Path
 import importlib.metadata
+import platformdirs
 version = importlib.metadata.version("pythonpbs")
 __version__ = version
 
@@ -12,5 +13,7 @@ DEFAULT_PBS_SCRIPT_PATH = PBS_SCRIPT_DIR / "gpu.pbs"
 SSH_CONFIG_PATH = "~/.ssh/config"
 # TODO: replace this path with something from `platformdirs`
 
+CACHE_DIR = Path(platformdirs.user_cache_dir("pybs"))
+
 if __name__ == "__main__":
     print(PROJECT_ROOT)
@@ -1,5 +1,19 @@
 
+"""Console helpers: theme and logging setup."""
+
+import os
+
+from loguru import logger as log
+from rich.console import Console
+from rich.logging import RichHandler
 from rich.theme import Theme
+
+LOG_LEVEL_ENV = "PYBS_LOG_LEVEL"
+DEFAULT_LOG_LEVEL = "INFO"
+COMPLETION_LOG_LEVEL = "WARNING"
+COMPLETE_ENV = "_PYBS_COMPLETE"
+"""Set by click while answering a shell completion request."""
+
 custom_theme = Theme(
     {
         "progress.description": "yellow bold",
@@ -32,4 +46,34 @@ def _log_formatter(
         + f"{icon}  - [{lvl_color}]{{message}}[/{lvl_color}]"
         # Right-align code location:
         + " [dim]{name}:{function}:{line}[/dim]"
-    )
\ No newline at end of file
+    )
+
+
+def configure_logging(level: str = None, log_file=None):
+    """Set up the log sinks of the command line interface.
+
+    Messages are handed to a queue and written by loguru's writer thread
+    (`enqueue=True`), so logging never blocks polling or the `Live`
+    displays.  Console messages go through a `RichHandler`; with
+    `log_file`, every message is also written there as one JSON object per
+    line.  `level` defaults to `$PYBS_LOG_LEVEL`, or `DEFAULT_LOG_LEVEL`.
+
+    While completing (see `COMPLETE_ENV`), console messages go to stderr,
+    as stdout holds the completions, and `level` defaults to
+    `$PYBS_LOG_LEVEL`, or `COMPLETION_LOG_LEVEL`.
+
+    Use `log.opt(lazy=True)` for messages that are expensive to build (e.g.
+    whole command outputs), so they are only formatted when logged.
+    """
+    completing = COMPLETE_ENV in os.environ
+    default = COMPLETION_LOG_LEVEL if completing else DEFAULT_LOG_LEVEL
+    level = (level or os.environ.get(LOG_LEVEL_ENV) or default).upper()
+    log.remove()
+    log.add(
+        RichHandler(console=Console(stderr=True) if completing else None, show_level=True),
+        format="{message}",
+        level=level,
+        enqueue=True,
+    )
+    if log_file is not None:
+        log.add(log_file, level=level, serialize=True, enqueue=True)
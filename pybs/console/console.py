@@ -2,6 +2,9 @@
 
 import click as ck
 
+from pathlib import Path
+
+from pybs.console import DEFAULT_LOG_LEVEL, LOG_LEVEL_ENV, configure_logging
 from pybs.console.remote import commands as q
 from pybs.console.remote import code
 from pybs.console.local import (
@@ -12,14 +15,33 @@ from pybs.console.local import (
 
 MAX_CONTENT_WIDTH = 120
 
+# Shell completion never runs the `entry_point` callback, so replace
+# loguru's default DEBUG sink here; the callback configures it again.
+configure_logging()
+
 
 @ck.group(
     context_settings=dict(
         max_content_width=MAX_CONTENT_WIDTH,
     )
 )
-def entry_point():
-    pass
+@ck.option(
+    "--log-level",
+    type=ck.Choice(
+        ["TRACE", "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR", "CRITICAL"],
+        case_sensitive=False,
+    ),
+    default=None,
+    help=f"Minimum level of logged messages (default: ${LOG_LEVEL_ENV} or {DEFAULT_LOG_LEVEL}).",
+)
+@ck.option(
+    "--log-file",
+    type=ck.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Also write log messages to this file, as JSON lines.",
+)
+def entry_point(log_level: str, log_file: Path):
+    configure_logging(log_level, log_file)
 
 
 entry_point.add_command(completions)
@@ -28,3 +50,14 @@ entry_point.add_command(help)
 entry_point.add_command(code)
 entry_point.add_command(q.stat)
 entry_point.add_command(q.sub)
+entry_point.add_command(q.wait)
+entry_point.add_command(q.workflow)
+entry_point.add_command(q.logs)
+entry_point.add_command(q.fetch)
+entry_point.add_command(q.usage)
+entry_point.add_command(q.place)
+entry_point.add_command(q.exec_)
+entry_point.add_command(q.kill)
+entry_point.add_command(q.tunnel)
+entry_point.add_command(q.env)
+entry_point.add_command(q.accounting)
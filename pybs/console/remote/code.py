@@ -11,38 +11,68 @@ from pathlib import Path
 from loguru import logger as log
 from rich.progress import Progress, TimeElapsedColumn, SpinnerColumn, TextColumn
 from rich.console import Console, Group
-from rich.logging import RichHandler
 from rich.live import Live
 from rich.progress import Progress, ProgressColumn, Text
 
-from pybs.constants import JOB_STATUS_DICT, POLL_INTERVAL, DEFAULT_PBS_SCRIPT_PATH
+from pybs.constants import JOB_STATUS_DICT, POLL_INTERVAL, DEFAULT_PBS_SCRIPT_PATH, SSH_TIMEOUT
 from pybs.server import PBSServer
-from pybs.console import custom_theme, _log_formatter
+from pybs.server.directives import DirectiveError, load_request
+from pybs.server.placement import Placement
+from pybs.server.sessions import Session, SessionStore, script_key
+from pybs.console import custom_theme
 from pybs.console.ui import CompactTimeColumn
 from pybs.console.tabcomplete import complete_remote_path, complete_hostname, complete_job_script
+from pybs.console.remote.commands import parse_shapes, request_options, request_overrides
 
 
 console = Console(
     theme=custom_theme,
     # stderr=True,
 )
-# Check that theme is set properly:
-# console.print(f"[progress.description]Logging level: {"TRACE"}") #style="bold blue")
 
-log_format = "{message}"
-handler = RichHandler(
-    show_level=True,
-    # console=console, # if this is enabled, it will print the `progress` instances twice
-)
-level = "TRACE"
-# level = "WARNING"
-log.remove()
-log.add(
-    handler,
-    # lambda m: console.print(m, end=""),
-    format=log_format,
-    level=level,
-)
+
+def _launch_vscode(hostname: str, node: str, remote_path: list, verbose: bool):
+    target_name = f"{hostname}-{node}"
+    if verbose:
+        print(f"Launching VScode on {target_name}...")
+    cmd_list = ["code", "--remote", f"ssh-remote+{target_name}"] + remote_path
+    log.debug(f"Command: {cmd_list}")
+    return subprocess.run(
+        cmd_list,
+        capture_output=True,
+    )
+
+
+def _kill_job(server: PBSServer, sessions: SessionStore, job_id: str):
+    """Kill the job (waiting until it is gone) and forget its session."""
+    report = server.kill_jobs([job_id])
+    if report.refused:
+        log.error(f"Job {job_id} is still in the queue. Check with `pybs stat`.")
+    else:
+        sessions.remove(job_id)
+        log.info("Job killed.")
+    return report
+
+
+def _killswitch(server: PBSServer, sessions: SessionStore, job_id: str):
+    """Stay open until Ctrl+C, then kill the job."""
+    # add check from ck.confirm.
+    try:
+        while (
+            c := ck.prompt(
+                ck.style(text="Press Ctrl+C to kill job.", fg="red"),
+                default=None,
+                hide_input=True,
+                prompt_suffix="",
+            )
+            != "^C"
+        ):
+            pass
+    except ck.Abort:
+        log.info(f"Caught Ctrl+C")
+        log.info(f"Killing job {job_id}...")
+        _kill_job(server, sessions, job_id)
+
 
 @ck.command()
 @ck.argument(
@@ -100,6 +130,48 @@ log.add(
 @ck.option(
     "--profile", 
 )
+@ck.option(
+    "--timeout",
+    type=float,
+    default=SSH_TIMEOUT,
+    show_default=True,
+    help="Deadline in seconds for each remote call.",
+)
+@ck.option(
+    "--hedge-host",
+    default=None,
+    shell_complete=complete_hostname,
+    help="Second login node to send slow queries to as well.",
+)
+@ck.option(
+    "--shape",
+    "shapes",
+    multiple=True,
+    callback=parse_shapes,
+    help="Candidate resource shape, e.g. ngpus=2,walltime=4:00:00.  If given (several "
+    "times), the shape predicted to start soonest is submitted.",
+)
+@ck.option(
+    "--race",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Submit the best N shapes and delete the others once one starts.",
+)
+@ck.option(
+    "--attach",
+    is_flag=True,
+    help="Reuse the queued or running job of an earlier session (for the same job "
+    "script and workspace) instead of submitting a new one.",
+)
+@ck.option(
+    "--job",
+    "attach_job",
+    default=None,
+    metavar="JOBID",
+    help="Attach to job JOBID (implies --attach).",
+)
+@request_options
 def code(
     hostname: str,
     remote_path: Tuple[Path],
@@ -117,10 +189,28 @@ def code(
     reuse_window: bool = False, 
     wait: bool = False, 
     profile: str = None, 
+
+    timeout: float = SSH_TIMEOUT,
+    hedge_host: str = None,
+
+    # Overrides of the job script's #PBS directives:
+    walltime: str = None,
+    ngpus: int = None,
+    ncpus: int = None,
+    mem: str = None,
+    queue: str = None,
+    validate: bool = True,
+    shapes: list = (),
+    race: int = 1,
+    attach: bool = False,
+    attach_job: str = None,
 ):
     """Launch a job on a remote server and open VScode.
 
     This allows interactive use of GPU compute nodes, such as with a Jupyter notebook.
+    Each launch is recorded, so that with --attach a job that is still queued
+    or running (e.g. after the laptop slept) is reused instead of submitting
+    another one; a running job is reattached to within seconds.
     """
     log.debug(f"Launching job on {hostname} with remote path {remote_path}")
     log.debug(f"Job script location: {job_script_location}")
@@ -138,6 +228,18 @@ def code(
     else:
         log.info(f"Using user-provided {job_script_location} job script: {job_script}")
 
+    # Check the job request before anything touches the network
+    overrides = request_overrides(
+        walltime=walltime, ngpus=ngpus, ncpus=ncpus, mem=mem, queue=queue
+    )
+    try:
+        load_request(job_script, job_script_location, overrides).validate(
+            source=str(job_script)
+        )
+    except DirectiveError as e:
+        log.error(str(e))
+        return
+
     progress = Progress(
         SpinnerColumn(
             spinner_name="line",
@@ -159,102 +261,161 @@ def code(
 
     import time
     # If remote, check if the file exists on the remote server
-    server = PBSServer(hostname, verbose=verbose)
+    server = PBSServer(hostname, verbose=verbose, timeout=timeout, hedge_host=hedge_host)
     hostname_expanded = server.full_remotehost
-    if job_script_location == "remote":
-        with progress:
-            task1 = progress.add_task(
-                f"Checking job script on [bold][white]{hostname_expanded}[/white][/bold] exists... ",
-                total=1,
-            )
-            # expand remote path
-            log.info(f"Expanding remote path {job_script}")
-            job_script = server.expand_remote_path(job_script)
-            log.info(f"--> {job_script}")
-            if not server.check_file_exists(job_script):
-                log.error(f"Job script {job_script} not found on {hostname_expanded}. Exiting.")
+    sessions = SessionStore(hostname)
+    key = script_key(job_script, job_script_location)
+    session = None
+    if attach or attach_job is not None:
+        # workspace paths expand from the cached remote environment
+        workspace = [str(server.expand_remote_path(p)) for p in remote_path]
+        session = sessions.attach(server, attach_job, key, workspace)
+        if session is None and attach_job is not None:
+            log.error(f"Job {attach_job} is not queued or running on {hostname}. Exiting.")
+            return
+        if session is None:
+            log.info("No queued or running job of an earlier session found; submitting a new one.")
+        else:
+            session.workspace = workspace or session.workspace
+            if not session.workspace:
+                log.error(f"No workspace given for job {session.job_id}. Exiting.")
                 return
-            else:
-                log.info(f"Job script found on {hostname_expanded}.")
-                # mark progress as complete
-                progress.update(task1, completed=True)
-
-        progress.remove_task(
-            task1
-        )  # prevent showing task twice in CLI output when we re-use `progress` object
-    elif job_script_location == "local":
-        # TODO: validate job script? 
-        # read job script 
-        if show_job_file:
-            from rich.syntax import Syntax
-            with open(job_script, "r") as f:
-                syntax = Syntax(f.read(), "bash", line_numbers=True)
-            
-            console.print(syntax)
+            sessions.save(session)
+            if session.node is not None:
+                log.success(f"Attached to job {session.job_id} on node {session.node}.")
+                _launch_vscode(
+                    hostname, session.node, [Path(p) for p in session.workspace], verbose
+                )
+                if killswitch:
+                    _killswitch(server, sessions, session.job_id)
+                return
+            log.success(f"Attached to job {session.job_id}, which has not started yet.")
+    if session is None:
+        if job_script_location == "remote":
+            with progress:
+                task1 = progress.add_task(
+                    f"Checking job script on [bold][white]{hostname_expanded}[/white][/bold] exists... ",
+                    total=1,
+                )
+                # expand remote path and check it in one remote call
+                log.info(f"Expanding remote path {job_script}")
+                script_info = server.inspect_paths([job_script])[str(job_script)]
+                job_script = Path(script_info["expanded"])
+                log.info(f"--> {job_script}")
+                if not script_info["is_file"]:
+                    log.error(f"Job script {job_script} not found on {hostname_expanded}. Exiting.")
+                    return
+                else:
+                    log.info(f"Job script found on {hostname_expanded}.")
+                    # mark progress as complete
+                    progress.update(task1, completed=True)
 
-    # Expand path 
-    with progress:
-        task = progress.add_task(
-            f"Expanding remote path on [bold][white]{hostname_expanded}[/white][/bold]... ",
-            total=1,
-        )
-        log.info(f"Expanding remote path {remote_path}")
-        remote_path = [
-            server.expand_remote_path(r)
-            for r in remote_path
-        ]
-        log.info(f"--> {remote_path}") 
-        progress.update(task, completed=True)
-    
-    progress.remove_task(task)
-    
+            progress.remove_task(
+                task1
+            )  # prevent showing task twice in CLI output when we re-use `progress` object
+        elif job_script_location == "local":
+            # read job script 
+            if show_job_file:
+                from rich.syntax import Syntax
+                with open(job_script, "r") as f:
+                    syntax = Syntax(f.read(), "bash", line_numbers=True)
+            
+                console.print(syntax)
 
-    # Check directory
-    if skip_check:
-        log.info("Skipping remote path existence check.")
-    else:
+        # Expand path 
         with progress:
-            task1 = progress.add_task(
-                f"Checking that workspace directory on [bold][white]{hostname_expanded}[/white][/bold] exists... ",
+            task = progress.add_task(
+                f"Expanding remote path on [bold][white]{hostname_expanded}[/white][/bold]... ",
                 total=1,
             )
-            checked = []
-            for r in remote_path:
-                if not server.check_dir_exists(r):
+            log.info(f"Expanding remote path {remote_path}")
+            # Expand and check all paths in one remote call
+            path_info = {
+                Path(info["expanded"]): info
+                for info in server.inspect_paths(remote_path).values()
+            }
+            remote_path = list(path_info)
+            log.info(f"--> {remote_path}") 
+            progress.update(task, completed=True)
+    
+        progress.remove_task(task)
+    
+
+        # Check directory
+        if skip_check:
+            log.info("Skipping remote path existence check.")
+        else:
+            with progress:
+                task1 = progress.add_task(
+                    f"Checking that workspace directory on [bold][white]{hostname_expanded}[/white][/bold] exists... ",
+                    total=1,
+                )
+                checked = []
+                for r in remote_path:
+                    if not path_info[r]["is_dir"]:
+                        log.error(
+                            f"Remote path {r} not found on {hostname_expanded}. Continuing..."
+                        )
+                    
+                    else:
+                        log.info(f"Remote path {r} found on {hostname_expanded}.")
+                        # mark progress as complete
+                        progress.update(task1, completed=True)
+                        checked.append(r)
+                if len(checked) == 0:
                     log.error(
-                        f"Remote path {r} not found on {hostname_expanded}. Continuing..."
+                        f"No remote paths found on {hostname_expanded}. Exiting."
                     )
-                    
+                    return
                 else:
-                    log.info(f"Remote path {r} found on {hostname_expanded}.")
-                    # mark progress as complete
-                    progress.update(task1, completed=True)
-                    checked.append(r)
-            if len(checked) == 0:
-                log.error(
-                    f"No remote paths found on {hostname_expanded}. Exiting."
-                )
-                return
-            else:
-                log.info(f"Remote paths found on {hostname_expanded}: {checked}")
+                    log.info(f"Remote paths found on {hostname_expanded}: {checked}")
 
-        progress.remove_task(
-            task1
-        )  # prevent showing task twice in CLI output when we re-use `progress` object
+            progress.remove_task(
+                task1
+            )  # prevent showing task twice in CLI output when we re-use `progress` object
 
-    if dryrun:
-        log.debug("Dry run mode enabled. Won't submit real job.")
+        if dryrun:
+            log.debug("Dry run mode enabled. Won't submit real job.")
 
-    # Submit job to remote server
-    with progress:
-        task2 = progress.add_task(
-            f"Submitting job to [bold][white]{hostname}[/white][/bold]... "
+        # Submit job to remote server
+        with progress:
+            task2 = progress.add_task(
+                f"Submitting job to [bold][white]{hostname}[/white][/bold]... "
+            )
+            if dryrun: time.sleep(1)
+            else:
+                try:
+                    if shapes:
+                        placement = Placement(
+                            server, job_script, job_script_location, overrides, validate
+                        )
+                        prediction, future = placement.submit(shapes, race=race)
+                        log.info(f"Using shape {prediction.shape} ({prediction.source}).")
+                        job_id = future.job_id
+                    else:
+                        job_id = server.submit_job(
+                            job_script,
+                            location=job_script_location,
+                            overrides=overrides,
+                            validate=validate,
+                        )
+                except DirectiveError as e:
+                    log.error(str(e))
+                    return
+
+        progress.remove_task(task2)
+        log.success(f"Job submitted with ID: {job_id}")
+        session = Session(
+            hostname,
+            job_id,
+            workspace=[str(p) for p in remote_path],
+            job_script=str(job_script),
+            script_key=key,
         )
-        if dryrun: time.sleep(1)
-        else: job_id = server.submit_job(job_script, location=job_script_location)
-
-    progress.remove_task(task2)
-    log.success(f"Job submitted with ID: {job_id}")
+        sessions.save(session)
+    else:
+        job_id = session.job_id
+        remote_path = [Path(p) for p in session.workspace]
 
     try:  # Now listen for program exit so we can kill the job if needed
 
@@ -280,7 +441,7 @@ def code(
                 f"", job_status="--", node="--", total=1
             )  # total=1 so we can update and remove
 
-            task7 = None
+            task6 = task7 = None
             while not monitor_job_status.finished:
                 sleep(POLL_INTERVAL)
 
@@ -302,8 +463,11 @@ def code(
                     task6 = progress.add_task(f"Waiting for job to start... ", total=1)
                     progress.update(task4, completed=True)
                     progress.remove_task(task4)  # complete 'waiting'
-                if status == "R" and task6 in progress.task_ids:
-                    progress.remove_task(task6)  # complete 'waiting'
+                # an attached job may be seen running without having been seen queued
+                if status == "R" and not monitor_job_status.finished:
+                    for waiting in (task4, task6):
+                        if waiting in progress.task_ids:
+                            progress.remove_task(waiting)  # complete 'waiting'
                     if node is None:
                         task7 = progress.add_task(
                             f"Waiting for node to be assigned... ", total=1
@@ -324,7 +488,9 @@ def code(
             # monitor_job_status.remove_task(task5)   # complete 'job status'
             info = server.job_info(job_id)
             node = info["node"]
-            log.debug(info)
+            log.opt(lazy=True).debug("{}", lambda: info)
+            session.node = node
+            sessions.save(session)
 
         if skip_check:
             log.info("Skipping GPU check.")
@@ -351,15 +517,7 @@ def code(
             # NOTE: I think it's because we are removing a task from WITHIN the `with progress` block.
 
         # Launch VS code
-        target_name = f"{hostname}-{node}"
-        if verbose:
-            print(f"Launching VScode on {target_name}...")
-        cmd_list = ["code", "--remote", f"ssh-remote+{target_name}"] + remote_path
-        log.debug(f"Command: {cmd_list}")
-        captured = subprocess.run(
-            cmd_list,
-            capture_output=True,
-        )
+        captured = _launch_vscode(hostname, node, remote_path, verbose)
 
     except KeyboardInterrupt:
 
@@ -377,22 +535,17 @@ def code(
         )
         with Live(progress_group, refresh_per_second=10):
             task6 = progress.add_task(f"Killing job {job_id}... ")
-            task7 = monitor_job_status.add_task(
-                f"Job status: ", job_status="--", node="--", total=1
-            )
-            server.kill_job(job_id)
-            while not progress.finished:
-                sleep(POLL_INTERVAL)
-                status = server.get_status(job_id)
-                status_display = f"[r][orange]{JOB_STATUS_DICT.get(status, '-').upper()}[/orange][/r]"
-                progress.update(task7, job_status=status_display)
-                if status == "C":
-                    progress.update(task7, completed=True)
-                    log.info("Job killed.")
+            # qdel, then wait until the shared poller sees the job gone
+            report = server.kill_jobs([job_id])
             progress.update(task6, completed=True)
-            log.info("Job killed.")
         progress.remove_task(task6)
+        if report.refused:
+            log.error(f"Job {job_id} is still in the queue. Check with `pybs stat`.")
+        else:
+            sessions.remove(job_id)
+            log.info("Job killed.")
 
+        log.complete()  # flush queued messages before exiting
         try:
             sys.exit(130)
         except SystemExit:
@@ -400,24 +553,5 @@ def code(
 
     if killswitch:
         # Stay open until Ctrl+C
-        # add check from ck.confirm.
         # If Ctrl+C, kill job
-        try:
-            while (
-                c := ck.prompt(
-                    ck.style(text="Press Ctrl+C to kill job.", fg="red"),
-                    default=None,
-                    hide_input=True,
-                    prompt_suffix="",
-                )
-                != "^C"
-            ):
-                pass
-        except ck.Abort:
-            log.info(f"Caught Ctrl+C")
-            log.info(f"Killing job {job_id}...")
-            server.kill_job(job_id)
-
-            # TODO:
-            # actually display the status of the job using `stat` while it exits.
-            log.info("Job killed.")
+        _killswitch(server, sessions, job_id)
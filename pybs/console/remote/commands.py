@@ -1,8 +1,33 @@
 """PBS commands for remote server."""
 
+import sys
+import math
+import shlex
 import click as ck
 
+from pathlib import Path
+from time import time
+
+from concurrent.futures import TimeoutError
+
+from pybs.constants import (
+    FANOUT_LIMIT,
+    JOB_STATUS_DICT,
+    KILL_TIMEOUT,
+    PBS_SPOOL_DIR,
+    TUNNEL_CHECK_INTERVAL,
+)
 from pybs.server import PBSServer
+from pybs.server.directives import DirectiveError
+from pybs.server.futures import as_completed
+from pybs.server.kill import expand_job_ids
+from pybs.server.accounting import Accounting
+from pybs.server.fanout import FanOut
+from pybs.server.fetch import Fetcher
+from pybs.server.logs import LogFollower
+from pybs.server.placement import Placement, Shape
+from pybs.server.tunnels import TunnelManager
+from pybs.server.workflow import Workflow
 from pybs.console.tabcomplete import complete_hostname
 
 
@@ -34,6 +59,31 @@ def stat(
     ck.echo(stderr)
 
 
+def request_options(func):
+    """Options that override the `#PBS` directives of a job script."""
+    options = [
+        ck.option("--walltime", default=None, help="Walltime, e.g. 2:00:00."),
+        ck.option("--ngpus", type=int, default=None, help="GPUs per chunk."),
+        ck.option("--ncpus", type=int, default=None, help="CPUs per chunk."),
+        ck.option("--mem", default=None, help="Memory per chunk, e.g. 46gb."),
+        ck.option("--queue", default=None, help="Queue to submit to."),
+        ck.option(
+            "--validate/--no-validate",
+            default=True,
+            help="Check the request against the cached queue limits and node inventory.",
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def request_overrides(**kwargs) -> dict:
+    """The overrides given with `request_options`."""
+    keys = ("walltime", "ngpus", "ncpus", "mem", "queue")
+    return {k: kwargs[k] for k in keys if kwargs.get(k) is not None}
+
+
 @ck.command()
 @ck.argument(
     "hostname",
@@ -42,17 +92,741 @@ def stat(
 )
 @ck.argument(
     "job_script",
-    type=ck.STRING,
-    shell_complete=complete_hostname,
+    type=ck.Path(path_type=Path),
 )
 @ck.option("--job-script-location", type=ck.Choice(["local", "remote"]), default=None)
+@request_options
 def sub(
     hostname: str,
-    job_script: str,
+    job_script: Path,
     job_script_location: str,
+    validate: bool,
+    **kwargs,
+):
+    """Submit a job to a remote server.
+
+    The script's `#PBS` directives (and any overrides) are checked before
+    the job is submitted.
+    """
+    if job_script_location is None:
+        job_script_location = "local" if job_script.is_file() else "remote"
+    server = PBSServer(hostname, verbose=False)
+    try:
+        job_id = server.submit_job(
+            job_script,
+            location=job_script_location,
+            overrides=request_overrides(**kwargs),
+            validate=validate,
+        )
+    except DirectiveError as e:
+        raise ck.ClickException(str(e))
+    ck.echo(job_id)
+
+
+@ck.command()
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.argument(
+    "job_ids",
+    nargs=-1,
+    required=True,
+    type=ck.STRING,
+)
+@ck.option(
+    "--timeout",
+    type=float,
+    default=None,
+    help="Give up after this many seconds (exit code 1).",
+)
+@ck.option(
+    "--any",
+    "first_only",
+    is_flag=True,
+    help="Return as soon as any one of the jobs finishes.",
+)
+def wait(
+    hostname: str,
+    job_ids: tuple,
+    timeout: float,
+    first_only: bool,
 ):
-    """Submit a job to a remote server."""
+    """Wait for jobs to finish.
+
+    All jobs are tracked from a single batched `qstat` call per poll.
+    Each job is printed as soon as it finishes.
+    """
+    server = PBSServer(hostname, verbose=False)
+    futures = server.watch_many(job_ids)
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            status = future.result()["status"]
+            ck.echo(f"{future.job_id}\t{JOB_STATUS_DICT.get(status, status)}")
+            if first_only:
+                break
+    except TimeoutError:
+        pending = [f.job_id for f in futures if not f.done()]
+        ck.echo(f"Timed out waiting for jobs: {' '.join(pending)}", err=True)
+        sys.exit(1)
+
+
+@ck.group()
+def workflow():
+    """Submit and track DAGs of dependent jobs.
+
+    A workflow is described by a JSON spec file mapping job names to job
+    scripts and their dependencies.  Job IDs and states are kept in a
+    state file next to the spec.
+    """
+
+
+def _state_path(spec: Path, state: Path) -> Path:
+    return state if state is not None else spec.with_suffix(".state.json")
+
+
+def _workflow_arguments(func):
+    """Arguments shared by the `workflow` subcommands."""
+    func = ck.option(
+        "--state",
+        type=ck.Path(dir_okay=False, path_type=Path),
+        default=None,
+        help="State file to use.  [default: SPEC with a .state.json suffix]",
+    )(func)
+    func = ck.argument(
+        "spec",
+        type=ck.Path(exists=True, dir_okay=False, path_type=Path),
+    )(func)
+    func = ck.argument(
+        "hostname",
+        type=str,
+        shell_complete=complete_hostname,
+    )(func)
+    return func
+
+
+def _echo_states(flow: Workflow):
+    ids = flow.job_ids()
+    for name in flow.order():
+        ck.echo(f"{name}\t{ids.get(name, '--')}\t{flow.states()[name]}")
+
+
+@workflow.command("submit")
+@_workflow_arguments
+def workflow_submit(hostname: str, spec: Path, state: Path):
+    """Submit every job in a workflow in a single remote call."""
+    state = _state_path(spec, state)
+    flow = Workflow.from_spec(spec)
     server = PBSServer(hostname)
-    stdout, stderr = server.sub(job_script, job_script_location)
-    ck.echo(stdout)
-    ck.echo(stderr)
+    try:
+        flow.submit(server)
+    except DirectiveError as e:
+        raise ck.ClickException(str(e))
+    finally:
+        flow.save_state(state)
+    _echo_states(flow)
+
+
+@workflow.command("status")
+@_workflow_arguments
+def workflow_status(hostname: str, spec: Path, state: Path):
+    """Show the state of each job in a workflow."""
+    state = _state_path(spec, state)
+    flow = Workflow.from_spec(spec, state)
+    server = PBSServer(hostname)
+    flow.refresh(server)
+    flow.save_state(state)
+    _echo_states(flow)
+
+
+@workflow.command("retry")
+@_workflow_arguments
+def workflow_retry(hostname: str, spec: Path, state: Path):
+    """Resubmit failed jobs of a workflow and the jobs that depend on them."""
+    state = _state_path(spec, state)
+    flow = Workflow.from_spec(spec, state)
+    server = PBSServer(hostname)
+    flow.refresh(server)
+    try:
+        flow.retry(server)
+    except DirectiveError as e:
+        raise ck.ClickException(str(e))
+    finally:
+        flow.save_state(state)
+    _echo_states(flow)
+
+
+@ck.command()
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.argument(
+    "job_ids",
+    nargs=-1,
+    required=True,
+    type=ck.STRING,
+)
+@ck.option(
+    "--follow/--no-follow",
+    "-f",
+    default=False,
+    help="Keep printing new output until the jobs finish.",
+)
+@ck.option(
+    "--bytes",
+    "-c",
+    "tail",
+    type=int,
+    default=None,
+    help="Start this many bytes before the end of each file.",
+)
+@ck.option(
+    "--interval",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Seconds between checks for new output.",
+)
+@ck.option(
+    "--spool-dir",
+    default=PBS_SPOOL_DIR,
+    show_default=True,
+    help="PBS spool directory on the compute nodes.",
+)
+def logs(
+    hostname: str,
+    job_ids: tuple,
+    follow: bool,
+    tail: int,
+    interval: float,
+    spool_dir: str,
+):
+    """Print the stdout/stderr of jobs.
+
+    Output of running jobs is read from the spool directory on the job's
+    node; output of finished jobs from the job's output paths.  When
+    several files are shown, each line is prefixed with its job ID.
+    """
+    server = PBSServer(hostname, verbose=False)
+    follower = LogFollower(
+        server,
+        follow=follow,
+        tail=tail,
+        interval=interval,
+        spool_dir=spool_dir,
+    )
+    try:
+        follower.add_jobs(job_ids)
+    except ValueError as e:
+        raise ck.ClickException(str(e))
+    try:
+        follower.run()
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+
+@ck.command()
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.argument(
+    "job_ids",
+    nargs=-1,
+    required=True,
+    type=ck.STRING,
+)
+@ck.option(
+    "--dest",
+    "-d",
+    type=ck.Path(file_okay=False, path_type=Path),
+    default=Path("."),
+    show_default=True,
+    help="Local directory to download into; each job gets a subdirectory.",
+)
+@ck.option(
+    "--jobs",
+    "-j",
+    "concurrency",
+    type=int,
+    default=4,
+    show_default=True,
+    help="Maximum number of parallel transfers.",
+)
+@ck.option(
+    "--batch-size",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of job directories packed into each compressed stream.",
+)
+@ck.option(
+    "--include",
+    multiple=True,
+    help="Only fetch files matching this glob pattern (may be repeated).",
+)
+def fetch(
+    hostname: str,
+    job_ids: tuple,
+    dest: Path,
+    concurrency: int,
+    batch_size: int,
+    include: tuple,
+):
+    """Download the output directories of jobs.
+
+    Files already present locally are skipped, so an interrupted fetch can
+    be resumed by running it again.
+    """
+    from rich.progress import Progress, BarColumn, DownloadColumn
+
+    server = PBSServer(hostname, verbose=False)
+    fetcher = Fetcher(
+        server,
+        dest,
+        concurrency=concurrency,
+        batch_size=batch_size,
+        include=include,
+    )
+    try:
+        dirs, needed = fetcher.plan(job_ids)
+    except ValueError as e:
+        raise ck.ClickException(str(e))
+    if not needed:
+        ck.echo("All files are already present.")
+        return
+    n_files = sum(len(entries) for entries in needed.values())
+    n_bytes = sum(size for entries in needed.values() for _, size, _ in entries)
+    with Progress(
+        "[progress.description]{task.description}",
+        BarColumn(),
+        DownloadColumn(),
+    ) as progress:
+        task = progress.add_task(f"Fetching {n_files} files... ", total=n_bytes)
+        try:
+            fetcher.download(
+                dirs,
+                needed,
+                on_file=lambda job_id, rel, size: progress.advance(task, size),
+            )
+        except RuntimeError as e:
+            raise ck.ClickException(f"{e} Run the command again to resume.")
+
+
+@ck.command()
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.option(
+    "--by",
+    type=ck.Choice(["user", "queue"]),
+    default="user",
+    show_default=True,
+    help="Group running jobs by user or by queue.",
+)
+@ck.option(
+    "--requested/--elapsed",
+    default=False,
+    help="Count requested walltime instead of elapsed time.",
+)
+def usage(
+    hostname: str,
+    by: str,
+    requested: bool,
+):
+    """Show GPU hours and job counts of running jobs.
+
+    Requires the `analytics` extra (`pip install "pythonpbs[analytics]"`).
+    """
+    server = PBSServer(hostname, verbose=False)
+    try:
+        table = server.queue_table(full=True)
+    except ImportError as e:
+        raise ck.ClickException(str(e))
+    running = table.filter(state="R")
+    hours = running.gpu_hours(by=by, requested=requested)
+    counts = running.count(by=by)
+    for key in sorted(counts, key=lambda k: -hours.get(k, 0.0)):
+        ck.echo(f"{key}\t{counts[key]}\t{hours.get(key, 0.0):.1f}")
+
+
+def parse_shapes(ctx, param, value) -> list:
+    """Click callback parsing `--shape` options into `Shape`s."""
+    try:
+        return [Shape.parse(spec) for spec in value]
+    except ValueError as e:
+        raise ck.BadParameter(str(e))
+
+
+def _format_wait(wait: float) -> str:
+    if wait is None:
+        return "unknown"
+    return f"{int(wait // 3600)}:{int(wait // 60 % 60):02d}:{int(wait % 60):02d}"
+
+
+@ck.command()
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.argument(
+    "job_script",
+    type=ck.Path(path_type=Path),
+)
+@ck.option("--job-script-location", type=ck.Choice(["local", "remote"]), default=None)
+@ck.option(
+    "--shape",
+    "shapes",
+    multiple=True,
+    required=True,
+    callback=parse_shapes,
+    help="Candidate shape, e.g. queue=gpu,ngpus=2,walltime=4:00:00,gpu_type=A100.  "
+    "May be given several times.",
+)
+@ck.option("--submit", is_flag=True, help="Submit the shape predicted to start soonest.")
+@ck.option(
+    "--race",
+    type=int,
+    default=1,
+    show_default=True,
+    help="With --submit, submit the best N shapes and delete the others once one starts.",
+)
+@request_options
+def place(
+    hostname: str,
+    job_script: Path,
+    job_script_location: str,
+    shapes: list,
+    submit: bool,
+    race: int,
+    validate: bool,
+    **kwargs,
+):
+    """Rank resource shapes for a job script by predicted time to start."""
+    if job_script_location is None:
+        job_script_location = "local" if job_script.is_file() else "remote"
+    server = PBSServer(hostname, verbose=False)
+    placement = Placement(
+        server,
+        job_script,
+        job_script_location,
+        overrides=request_overrides(**kwargs),
+        validate=validate,
+    )
+    try:
+        if not submit:
+            for p in placement.rank(shapes):
+                ck.echo(f"{p.shape}\t{_format_wait(p.wait)}\t{p.source}")
+            return
+        prediction, future = placement.submit(shapes, race=race)
+    except (DirectiveError, RuntimeError) as e:
+        raise ck.ClickException(str(e))
+    except KeyboardInterrupt:
+        sys.exit(130)
+    ck.echo(f"{future.job_id}\t{prediction.shape}\t{future.node or '--'}")
+
+
+@ck.command("exec", context_settings=dict(ignore_unknown_options=True))
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.argument("job_id", type=ck.STRING)
+@ck.argument("command", nargs=-1, required=True, type=ck.UNPROCESSED)
+@ck.option(
+    "--fanout",
+    type=int,
+    default=FANOUT_LIMIT,
+    show_default=True,
+    help="Maximum number of nodes to run on at the same time.",
+)
+@ck.option(
+    "--timeout",
+    type=float,
+    default=None,
+    help="Give up on a node after this many seconds.",
+)
+def exec_(
+    hostname: str,
+    job_id: str,
+    command: tuple,
+    fanout: int,
+    timeout: float,
+):
+    """Run a command on every node of a job, e.g. `pybs exec HOST JOBID -- nvidia-smi`.
+
+    A single COMMAND argument is a shell command line, run as is (as with
+    ssh and pdsh): `-- 'cd $PBS_O_WORKDIR && ls'`.  Several arguments are
+    quoted one by one, so that each reaches the command unchanged.
+
+    Output lines are prefixed with the node they come from.  The exit code
+    is the largest exit code of any node.
+    """
+    server = PBSServer(hostname, verbose=False)
+    try:
+        nodes = server.job_nodes(job_id)
+    except ValueError as e:
+        raise ck.ClickException(str(e))
+    runner = FanOut(server, fanout=fanout, timeout=timeout)
+    try:
+        cmd = command[0] if len(command) == 1 else shlex.join(command)
+        results = runner.run(cmd, nodes)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    failed = [r for r in results.values() if not r.ok]
+    for r in failed:
+        reason = "timed out" if r.timed_out else f"exit code {r.returncode}"
+        ck.echo(f"{r.node}: {reason}", err=True)
+    sys.exit(max((r.returncode for r in results.values()), default=0))
+
+
+@ck.command()
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.argument("job_ids", nargs=-1, type=ck.STRING)
+@ck.option("--owner", default=None, help="Only jobs of this user.  [default: you]")
+@ck.option("--name", default=None, help="Only jobs whose name matches this pattern, e.g. 'sweep-*'.")
+@ck.option(
+    "--state",
+    "states",
+    multiple=True,
+    type=ck.Choice(["Q", "R", "H", "W", "S", "E", "B"]),
+    help="Only jobs in this state.  May be given several times.",
+)
+@ck.option(
+    "--timeout",
+    type=float,
+    default=KILL_TIMEOUT,
+    show_default=True,
+    help="Seconds to wait for the jobs to leave the queue.",
+)
+@ck.option("--force", is_flag=True, help="Force deletion (qdel -W force) of jobs that refuse to die.")
+@ck.option("--no-wait", is_flag=True, help="Do not wait for the jobs to terminate.")
+@ck.option("--dry-run", is_flag=True, help="Only list the jobs that would be killed.")
+def kill(
+    hostname: str,
+    job_ids: tuple,
+    owner: str,
+    name: str,
+    states: tuple,
+    timeout: float,
+    force: bool,
+    no_wait: bool,
+    dry_run: bool,
+):
+    """Kill jobs by ID, ID range (1000-1050, 1234[1-10]) or filter.
+
+    All jobs are deleted with batched `qdel` calls, then tracked from
+    shared queue snapshots until they are gone.  Jobs that are still in
+    the queue after the timeout are listed and the exit code is 1.
+    """
+    filtered = owner is not None or name is not None or states
+    if not job_ids and not filtered:
+        raise ck.UsageError("Give job IDs or at least one of --owner, --name or --state.")
+    server = PBSServer(hostname, verbose=False)
+    if dry_run:
+        selected = expand_job_ids(job_ids)
+        if filtered:
+            selected += server.select_jobs(owner or server.username, name, states)
+        ck.echo("\n".join(dict.fromkeys(selected)))
+        return
+    report = server.kill_jobs(
+        job_ids,
+        owner=owner,
+        name=name,
+        states=states,
+        wait=not no_wait,
+        timeout=timeout,
+        force=force,
+    )
+    ck.echo(
+        f"Killed {len(report.killed)}, already gone {len(report.unknown)}, "
+        f"refused {len(report.refused)}" + ("" if not no_wait else f", sent {len(report.sent)}")
+    )
+    if report.refused:
+        ck.echo(" ".join(report.refused), err=True)
+        sys.exit(1)
+
+
+def parse_ports(ctx, param, value) -> list:
+    """Click callback parsing `--port REMOTE[:LOCAL]` options."""
+    ports = []
+    for spec in value:
+        remote, _, local = spec.partition(":")
+        try:
+            ports.append((int(remote), int(local) if local else None))
+        except ValueError:
+            raise ck.BadParameter(f"Invalid port {spec!r}: expected REMOTE[:LOCAL].")
+    return ports
+
+
+@ck.command()
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.argument("job_id", type=ck.STRING)
+@ck.option(
+    "--port",
+    "-p",
+    "ports",
+    multiple=True,
+    callback=parse_ports,
+    help="Port on the node to forward, as REMOTE[:LOCAL].  May be given several times.",
+)
+@ck.option(
+    "--jupyter/--no-jupyter",
+    default=True,
+    show_default=True,
+    help="Forward the ports of Jupyter servers running on the node.",
+)
+@ck.option(
+    "--interval",
+    type=float,
+    default=TUNNEL_CHECK_INTERVAL,
+    show_default=True,
+    help="Seconds between connection checks and Jupyter discovery.",
+)
+def tunnel(hostname: str, job_id: str, ports: list, jupyter: bool, interval: float):
+    """Forward ports to the node of a running job until it ends.
+
+    All forwards share one ssh connection through the login node, which is
+    re-established if it drops.  Jupyter servers started on the node are
+    forwarded as they appear.
+    """
+    server = PBSServer(hostname, verbose=False)
+    manager = TunnelManager(server, job_id, ports=ports, jupyter=jupyter, interval=interval)
+    try:
+        manager.run()
+    except ValueError as e:
+        raise ck.ClickException(str(e))
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+
+@ck.command("env")
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.option("--refresh", is_flag=True, help="Capture the environment again.")
+def env(hostname: str, refresh: bool):
+    """Show the login node's environment used to expand remote paths.
+
+    It is captured once and cached locally, so `~` and `$VARS` in remote
+    paths are expanded without a remote call.  It is captured again after
+    a week, when the login node reports a change, or with --refresh.
+    """
+    server = PBSServer(hostname, verbose=False)
+    environment = server.environment(refresh=refresh)
+    for name, value in sorted(environment.variables.items()):
+        ck.echo(f"{name}={value}")
+    age = (time() - environment.fetched_at) / 3600
+    ck.echo(f"Captured {age:.1f} hours ago (fingerprint {environment.fingerprint}).", err=True)
+
+
+@ck.group()
+def accounting():
+    """Efficiency of finished jobs: requested vs. used resources.
+
+    Finished jobs are stored locally by `sync`, which only fetches jobs it
+    has not seen before.  Run it regularly, as the server forgets finished
+    jobs after a while.
+    """
+
+
+@accounting.command("sync")
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.option("--owner", default=None, help="Sync jobs of this user.  [default: you]")
+@ck.option("--all-users", is_flag=True, help="Sync the finished jobs of every user.")
+def accounting_sync(hostname: str, owner: str, all_users: bool):
+    """Store the resources used by newly finished jobs."""
+    server = PBSServer(hostname, verbose=False)
+    store = Accounting(server)
+    try:
+        ck.echo(f"Added {store.sync(owner=owner, all_users=all_users)} jobs.")
+    except ValueError as e:
+        raise ck.ClickException(str(e))
+    finally:
+        store.close()
+
+
+@accounting.command("sample")
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.argument("job_ids", nargs=-1, type=ck.STRING)
+def accounting_sample(hostname: str, job_ids: tuple):
+    """Sample the GPU utilisation of running jobs (default: all of yours)."""
+    server = PBSServer(hostname, verbose=False)
+    store = Accounting(server)
+    try:
+        samples = store.sample_gpus(job_ids or None)
+    finally:
+        store.close()
+    for job_id, util in samples.items():
+        ck.echo(f"{job_id}\t{util:.0f}%")
+
+
+def _percent(value: float) -> str:
+    return "--" if value is None else f"{100 * value:.0f}%"
+
+
+@accounting.command("report")
+@ck.argument(
+    "hostname",
+    type=str,
+    shell_complete=complete_hostname,
+)
+@ck.option(
+    "--by",
+    type=ck.Choice(["user", "script"]),
+    default="user",
+    show_default=True,
+    help="Group jobs by user or by job script.",
+)
+@ck.option("--days", type=float, default=None, help="Only jobs that ended in the last N days.")
+def accounting_report(hostname: str, by: str, days: float):
+    """Show efficiency per user or job script, with suggested requests.
+
+    Columns: jobs, GPU hours, walltime / CPU / memory efficiency (used vs.
+    requested), mean GPU utilisation, suggested walltime and memory.
+    """
+    server = PBSServer(hostname, verbose=False)
+    store = Accounting(server)
+    since = None if days is None else time() - days * 86400
+    try:
+        report = store.report(by=by, since=since)
+    finally:
+        store.close()
+    ck.echo(f"{by}\tjobs\tgpu_h\twall\tcpu\tmem\tgpu\tsuggest")
+    for r in report:
+        gpu = "--" if r["gpu_util"] is None else f"{r['gpu_util']:.0f}%"
+        suggest = []
+        if r["suggest_walltime"] is not None:
+            suggest.append(f"walltime={_format_wait(r['suggest_walltime'])}")
+        if r["suggest_mem"] is not None:
+            suggest.append(f"mem={math.ceil(r['suggest_mem'] / 1024**3)}gb")
+        ck.echo(
+            f"{r['key']}\t{r['jobs']}\t{r['gpu_hours']:.1f}\t{_percent(r['walltime'])}\t"
+            f"{_percent(r['cpu'])}\t{_percent(r['mem'])}\t{gpu}\t{','.join(suggest)}"
+        )
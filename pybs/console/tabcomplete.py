@@ -20,7 +20,7 @@ def complete_remote_path(ctx, param, incomplete):
 
     hostname = ctx.params["hostname"]
 
-    server = PBSServer(hostname)
+    server = PBSServer(hostname, verbose=False)
 
     # Generate list of remote paths that match the incomplete string
     # To find that, find the last '/' in the incomplete string
@@ -32,11 +32,11 @@ def complete_remote_path(ctx, param, incomplete):
 
     stdout, stderr = server.ls(f"{partial}*")
 
-    log.debug(f"stdout: {stdout}")
-    log.debug(f"stderr: {stderr}")
+    log.opt(lazy=True).debug("stdout: {}", lambda: stdout)
+    log.opt(lazy=True).debug("stderr: {}", lambda: stderr)
 
     remote_paths = stdout.split("\n")
-    log.debug(f"Remote paths: {remote_paths}")
+    log.opt(lazy=True).debug("Remote paths: {}", lambda: remote_paths)
     return remote_paths
     return [p for p in remote_paths if incomplete in p]
 
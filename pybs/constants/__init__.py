@@ -2,10 +2,28 @@
 
 from pybs import DEFAULT_PBS_SCRIPT_PATH
 POLL_INTERVAL = 0.5
+SNAPSHOT_MAX_AGE = 1.0
+QSTAT_RATE = 2.0
+QSTAT_BURST = 4
+SNAPSHOT_BATCH_SIZE = 500
+PBS_SPOOL_DIR = "/var/spool/pbs/spool"
+LIMITS_CACHE_TTL = 24 * 3600
+ENV_CACHE_TTL = 7 * 24 * 3600
+GPU_TYPE_RESOURCE = "gpu_model"
+
+SSH_TIMEOUT = 60.0
+QSUB_TIMEOUT = 10.0
+SSH_CONNECT_TIMEOUT = 10
+SSH_RETRIES = 2
+SSH_HEDGE_DELAY = 2.0
+FANOUT_LIMIT = 32
+KILL_TIMEOUT = 60.0
+TUNNEL_CHECK_INTERVAL = 5.0
 
 JOB_STATUS_DICT = {
     "C": "Completed",
     "E": "Exiting",
+    "F": "Finished",
     "H": "Held",
     "Q": "Queued",
     "R": "Running",
@@ -13,4 +31,5 @@ JOB_STATUS_DICT = {
     "W": "Waiting",
     "S": "Suspended",
     "B": "Batch",
+    "X": "Expired",
 }
\ No newline at end of file
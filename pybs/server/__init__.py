@@ -1,10 +1,15 @@
 """Module for interacting with the PBS server."""
 
 import subprocess
+import shlex
+import threading
 import os
 
-from functools import partial
-from typing import Tuple
+from contextlib import nullcontext
+from fnmatch import fnmatchcase
+from functools import partial, wraps
+from time import monotonic, sleep
+from typing import Dict, Iterable, List, Tuple
 from pathlib import Path
 from loguru import logger as log
 
@@ -14,6 +19,49 @@ from sshconf import read_ssh_config
 from os.path import expanduser
 
 from pybs import SSH_CONFIG_PATH
+from pybs.constants import (
+    FANOUT_LIMIT,
+    KILL_TIMEOUT,
+    SNAPSHOT_BATCH_SIZE,
+    SNAPSHOT_MAX_AGE,
+    SSH_CONNECT_TIMEOUT,
+    SSH_HEDGE_DELAY,
+    SSH_RETRIES,
+    SSH_TIMEOUT,
+)
+from pybs.server.qstat import (
+    QueueSnapshot,
+    iter_pbsnodes,
+    iter_qstat_full,
+    iter_qstat_table,
+    iter_queued_estimates,
+    parse_qstat_missing,
+    parse_qstat_queues,
+    parse_qstat_table,
+    short_job_id,
+)
+from pybs.server.coordination import Coordinator
+from pybs.server.directives import ResourceRequest, load_request
+from pybs.server.environment import RemoteEnvironment
+from pybs.server.inventory import ClusterLimits
+from pybs.server.helper import SCHEDULER_OPS, HelperError, RemoteHelper
+from pybs.server.stream import RemoteStream
+from pybs.server.table import QueueTable
+from pybs.server.futures import JobFuture, JobPoller, wait as wait_futures
+from pybs.server.kill import KillReport, expand_job_ids, match_jobs
+from pybs.server.fanout import FanOut, NodeResult
+from pybs.server.resilience import (
+    BreakerPopen,
+    CircuitOpenError,
+    SSHCancelledError,
+    SSHError,
+    SSHTimeoutError,
+    backoff_delays,
+    get_breaker,
+)
+
+SSH_CONNECTION_ERROR = 255
+"""Exit status of `ssh` itself failing (as opposed to the remote command)."""
 
 
 class PBSServer:
@@ -25,6 +73,23 @@ class PBSServer:
         The hostname of the remote server.
     print_output : bool
         Whether to print the output of the commands.
+    timeout : float
+        Default deadline in seconds for each remote call.  None disables it.
+    retries : int
+        Number of retries (with jittered backoff) for idempotent queries
+        when SSH fails or times out.
+    hedge_host : str
+        Optional second login node (ssh config alias).  Idempotent queries
+        that have not answered within `hedge_delay` seconds are also sent
+        there, and whichever answers first wins.
+    use_helper : bool
+        Answer queries (job states, path checks, node info) through a small
+        helper script deployed to the login node, batching them into one
+        JSON request per call.  Falls back to plain shell commands if the
+        helper cannot be run.
+    coordinate : bool
+        Share queue snapshots with other pybs processes on this machine and
+        cap their combined `qstat` rate (see `pybs.server.coordination`).
 
     """
 
@@ -33,10 +98,21 @@ class PBSServer:
         remotehost: str,
         print_output: bool = False,
         verbose: bool = True,
+        timeout: float = SSH_TIMEOUT,
+        retries: int = SSH_RETRIES,
+        hedge_host: str = None,
+        hedge_delay: float = SSH_HEDGE_DELAY,
+        use_helper: bool = True,
+        coordinate: bool = True,
     ):
         self.remotehost = remotehost
         self.print_output = print_output
         self.verbose = verbose
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge_host = hedge_host
+        self.hedge_delay = hedge_delay
+        self.use_helper = use_helper
 
         ssh_config_path = Path(expanduser(SSH_CONFIG_PATH))
         assert (
@@ -52,11 +128,20 @@ class PBSServer:
         assert (
             remotehost in hostnames
         ), f"Specified hostname '{remotehost}' not found in ssh config"
+        assert (
+            hedge_host is None or hedge_host in hostnames
+        ), f"Specified hedge hostname '{hedge_host}' not found in ssh config"
         username = c.host(remotehost)["user"]
         self.username = username
         self.remotehost = remotehost
         self.address = c.host(remotehost)["hostname"]
         self.full_remotehost = f"{self.username}@{self.address}"
+        self._poller = None
+        self._helper = None
+        self._environment = None
+        self._coordinator = (
+            Coordinator(remotehost) if coordinate and Coordinator.available else None
+        )
 
         # log info using pretty colours for username
 
@@ -67,12 +152,13 @@ class PBSServer:
     """Decorator for stdout and stderr collection."""
 
     def print_stdout(func):
+        @wraps(func)
         def decorated(self, *args, **kwargs):
-            stdout, stderr = None, None
             try:
                 stdout, stderr = func(self, *args, **kwargs)
             except Exception as e:
-                print(e)
+                log.error(f"{func.__name__} failed: {e}")
+                raise
 
             if self.print_output:
                 print(stdout)
@@ -94,30 +180,264 @@ class PBSServer:
             return info["node"]
         return None
 
-    def ssh_call(self, cmd):
-        cmd = ["ssh", self.remotehost, cmd]
-        status = subprocess.call(cmd)
-        return status
+    def _ssh_args(
+        self,
+        cmd: str,
+        login_node: str = None,
+        target_node: str = None,
+    ) -> List[str]:
+        """Build the `ssh` command line for a remote command."""
+        login_node = self.remotehost if login_node is None else login_node
+        args = ["ssh", "-o", f"ConnectTimeout={SSH_CONNECT_TIMEOUT}"]
+        if target_node is None:
+            return args + [login_node, cmd]
+        return args + ["-J", login_node, f"{self.username}@{target_node}", cmd]
 
-    @print_stdout
-    def ssh_execute(self, cmd):
-        cmd = ["ssh", self.remotehost, cmd]
-        captured = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False
+    def _attempt(
+        self,
+        args: List[str],
+        timeout: float,
+        cancelled: threading.Event = None,
+    ) -> subprocess.CompletedProcess:
+        """Run `ssh` once, draining stdout and stderr concurrently.
+
+        Raises `SSHTimeoutError` if the deadline passes, and `SSHError` if
+        `ssh` itself fails.  The process is killed on timeout or if
+        `cancelled` is set (e.g. because a hedged call already answered).
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        process = subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=False,
         )
-        stdout = captured.stdout.read().decode()
-        stderr = captured.stderr.read().decode()
-        return stdout, stderr
+        while True:
+            wait = 0.1 if cancelled is not None else None
+            if deadline is not None:
+                remaining = max(deadline - monotonic(), 0)
+                wait = remaining if wait is None else min(wait, remaining)
+            try:
+                stdout, stderr = process.communicate(timeout=wait)
+                break
+            except subprocess.TimeoutExpired:
+                expired = deadline is not None and monotonic() >= deadline
+                if expired or (cancelled is not None and cancelled.is_set()):
+                    process.kill()
+                    process.communicate()
+                    if expired:
+                        raise SSHTimeoutError(
+                            f"Remote call to {args[-2]} timed out after {timeout}s"
+                        )
+                    raise SSHCancelledError("Cancelled")
+        if process.returncode == SSH_CONNECTION_ERROR:
+            raise SSHError(stderr.decode(errors="replace").strip() or "SSH failed")
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+    def _attempt_host(self, cmd: str, host: str, target_node, timeout, cancelled=None):
+        """One attempt on one login node, guarded by the circuit breaker of
+        that host (or of the target node through it)."""
+        args = self._ssh_args(cmd, login_node=host, target_node=target_node)
+        with get_breaker(host, target_node).attempt():
+            return self._attempt(args, timeout, cancelled)
+
+    def _hedged(self, cmd: str, target_node, timeout) -> subprocess.CompletedProcess:
+        """Send the call to the hedge host too if the primary is slow."""
+        results = []
+        errors = []
+        done = threading.Event()
+        cancelled = threading.Event()
+        lock = threading.Lock()
+
+        def run(host):
+            try:
+                result = self._attempt_host(cmd, host, target_node, timeout, cancelled)
+                with lock:
+                    results.append(result)
+                cancelled.set()
+            except BaseException as e:  # re-raised in the calling thread
+                with lock:
+                    errors.append(e)
+            done.set()
+
+        threads = [threading.Thread(target=run, args=(self.remotehost,), daemon=True)]
+        threads[0].start()
+        done.wait(self.hedge_delay)
+        if not results:
+            log.debug(f"Hedging remote call on {self.hedge_host}.")
+            threads.append(
+                threading.Thread(target=run, args=(self.hedge_host,), daemon=True)
+            )
+            threads[1].start()
+            while not results and any(t.is_alive() for t in threads):
+                done.wait(0.1)
+                done.clear()
+        cancelled.set()
+        if results:
+            return results[0]
+        raise errors[-1]
+
+    def _run(
+        self,
+        cmd: str,
+        target_node: str = None,
+        timeout: float = None,
+        idempotent: bool = False,
+    ) -> subprocess.CompletedProcess:
+        """Run a remote command with a deadline.
+
+        Idempotent calls are retried on SSH failures and timeouts, and are
+        hedged across `hedge_host` if one is configured.  Calls to a host
+        whose circuit breaker is open fail immediately with
+        `CircuitOpenError`.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if idempotent else 0
+        delays = backoff_delays(retries)
+        while True:
+            try:
+                if idempotent and self.hedge_host is not None:
+                    return self._hedged(cmd, target_node, timeout)
+                return self._attempt_host(cmd, self.remotehost, target_node, timeout)
+            except CircuitOpenError:
+                raise
+            except SSHError as e:
+                delay = next(delays, None)
+                if delay is None:
+                    raise
+                log.warning(f"Remote call failed ({e}); retrying in {delay:.1f}s.")
+                sleep(delay)
+
+    def ssh_stream(
+        self,
+        cmd: str,
+        target_node: str = None,
+        timeout: float = None,
+    ) -> RemoteStream:
+        """Run a remote command and iterate over its stdout lines as they arrive.
+
+        Unlike `ssh_execute`, the output is never held in memory as a whole
+        (see `stream.py`).  The deadline covers consuming the output too.
+        Streams are guarded by the host's circuit breaker but not retried.
+        """
+        breaker = get_breaker(self.remotehost, target_node)
+        breaker.check()
+        args = self._ssh_args(cmd, target_node=target_node)
+        try:
+            return RemoteStream(args, self.timeout if timeout is None else timeout, breaker)
+        except BaseException:
+            breaker.release()
+            raise
+
+    def stream_query(self, cmd: str, parse, timeout: float = None):
+        """Return `parse(lines)` of a query's streamed output.
+
+        As the parser builds its result from scratch, the whole query is
+        retried on SSH failures and timeouts, like idempotent `_run` calls.
+        Only pass scheduler queries: each attempt is rate-limited (see
+        `_throttled`).
+        """
+        delays = backoff_delays(self.retries)
+        while True:
+            try:
+                with self._throttled(), self.ssh_stream(cmd, timeout=timeout) as lines:
+                    return parse(lines)
+            except CircuitOpenError:
+                raise
+            except SSHError as e:
+                delay = next(delays, None)
+                if delay is None:
+                    raise
+                log.warning(f"Remote call failed ({e}); retrying in {delay:.1f}s.")
+                sleep(delay)
+
+    def scheduler_query(self, cmd: str) -> Tuple[str, str]:
+        """Run a read-only scheduler command (`qstat`, `pbsnodes`, ...) and
+        return its stdout and stderr, rate-limited (see `_throttled`)."""
+        with self._throttled():
+            return self.ssh_execute(cmd, idempotent=True)
+
+    def ssh_call(self, cmd, timeout: float = None, idempotent: bool = True):
+        """Run a remote command and return its exit status."""
+        return self._run(cmd, timeout=timeout, idempotent=idempotent).returncode
 
-    def ssh_jump_execute(self, cmd: str, target_node: str, login_node: str = None):
-        login_node = self.remotehost if login_node is None else login_node
-        cmd = ["ssh", "-J", login_node, f"{self.username}@{target_node}", cmd]
-        captured = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False
-        )
-        stdout = captured.stdout.read().decode()
-        stderr = captured.stderr.read().decode()
-        return stdout, stderr
+    @print_stdout
+    def ssh_execute(
+        self,
+        cmd,
+        timeout: float = None,
+        idempotent: bool = False,
+    ):
+        """Run a remote command and return its stdout and stderr.
+
+        Only pass `idempotent=True` for commands that are safe to run more
+        than once (queries), as these may be retried or hedged.
+        """
+        result = self._run(cmd, timeout=timeout, idempotent=idempotent)
+        return result.stdout.decode(), result.stderr.decode()
+
+    def ssh_popen(
+        self,
+        cmd: str,
+        target_node: str = None,
+        **kwargs,
+    ) -> subprocess.Popen:
+        """Start a remote command without waiting for it to finish.
+
+        The command runs on the login node, or on `target_node` using the
+        login node as a jump host.  Extra keyword arguments are passed to
+        `subprocess.Popen`.  The circuit breaker of the host (or of the
+        target node through it) learns the outcome once the process is
+        waited for.
+        """
+        args = self._ssh_args(cmd, target_node=target_node)
+        kwargs.setdefault("stdin", subprocess.DEVNULL)
+        breaker = get_breaker(self.remotehost, target_node)
+        return BreakerPopen(args, breaker, shell=False, **kwargs)
+
+    def ssh_jump_execute(
+        self,
+        cmd: str,
+        target_node: str,
+        login_node: str = None,
+        timeout: float = None,
+        idempotent: bool = False,
+    ):
+        """Run a command on a compute node, using the login node as a jump host."""
+        if login_node is not None and login_node != self.remotehost:
+            args = self._ssh_args(cmd, login_node=login_node, target_node=target_node)
+            result = self._attempt(args, self.timeout if timeout is None else timeout)
+        else:
+            result = self._run(
+                cmd, target_node=target_node, timeout=timeout, idempotent=idempotent
+            )
+        return result.stdout.decode(), result.stderr.decode()
+
+    def fanout_execute(
+        self,
+        cmd: str,
+        nodes: Iterable[str],
+        fanout: int = FANOUT_LIMIT,
+        timeout: float = None,
+        stream: bool = False,
+    ) -> Dict[str, NodeResult]:
+        """Run a command on many compute nodes concurrently.
+
+        At most `fanout` nodes run at once, each with its own `timeout`.
+        Returns a `NodeResult` per node.  If `stream` is True, output is
+        also printed as it arrives, prefixed with the node name.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        runner = FanOut(self, fanout=fanout, timeout=timeout, stream=stream)
+        return runner.run(cmd, nodes)
+
+    def job_nodes(self, job_id: str) -> List[str]:
+        """Get every node a running job is placed on."""
+        nodes = self.job_info(job_id).get("nodes") or []
+        if not nodes:
+            raise ValueError(f"Job {job_id} has no nodes assigned.")
+        return nodes
 
     @print_stdout
     def check_gpu(
@@ -138,47 +458,156 @@ class PBSServer:
                 raise ValueError("Either node or job_id must be provided.")
             info_dict = self.job_info(job_id)
             node = info_dict["node"]
-        stdout, stderr = self.ssh_jump_execute(cmd, target_node=node)
+        stdout, stderr = self.ssh_jump_execute(cmd, target_node=node, idempotent=True)
         return stdout, stderr
 
+    @property
+    def helper(self) -> RemoteHelper:
+        """The remote helper, or None if disabled."""
+        if not self.use_helper:
+            return None
+        if self._helper is None:
+            self._helper = RemoteHelper(self)
+        return self._helper
+
+    def helper_query(self, queries: List[dict]) -> list:
+        """Run queries through the remote helper in a single call.
+
+        Returns None (and disables the helper for this server) if the
+        helper cannot be used, so callers can fall back to shell commands.
+        """
+        if self.helper is None:
+            return None
+        scheduler = any(q["op"] in SCHEDULER_OPS for q in queries)
+        try:
+            with self._throttled() if scheduler else nullcontext():
+                results = self.helper.query(queries)
+        except HelperError as e:
+            log.warning(f"Remote helper unavailable, using shell commands: {e}")
+            self.use_helper = False
+            return None
+        self._check_environment(self.helper.env_fingerprint)
+        return results
+
+    def _check_environment(self, fingerprint: str):
+        """Drop the cached environment if the login node reports a different one."""
+        environment = self._environment or RemoteEnvironment.load(self.remotehost)
+        if fingerprint is None or environment is None:
+            return
+        if environment.fingerprint != fingerprint:
+            log.info(f"Environment of {self.remotehost} changed; capturing it again.")
+            RemoteEnvironment.invalidate(self.remotehost)
+            self._environment = None
+
+    def environment(self, refresh: bool = False) -> RemoteEnvironment:
+        """Home directory and path variables of the login node, cached locally
+        (see `environment.py`)."""
+        if refresh:
+            self._environment = RemoteEnvironment.fetch(self)
+            self._environment.save(self.remotehost)
+        elif self._environment is None:
+            self._environment = RemoteEnvironment.cached(self)
+        return self._environment
+
+    def inspect_paths(self, paths: Iterable[Path]) -> Dict[str, dict]:
+        """Expand and check several remote paths at once.
+
+        Paths are expanded locally from the cached environment, and checked
+        in one remote call.  Returns a dict keyed by the given path (as a
+        string) with keys `expanded`, `exists`, `is_file` and `is_dir`.
+        """
+        paths = list(paths)
+        for retry in (True, False):
+            expanded = {str(p): self.environment().expand(p) for p in paths}
+            results = self.helper_query([dict(op="paths", paths=sorted(set(expanded.values())))])
+            if results is None or self._environment is not None:
+                break
+            # the environment changed since it was cached: expand again, once
+            if not retry:
+                log.warning(
+                    f"Environment of {self.remotehost} changes between connections; "
+                    "using the paths expanded from the one just captured."
+                )
+        if results is not None:
+            return {path: dict(results[0][e], expanded=e) for path, e in expanded.items()}
+        info = {}
+        for path, e in expanded.items():
+            info[path] = dict(
+                expanded=e,
+                is_file=self._test_remote_path("-f", e),
+                is_dir=self._test_remote_path("-d", e),
+            )
+            info[path]["exists"] = info[path]["is_file"] or info[path]["is_dir"]
+        return info
+
     def expand_remote_path(self, path: Path) -> Path:
-        """Expand a path on the remote server."""
-        cmd = f"echo {path}"
-        stdout, stderr = self.ssh_execute(cmd)
-        return Path(stdout.strip())
-    
+        """Expand `~` and `$VARS` in a remote path (without a remote call)."""
+        return Path(self.environment().expand(path))
 
-    def check_file_exists(
-        self,
-        remote_path: Path,
-    ) -> bool:
-        """Check if a file exists on the remote server."""
-        cmd = f"test -f {remote_path}"
+    def _test_remote_path(self, flag: str, remote_path: Path) -> bool:
+        cmd = f"test {flag} {shlex.quote(str(remote_path))}"
         status = self.ssh_call(cmd)
         if status == 0:
             return True
         if status == 1:
             return False
-        raise Exception(f"SSH: Error checking file existence: {status}")
+        raise Exception(f"SSH: Error checking path {remote_path}: {status}")
+
+    def check_file_exists(
+        self,
+        remote_path: Path,
+    ) -> bool:
+        """Check if a file exists on the remote server."""
+        return self.inspect_paths([remote_path])[str(remote_path)]["is_file"]
 
     def check_dir_exists(
         self,
         remote_path: Path,
     ) -> bool:
         """Check if a directory exists on the remote server."""
-        cmd = f"test -d {remote_path}"
-        status = self.ssh_call(cmd)
-        if status == 0:
-            return True
-        if status == 1:
-            return False
-        raise Exception(f"SSH: Error checking directory existence: {status}")
+        return self.inspect_paths([remote_path])[str(remote_path)]["is_dir"]
+
+    def node_info(self, nodes: Iterable[str] = None) -> Dict[str, dict]:
+        """Get the `pbsnodes` attributes of nodes (default: all nodes)."""
+        nodes = None if nodes is None else list(nodes)
+        results = self.helper_query([dict(op="nodes", nodes=nodes)])
+        if results is not None:
+            return results[0]
+        cmd = "pbsnodes " + (" ".join(shlex.quote(n) for n in nodes) if nodes else "-a")
+        return self.stream_query(cmd, lambda lines: {n["name"]: n for n in iter_pbsnodes(lines)})
+
+    def queue_info(self) -> Dict[str, dict]:
+        """Get the `qstat -Qf` attributes of all queues."""
+        results = self.helper_query([dict(op="queues")])
+        if results is not None:
+            return results[0]
+        stdout, _ = self.scheduler_query("qstat -Qf")
+        return parse_qstat_queues(stdout)
+
+    def queued_estimates(self) -> List[dict]:
+        """Get the scheduler's start time estimates of queued jobs.
+
+        See `qstat.iter_queued_estimates`; `start` is None for jobs that the
+        scheduler has not estimated.
+        """
+        results = self.helper_query([dict(op="estimates")])
+        if results is not None:
+            return results[0]
+        return self.stream_query("qstat -f -i", lambda lines: list(iter_queued_estimates(lines)))
+
+    def cluster_limits(self, refresh: bool = False) -> ClusterLimits:
+        """Queue limits and node inventory, cached locally (see `inventory.py`)."""
+        if refresh:
+            limits = ClusterLimits.fetch(self)
+            limits.save(self.remotehost)
+            return limits
+        return ClusterLimits.cached(self)
 
     @property
     def hostname(self):
         """Get the hostname of the remote server."""
         cmd = "hostname"
-        stdout, stderr = self.ssh_execute(cmd)
+        stdout, stderr = self.ssh_execute(cmd, idempotent=True)
         return stdout, stderr
 
     def stat(
@@ -198,7 +627,7 @@ class PBSServer:
         else:
             cmd = f"qstat -u {username}"
 
-        stdout, stderr = self.ssh_execute(cmd)
+        stdout, stderr = self.scheduler_query(cmd)
         return stdout, stderr
 
     @print_stdout
@@ -223,20 +652,20 @@ class PBSServer:
             cmd += f" {job_id}"
 
         cmd = " ".join([cmd] + arguments)
-        stdout, stderr = self.ssh_execute(cmd)
+        stdout, stderr = self.scheduler_query(cmd)
         return stdout, stderr
 
     @print_stdout
     def pstat(self):
         """Get overview of the compute nodes and list of jobs running on each node."""
         cmd = "pstat"
-        stdout, stderr = self.ssh_execute(cmd)
+        stdout, stderr = self.scheduler_query(cmd)
         return stdout, stderr
 
     @print_stdout
     def pbsnodes(self, node: str):
         cmd = f"pbsnodes {node}"
-        stdout, stderr = self.ssh_execute(cmd)
+        stdout, stderr = self.scheduler_query(cmd)
         return stdout, stderr
 
     def job_info(self, job_id: str):
@@ -258,91 +687,277 @@ class PBSServer:
         job_id, address = parsed[0], parsed[1:]
         return job_id, address
 
-    def qsub(self, job_script: Path):
+    def qsub(self, job_script: Path, options: str = ""):
         """Submit a job to the queue."""
-        cmd = f"qsub {job_script}"
+        cmd = f"qsub {options} {job_script}" if options else f"qsub {job_script}"
         stdout, stderr = self.ssh_execute(cmd)
         return stdout, stderr
     
-    def qsub_stdin(self, job_script: str):
+    def qsub_stdin(self, job_script: str, options: str = ""):
         """Submit a job to the queue using stdin."""
         # Use single quote to escape everything in the heredoc
-        cmd = "qsub << 'EOF'\n" + job_script + "\nEOF"
+        cmd = f"qsub {options} << 'EOF'\n" if options else "qsub << 'EOF'\n"
+        cmd += job_script + "\nEOF"
         stdout, stderr = self.ssh_execute(cmd)
         log.info(f"Submitted `STDIN` job with script:\n{job_script}")
         return stdout, stderr
 
+    def check_request(
+        self,
+        job_script: Path,
+        location: str = "local",
+        overrides: dict = None,
+        validate: bool = True,
+    ) -> ResourceRequest:
+        """Parse a job script's `#PBS` directives and check them before submission.
+
+        Mistakes in the directives (and in `overrides`) are found without
+        any remote call.  If `validate` is True, the request is then checked
+        against the cached queue limits and node inventory.  Raises
+        `DirectiveError` if the job would be rejected.
+        """
+        request = load_request(job_script, location, overrides)
+        request.validate(source=str(job_script))
+        if validate:
+            request.validate(self.cluster_limits(), source=str(job_script))
+        return request
+
     def submit_job(
         self, 
         job_script: Path, 
         location: str = "remote", 
+        overrides: dict = None,
+        validate: bool = True,
     ):
-        """Submit a job to the queue and return the job ID."""
+        """Submit a job to the queue and return the job ID.
+
+        `overrides` (e.g. `dict(walltime="2:00:00", ngpus=2)`) take
+        precedence over the script's `#PBS` directives.  See `check_request`
+        for the checks done before submission.
+        """
+        if location not in ("local", "remote"):
+            raise ValueError(f"Invalid location: {location}")
+        request = self.check_request(job_script, location, overrides, validate)
+        options = request.qsub_args()
         if location == "remote":
-            stdout, stderr = self.qsub(job_script)
-        elif location == "local":
+            stdout, stderr = self.qsub(job_script, options)
+        else:
             # load job_script from local machine
             with open(job_script, "r") as f:
                 job_script = f.read()
-            stdout, stderr = self.qsub_stdin(job_script)
-            log.debug(stdout)
-            log.debug(stderr)
+            stdout, stderr = self.qsub_stdin(job_script, options)
+            log.opt(lazy=True).debug("{}\n{}", lambda: stdout, lambda: stderr)
 
-        else: 
-            raise ValueError(f"Invalid location: {location}")
-        
         job_id, _ = self.parse_job_id(stdout)
         return job_id
 
     def _parse_pstat(
         self,
         job_id: str,
-    ) -> str:
+    ) -> dict:
         """Parse qstat output for a particular job and return the information."""
         if job_id is None:
             raise ValueError("job_id must be provided.")
-        stdout, _ = self.qstat(job_id=job_id)
-        # find job name line
-        lines = stdout.split("\n")
-        for i, line in enumerate(lines):
-            if line.startswith(job_id):
-                break
-
-        if i <= 2:
-            print(stdout)
+        job_id = short_job_id(job_id)
+        snapshot = self.snapshot([job_id])
+        if job_id not in snapshot:
             raise ValueError(f"Job ID {job_id} not found in qstat output.")
-        header = lines[i - 2]
-        info_line = lines[i]
-        node_line = lines[i + 1]
-
-        header = header.replace("Job ID", "Job_ID")  # to avoid splitting on space
-        header = header.split()
-        fields = info_line.split()
-        assert len(fields) == len(
-            header
-        ), f"Parse error: Fields and header mismatch: {len(fields)} vs {len(header)}"
-
-        node_line = node_line.strip()
-        if "/" not in node_line:
-            node_name = node_line.strip()
-            resources = None
+        return snapshot[job_id]
+
+    def snapshot(
+        self,
+        job_ids: Iterable[str] = None,
+        max_age: float = SNAPSHOT_MAX_AGE,
+    ) -> QueueSnapshot:
+        """Get the state of many jobs in a single remote call.
+
+        If `job_ids` is None, the whole queue is returned.  Otherwise the
+        jobs are queried in batches of `SNAPSHOT_BATCH_SIZE`, chained into
+        one SSH command.  Requested jobs that `qstat` reports as unknown or
+        finished are listed in the snapshot's `missing` set.
+
+        States up to `max_age` seconds old may be served from the snapshots
+        shared by other pybs processes instead of querying the server.
+        """
+        if job_ids is not None:
+            job_ids = sorted({short_job_id(j) for j in job_ids})
+            if not job_ids:
+                return QueueSnapshot()
+        if self._coordinator is None:
+            return self._fetch_snapshot(job_ids)
+        return self._coordinator.snapshot(job_ids, max_age, self._fetch_snapshot)
+
+    def _fetch_snapshot(self, job_ids: List[str] = None) -> QueueSnapshot:
+        results = self.helper_query([dict(op="jobs", ids=job_ids)])
+        if results is not None:
+            return QueueSnapshot(results[0]["rows"], results[0]["missing"])
+        if job_ids is None:
+            cmd = "qstat -n"
         else:
-            node_name, resources = node_line.split("/")
+            cmd = self._batched("qstat -n", job_ids)
+        stdout, stderr = self.scheduler_query(cmd)
+        return parse_qstat_table(stdout, stderr)
+
+    def _throttled(self):
+        """Context that rate-limits a scheduler query together with other processes.
+
+        Every query of the PBS server goes through it: `scheduler_query`,
+        `stream_query` and helper queries with a `SCHEDULER_OPS` operation.
+        """
+        if self._coordinator is None:
+            return nullcontext()
+        return self._coordinator.throttled()
+
+    def _batched(self, cmd: str, job_ids: Iterable[str]) -> str:
+        """Chain `cmd` over batches of job IDs into a single shell command."""
+        job_ids = sorted({short_job_id(j) for j in job_ids})
+        batches = [
+            job_ids[i : i + SNAPSHOT_BATCH_SIZE]
+            for i in range(0, len(job_ids), SNAPSHOT_BATCH_SIZE)
+        ]
+        return "; ".join(
+            f"{cmd} " + " ".join(shlex.quote(j) for j in batch) for batch in batches
+        )
+
+    def job_records(
+        self,
+        job_ids: Iterable[str],
+        history: bool = True,
+    ) -> dict:
+        """Get the full `qstat -f` records of many jobs in a single remote call.
 
-        status = fields[header.index("S")]
-        return dict(
-            status=status,
-            node=node_name,
-            resources=resources,
+        If `history` is True, finished jobs are included (`qstat -x`).
+        """
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        cmd = self._batched("qstat -x -f" if history else "qstat -f", job_ids)
+        return self.stream_query(
+            cmd, lambda lines: {r["job_id"]: r for r in iter_qstat_full(lines)}
         )
 
+    def queue_table(self, full: bool = False) -> QueueTable:
+        """Get the whole queue as a columnar `QueueTable` (requires numpy).
+
+        By default this uses `qstat -n`, which has no GPU counts.  With
+        `full=True`, `qstat -f` is used instead: it includes requested GPUs
+        but is more expensive for the PBS server.
+        """
+        if full:
+            return self.stream_query(
+                "qstat -f", lambda lines: QueueTable.from_records(iter_qstat_full(lines))
+            )
+        return self.stream_query(
+            "qstat -n", lambda lines: QueueTable.from_rows(iter_qstat_table(lines))
+        )
+
+    @property
+    def poller(self) -> JobPoller:
+        """The shared poller that resolves this server's job futures."""
+        if self._poller is None:
+            self._poller = JobPoller(self)
+        return self._poller
+
+    def watch(self, job_id: str) -> JobFuture:
+        """Get a future that resolves when the job finishes."""
+        return self.poller.watch(job_id)
+
+    def watch_many(self, job_ids: Iterable[str]) -> List[JobFuture]:
+        """Get futures for several jobs, resolved by the same poller."""
+        return self.poller.watch_many(job_ids)
+
+    def detach(self, future: JobFuture):
+        """Stop waiting for a job's future (see `JobPoller.detach`)."""
+        self.poller.detach(future)
+
+    def submit(
+        self,
+        job_script: Path,
+        location: str = "remote",
+        overrides: dict = None,
+        validate: bool = True,
+    ) -> JobFuture:
+        """Submit a job to the queue and return a future for it."""
+        job_id = self.submit_job(job_script, location, overrides, validate)
+        return self.watch(job_id)
+
     def kill_job(self, job_id: str):
         """Kill a job."""
         cmd = f"qdel {job_id}"
-        stdout, stderr = self.ssh_execute(cmd)
+        stdout, stderr = self.ssh_execute(cmd, idempotent=True)
         return stdout, stderr
 
+    def select_jobs(
+        self,
+        owner: str = None,
+        name: str = None,
+        states: Iterable[str] = None,
+    ) -> List[str]:
+        """IDs of the queued and running jobs matching all the given filters.
+
+        `name` is a shell-style pattern on the job name.  Names that
+        `qstat -a` truncates are checked against the full job records.
+        """
+        job_ids = match_jobs(self.snapshot(), owner, name, states)
+        if name is None or not job_ids:
+            return job_ids
+        records = self.job_records(job_ids, history=False)
+        return [
+            job_id
+            for job_id in job_ids
+            if job_id in records and fnmatchcase(records[job_id].get("Job_Name", ""), name)
+        ]
+
+    def kill_jobs(
+        self,
+        job_ids: Iterable[str] = (),
+        owner: str = None,
+        name: str = None,
+        states: Iterable[str] = None,
+        wait: bool = True,
+        timeout: float = KILL_TIMEOUT,
+        force: bool = False,
+    ) -> KillReport:
+        """Kill many jobs with batched `qdel` calls and confirm they are gone.
+
+        Jobs are given as IDs or ranges (see `kill.expand_job_ids`), and/or
+        selected with `select_jobs` (`owner` defaults to this user when any
+        filter is given).  If `wait` is True, the jobs are then tracked from
+        shared queue snapshots until they leave the queue; with `force`,
+        jobs still there after `timeout` get a `qdel -W force` and another
+        `timeout`.  Jobs that survive are listed as `refused`.
+        """
+        job_ids = expand_job_ids(job_ids)
+        if owner is not None or name is not None or states:
+            owner = self.username if owner is None else owner
+            job_ids += self.select_jobs(owner, name, states)
+        job_ids = list(dict.fromkeys(job_ids))
+        report = KillReport()
+        if not job_ids:
+            return report
+        log.info(f"Killing {len(job_ids)} jobs.")
+        _, stderr = self.ssh_execute(self._batched("qdel", job_ids), idempotent=True)
+        gone = parse_qstat_missing(stderr)
+        report.unknown = [j for j in job_ids if j in gone]
+        report.sent = [j for j in job_ids if j not in gone]
+        if not wait or not report.sent:
+            return report
+        futures = self.watch_many(report.sent)
+        _, pending = wait_futures(futures, timeout=timeout)
+        if pending and force:
+            log.warning(f"{len(pending)} jobs still running: forcing deletion.")
+            ids = [f.job_id for f in pending]
+            self.ssh_execute(self._batched("qdel -W force", ids), idempotent=True)
+            _, pending = wait_futures(pending, timeout=timeout)
+        for future in pending:
+            self.detach(future)
+        report.killed = [f.job_id for f in futures if f not in pending]
+        report.refused = [f.job_id for f in futures if f in pending]
+        if report.refused:
+            log.error(f"{len(report.refused)} jobs refused to die: {' '.join(report.refused)}")
+        return report
+
     def ls(self, path: str = ""):
         cmd = f"ls {path}"
-        stdout, stderr = self.ssh_execute(cmd)
+        stdout, stderr = self.ssh_execute(cmd, idempotent=True)
         return stdout, stderr
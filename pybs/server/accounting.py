@@ -0,0 +1,313 @@
+"""Efficiency accounting of finished jobs.
+
+`Accounting` keeps one row per finished job in a local SQLite database
+(`CACHE_DIR/accounting/<host>.sqlite`): what the job requested (CPUs, GPUs,
+memory, walltime) next to what it used (`resources_used` from
+`qstat -x -f`).  Syncing is incremental: finished jobs are listed with
+`qstat -x` and only jobs that are not stored yet are fetched in full.  As
+the server only keeps a limited job history, sync regularly.
+
+PBS does not record GPU utilisation unless the site adds it (any
+`resources_used` attribute with `gpu` in its name is used).  Otherwise
+`sample_gpus` samples `nvidia-smi` on the nodes of running jobs; on nodes
+shared by several jobs, a sample covers all GPUs of the node.
+
+Reports aggregate jobs per user or per job script and suggest requests
+(walltime and memory) that fit what the jobs actually used.
+"""
+
+import math
+import shlex
+import sqlite3
+
+from time import time
+from typing import Dict, Iterable, List
+from loguru import logger as log
+
+from pybs import CACHE_DIR
+from pybs.constants import SNAPSHOT_BATCH_SIZE
+from pybs.server.directives import VALUE_OPTIONS
+from pybs.server.qstat import (
+    FINISHED_STATES,
+    iter_qstat_table,
+    parse_ctime,
+    parse_duration,
+    parse_size,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    owner TEXT,
+    name TEXT,
+    script TEXT,
+    queue TEXT,
+    exit_status INTEGER,
+    ncpus INTEGER,
+    ngpus INTEGER,
+    mem INTEGER,
+    walltime INTEGER,
+    cput INTEGER,
+    mem_used INTEGER,
+    walltime_used INTEGER,
+    gpu_util REAL,
+    qtime REAL,
+    stime REAL,
+    end_time REAL
+);
+CREATE TABLE IF NOT EXISTS gpu_samples (
+    job_id TEXT,
+    time REAL,
+    util REAL
+);
+CREATE INDEX IF NOT EXISTS gpu_samples_job ON gpu_samples (job_id);
+"""
+
+COLUMNS = (
+    "job_id", "owner", "name", "script", "queue", "exit_status",
+    "ncpus", "ngpus", "mem", "walltime",
+    "cput", "mem_used", "walltime_used", "gpu_util",
+    "qtime", "stime", "end_time",
+)  # fmt: skip
+
+GPU_QUERY = "nvidia-smi --query-gpu=utilization.gpu --format=csv,noheader,nounits"
+HEADROOM = 1.2
+"""Margin added to the observed usage when suggesting requests."""
+
+
+def _int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _positive(value):
+    return value if value is not None and value >= 0 else None
+
+
+def job_script(record: dict) -> str:
+    """Job script a job was submitted with, or its name for `STDIN` jobs."""
+    try:
+        tokens = shlex.split(record.get("Submit_arguments", ""))
+    except ValueError:
+        tokens = []
+    script = None
+    while tokens:
+        token = tokens.pop(0)
+        if token.startswith("-"):
+            if token[:2] in VALUE_OPTIONS and len(token) == 2 and tokens:
+                tokens.pop(0)
+            continue
+        script = token
+    return script or record.get("Job_Name", "")
+
+
+def gpu_utilisation(record: dict):
+    """GPU utilisation (%) recorded by the site in `resources_used`, if any."""
+    for key, value in record.items():
+        if key.startswith("resources_used.") and "gpu" in key and "ngpus" not in key:
+            try:
+                return float(value.rstrip("%"))
+            except ValueError:
+                continue
+    return None
+
+
+def job_row(record: dict) -> dict:
+    """Compact accounting row of a `qstat -x -f` record."""
+    return dict(
+        job_id=record["job_id"],
+        owner=record.get("Job_Owner", "").split("@")[0],
+        name=record.get("Job_Name", ""),
+        script=job_script(record),
+        queue=record.get("queue", ""),
+        exit_status=_int(record.get("Exit_status")),
+        ncpus=_int(record.get("Resource_List.ncpus")),
+        ngpus=_int(record.get("Resource_List.ngpus"), 0),
+        mem=_positive(parse_size(record.get("Resource_List.mem"))),
+        walltime=_positive(parse_duration(record.get("Resource_List.walltime"))),
+        cput=_positive(parse_duration(record.get("resources_used.cput"))),
+        mem_used=_positive(parse_size(record.get("resources_used.mem"))),
+        walltime_used=_positive(parse_duration(record.get("resources_used.walltime"))),
+        gpu_util=gpu_utilisation(record),
+        qtime=parse_ctime(record.get("qtime")),
+        stime=parse_ctime(record.get("stime")),
+        end_time=parse_ctime(record.get("obittime") or record.get("mtime")),
+    )
+
+
+def checked_table(lines, cmd: str) -> List[dict]:
+    """Rows of `qstat -a` output, raising ValueError if there was output
+    but no `Job ID` header (i.e. it was not in the alternate format)."""
+    seen = dict(header=False, output=False)
+
+    def tracked():
+        for line in lines:
+            seen["output"] = seen["output"] or bool(line.strip())
+            seen["header"] = seen["header"] or line.startswith("Job ID")
+            yield line
+
+    rows = list(iter_qstat_table(tracked()))
+    if seen["output"] and not seen["header"]:
+        raise ValueError(f"Unrecognised output of `{cmd}`: no `Job ID` header.")
+    return rows
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)]
+
+
+def _ratio(used: float, requested: float):
+    return used / requested if requested else None
+
+
+class Accounting:
+    """Local store of the resources requested and used by finished jobs.
+
+    Parameters
+    ----------
+    server : PBSServer
+        The server to sync from.
+    path : Path
+        SQLite database to use.  Defaults to one per host in `CACHE_DIR`.
+
+    """
+
+    def __init__(self, server, path=None):
+        self.server = server
+        self.path = path or CACHE_DIR / "accounting" / f"{server.remotehost}.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def known_jobs(self) -> set:
+        return {row[0] for row in self.db.execute("SELECT job_id FROM jobs")}
+
+    def finished_jobs(self, owner: str = None) -> List[str]:
+        """IDs of the finished jobs still in the server's history."""
+        # -a: the alternate format, which `-u` implies; the default differs
+        cmd = "qstat -x -a" + (f" -u {shlex.quote(owner)}" if owner else "")
+        rows = self.server.stream_query(cmd, lambda lines: checked_table(lines, cmd))
+        return [row["job_id"] for row in rows if row["status"] in FINISHED_STATES]
+
+    def sync(self, owner: str = None, all_users: bool = False) -> int:
+        """Store the finished jobs that are new since the last sync.
+
+        Only jobs of `owner` (default: this user) are synced, unless
+        `all_users` is True.  Returns the number of new jobs.
+        """
+        owner = None if all_users else (owner or self.server.username)
+        known = self.known_jobs()
+        new = [j for j in self.finished_jobs(owner) if j not in known]
+        log.info(f"Fetching {len(new)} new finished jobs.")
+        added = 0
+        for i in range(0, len(new), SNAPSHOT_BATCH_SIZE):
+            records = self.server.job_records(new[i : i + SNAPSHOT_BATCH_SIZE])
+            rows = [job_row(r) for r in records.values()]
+            if not rows:
+                continue
+            with self.db:  # commit each batch, so an interrupted sync resumes
+                self.db.executemany(
+                    f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}) "
+                    f"VALUES ({', '.join(':' + c for c in COLUMNS)})",
+                    rows,
+                )
+            added += len(rows)
+        return added
+
+    def sample_gpus(self, job_ids: Iterable[str] = None) -> Dict[str, float]:
+        """Sample the GPU utilisation of running jobs (default: all of yours).
+
+        Returns the mean utilisation (%) of each sampled job.
+        """
+        snapshot = self.server.snapshot(job_ids)
+        running = {
+            job_id: row["nodes"]
+            for job_id, row in snapshot.items()
+            if row["status"] == "R"
+            and row["nodes"]
+            and (job_ids is not None or row.get("Username") == self.server.username[:8])
+        }
+        nodes = {n for job_nodes in running.values() for n in job_nodes}
+        results = self.server.fanout_execute(GPU_QUERY, nodes)
+        node_util = {}
+        for node, result in results.items():
+            values = [float(v) for v in result.stdout if v.strip().replace(".", "").isdigit()]
+            if result.ok and values:
+                node_util[node] = sum(values) / len(values)
+        now = time()
+        samples = {}
+        for job_id, job_nodes in running.items():
+            values = [node_util[n] for n in job_nodes if n in node_util]
+            if values:
+                samples[job_id] = sum(values) / len(values)
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO gpu_samples VALUES (?, ?, ?)",
+                [(job_id, now, util) for job_id, util in samples.items()],
+            )
+        return samples
+
+    def jobs(self, since: float = None) -> List[sqlite3.Row]:
+        """Stored jobs (that ended after `since`), with sampled GPU utilisation
+        filled in where the server did not record it."""
+        return self.db.execute(
+            """
+            SELECT {}, COALESCE(jobs.gpu_util, samples.util) AS gpu_util
+            FROM jobs LEFT JOIN (
+                SELECT job_id, AVG(util) AS util FROM gpu_samples GROUP BY job_id
+            ) AS samples USING (job_id)
+            WHERE COALESCE(end_time, 0) >= ?
+            """.format(", ".join(f"jobs.{c}" for c in COLUMNS if c != "gpu_util")),
+            (since or 0,),
+        ).fetchall()
+
+    def report(self, by: str = "user", since: float = None) -> List[dict]:
+        """Efficiency per user (`by="user"`) or per job script (`by="script"`).
+
+        Efficiencies are used / requested, summed over the group's jobs:
+        `walltime` (elapsed vs. requested), `cpu` (CPU time vs. elapsed
+        times CPUs) and `mem`.  `gpu_util` is the mean utilisation of the
+        jobs for which it is known.  `suggest_walltime` (95th percentile)
+        and `suggest_mem` (maximum) leave `HEADROOM` over what was used.
+        """
+        key = dict(user="owner", script="script")[by]
+        groups = {}
+        for job in self.jobs(since):
+            groups.setdefault(job[key], []).append(job)
+        report = []
+        for name, jobs in groups.items():
+            timed = [j for j in jobs if j["walltime_used"] is not None]
+            cpu = [j for j in timed if j["cput"] is not None and j["ncpus"]]
+            mem = [j for j in jobs if j["mem_used"] is not None and j["mem"]]
+            gpu = [j["gpu_util"] for j in jobs if j["gpu_util"] is not None]
+            report.append(
+                dict(
+                    key=name,
+                    jobs=len(jobs),
+                    gpu_hours=sum(j["ngpus"] * j["walltime_used"] for j in timed) / 3600,
+                    walltime=_ratio(
+                        sum(j["walltime_used"] for j in timed if j["walltime"]),
+                        sum(j["walltime"] for j in timed if j["walltime"]),
+                    ),
+                    cpu=_ratio(
+                        sum(j["cput"] for j in cpu),
+                        sum(j["walltime_used"] * j["ncpus"] for j in cpu),
+                    ),
+                    mem=_ratio(sum(j["mem_used"] for j in mem), sum(j["mem"] for j in mem)),
+                    gpu_util=sum(gpu) / len(gpu) if gpu else None,
+                    suggest_walltime=int(
+                        _percentile([j["walltime_used"] for j in timed], 0.95) * HEADROOM
+                    ) if timed else None,
+                    suggest_mem=int(
+                        max(j["mem_used"] for j in mem) * HEADROOM
+                    ) if mem else None,
+                )
+            )
+        return sorted(report, key=lambda r: -r["gpu_hours"])
@@ -0,0 +1,242 @@
+"""Sharing of queue snapshots between pybs processes, and query rate limiting.
+
+Every pybs process on this machine that queries the same host shares the
+files in `CACHE_DIR/coordination/<host>/`:
+
+- `jobs.json` holds the most recent state of each job asked for by ID,
+  with the time it was seen, and the queries being fetched right now;
+- `queue.json` holds the last whole-queue snapshot, which can be large, so
+  it is only read by callers that ask for the whole queue;
+- `bucket.json` holds a token bucket that caps the rate of scheduler
+  queries to the host across all processes.
+
+Callers say how old an answer they can accept (`max_age`); fresh enough
+answers are served from the shared state without querying the server.
+A process about to fetch marks the query as in flight, and others making
+the same query wait for its result instead of sending it again.  The file
+lock only guards these short reads and writes: it is released while
+waiting for a rate-limit token and during the remote call, and the result
+is merged into the state as it is afterwards.
+
+Jobs are only served from the shared state if they have been seen there:
+a job missing from an older whole-queue snapshot may simply be newer than
+it, so it is always looked up.  A whole-queue snapshot updates only the
+jobs already in `jobs.json`.
+
+NOTE: this relies on `fcntl` file locks, so it is disabled on Windows.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from contextlib import contextmanager
+from time import sleep, time
+from typing import Callable, Iterable
+from loguru import logger as log
+
+from pybs import CACHE_DIR
+from pybs.constants import QSTAT_BURST, QSTAT_RATE
+from pybs.server.qstat import QueueSnapshot
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+KEEP_SECONDS = 3600
+"""Jobs not seen for this long are dropped from the shared state."""
+
+IN_FLIGHT_SECONDS = 300
+"""Queries marked as in flight for longer than this are fetched again."""
+
+_WAIT_INTERVAL = 0.1
+
+
+class Coordinator:
+    """Share queue snapshots of one host between processes and cap query rate.
+
+    Parameters
+    ----------
+    host : str
+        The ssh config alias of the host.
+    rate : float
+        Scheduler queries per second allowed for this host, summed over all
+        pybs processes.
+    burst : int
+        Number of queries that may be made at once after a quiet period.
+
+    """
+
+    available = fcntl is not None
+
+    def __init__(self, host: str, rate: float = QSTAT_RATE, burst: int = QSTAT_BURST):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.directory = CACHE_DIR / "coordination" / host
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.jobs_path = self.directory / "jobs.json"
+        self.queue_path = self.directory / "queue.json"
+        self.bucket_path = self.directory / "bucket.json"
+        self.lock_path = self.directory / "lock"
+
+    @staticmethod
+    def _load(path) -> dict:
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _save(path, data: dict):
+        # write then rename, so that readers never need the lock
+        tmp = path.with_name(f"{path.name}.{os.getpid()}")
+        tmp.write_text(json.dumps(data))
+        tmp.replace(path)
+
+    @contextmanager
+    def locked(self):
+        """Hold the host's state lock (blocking other processes)."""
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _take_token(self) -> float:
+        """Take a token from the bucket, and return how many seconds to wait
+        before using it.  Call with the lock held."""
+        bucket = self._load(self.bucket_path)
+        now = time()
+        tokens = bucket.get("tokens", self.burst)
+        tokens = min(self.burst, tokens + (now - bucket.get("at", now)) * self.rate) - 1
+        self._save(self.bucket_path, dict(tokens=tokens, at=now))
+        return max(0.0, -tokens / self.rate)
+
+    def _wait_for_token(self, delay: float):
+        if delay > 0:
+            log.debug(f"Rate limiting queries to {self.host}: waiting {delay:.1f}s.")
+            sleep(delay)
+
+    @contextmanager
+    def throttled(self):
+        """Wait for a rate-limit token before querying the scheduler."""
+        with self.locked():
+            delay = self._take_token()
+        self._wait_for_token(delay)
+        yield
+
+    def _lookup(self, state: dict, job_ids, max_age: float, now: float) -> QueueSnapshot:
+        """A snapshot from the shared state, or None if it is not fresh enough."""
+        if job_ids is None:
+            taken = state.get("queue_at")
+            if taken is None or now - taken > max_age:
+                return None
+            queue = self._load(self.queue_path)
+            if now - queue.get("at", 0) > max_age:
+                return None
+            return QueueSnapshot(queue["rows"])
+        jobs = state.get("jobs", {})
+        rows, missing = {}, set()
+        for job_id in job_ids:
+            entry = jobs.get(job_id)
+            if entry is None or now - entry["at"] > max_age:
+                return None
+            if entry["row"] is None:
+                missing.add(job_id)
+            else:
+                rows[job_id] = entry["row"]
+        return QueueSnapshot(rows, missing)
+
+    def _store(self, state: dict, job_ids, snapshot: QueueSnapshot, now: float):
+        jobs = {
+            j: e for j, e in state.get("jobs", {}).items() if now - e["at"] < KEEP_SECONDS
+        }
+        if job_ids is None:
+            self._save(self.queue_path, dict(at=now, rows=snapshot))
+            state["queue_at"] = now
+            # jobs seen before but no longer in the queue have left it
+            for job_id, entry in jobs.items():
+                entry.update(at=now, row=snapshot.get(job_id))
+        else:
+            for job_id, row in snapshot.items():
+                jobs[job_id] = dict(at=now, row=row)
+            for job_id in snapshot.missing:
+                jobs[job_id] = dict(at=now, row=None)
+        state["jobs"] = jobs
+
+    @staticmethod
+    def _query_key(job_ids) -> str:
+        if job_ids is None:
+            return "queue"
+        return hashlib.sha1(" ".join(job_ids).encode()).hexdigest()[:12]
+
+    @staticmethod
+    def _in_flight(state: dict, key: str, now: float) -> bool:
+        """Whether another live process is fetching the query `key`."""
+        fetch = state.get("in_flight", {}).get(key)
+        if fetch is None or now - fetch["at"] > IN_FLIGHT_SECONDS:
+            return False
+        if fetch["pid"] == os.getpid() and fetch["thread"] == threading.get_ident():
+            return False
+        try:
+            os.kill(fetch["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _finish(self, key: str, job_ids=None, snapshot: QueueSnapshot = None):
+        """Clear the in-flight mark of a query, storing its result if any."""
+        with self.locked():
+            # merge into the current state: others may have written meanwhile
+            state = self._load(self.jobs_path)
+            if snapshot is not None:
+                self._store(state, job_ids, snapshot, time())
+            state.get("in_flight", {}).pop(key, None)
+            self._save(self.jobs_path, state)
+
+    def snapshot(
+        self,
+        job_ids: Iterable[str],
+        max_age: float,
+        fetch: Callable[..., QueueSnapshot],
+    ) -> QueueSnapshot:
+        """A snapshot no older than `max_age` seconds, calling `fetch(job_ids)`
+        (at most once across processes for the same query) if needed.
+
+        `fetch` should take its rate-limit token itself (see `throttled`).
+        """
+        job_ids = None if job_ids is None else sorted(job_ids)
+        key = self._query_key(job_ids)
+        while True:
+            cached = self._lookup(self._load(self.jobs_path), job_ids, max_age, time())
+            if cached is not None:
+                return cached
+            with self.locked():
+                state = self._load(self.jobs_path)
+                now = time()
+                cached = self._lookup(state, job_ids, max_age, now)
+                if cached is not None:
+                    return cached
+                waiting = self._in_flight(state, key, now)
+                if not waiting:
+                    state.setdefault("in_flight", {})[key] = dict(
+                        pid=os.getpid(), thread=threading.get_ident(), at=now
+                    )
+                    self._save(self.jobs_path, state)
+            if not waiting:
+                break
+            # the same query is being fetched by another process
+            sleep(_WAIT_INTERVAL)
+        try:
+            snapshot = fetch(job_ids)
+        except BaseException:
+            self._finish(key)
+            raise
+        self._finish(key, job_ids, snapshot)
+        return snapshot
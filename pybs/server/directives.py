@@ -0,0 +1,431 @@
+"""Parsing and validation of the `#PBS` directives of job scripts.
+
+`parse_script` turns the `#PBS` header of a job script into a typed
+`ResourceRequest`, e.g. for `pbs_scripts/gpu.pbs`::
+
+    #PBS -l select=1:ncpus=6:ngpus=1:mem=46gb
+    #PBS -l walltime=9:00:00
+
+gives one chunk of 6 CPUs, 1 GPU and 46 GiB, and a walltime of 9 hours.
+Mistakes that `qsub` would reject are collected while parsing, so they can
+be reported without a round trip to the server.  Requests can also be
+checked against a cluster's queue limits and node inventory (see
+`inventory.ClusterLimits`).
+
+Overrides given on the command line (walltime, GPUs, ...) are merged into
+the request and passed to `qsub` as options, which take precedence over
+the directives in the script.
+"""
+
+import hashlib
+import re
+import shlex
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from pybs.server.qstat import parse_size
+
+PARSE_CACHE_SIZE = 256
+"""Number of parsed scripts kept in memory, keyed by script hash."""
+
+FLAG_OPTIONS = ("-f", "-h", "-I", "-V", "-X", "-z")
+"""`qsub` options without a value."""
+
+VALUE_OPTIONS = (
+    "-A", "-a", "-c", "-e", "-J", "-j", "-k", "-l", "-M", "-m",
+    "-N", "-o", "-P", "-p", "-q", "-R", "-r", "-S", "-u", "-v", "-W",
+)  # fmt: skip
+"""`qsub` options that take a value."""
+
+INT_RESOURCES = ("ncpus", "ngpus", "mpiprocs", "ompthreads", "nodect")
+SIZE_RESOURCES = ("mem", "vmem", "pmem", "pvmem")
+DURATION_RESOURCES = ("walltime", "cput", "pcput", "soft_walltime")
+
+_OPTION_PATTERNS = {
+    "-j": (r"^(oe|eo|n)$", "must be one of oe, eo or n"),
+    "-m": (r"^(n|[abej]+)$", "must be n or a combination of a, b, e and j"),
+    "-k": (r"^[oedn]+$", "must be a combination of o, e, d and n"),
+    "-r": (r"^[yn]$", "must be y or n"),
+    "-J": (r"^\d+-\d+(:\d+)?(%\d+)?$", "must be a range such as 1-10 or 1-10:2"),
+    "-W": (r"^\w+=.+$", "must be of the form attribute=value"),
+}
+_DURATION_PATTERN = re.compile(r"^\d+(:\d+){0,2}(\.\d+)?$")
+
+
+class DirectiveError(ValueError):
+    """A job script has invalid `#PBS` directives or cannot run on the cluster."""
+
+    def __init__(self, issues: List[str], source: str = None):
+        self.issues = list(issues)
+        self.source = source
+        where = f" in {source}" if source else ""
+        super().__init__(
+            f"Invalid job request{where}:\n" + "\n".join(f"  {i}" for i in self.issues)
+        )
+
+
+def parse_walltime(value: str) -> Optional[int]:
+    """Convert a PBS duration (`[[HH:]MM:]SS`) to seconds, or None if invalid.
+
+    NOTE: unlike `qstat.parse_duration`, which reads `qstat -a` columns,
+    two fields are minutes and seconds here, as in `qsub -l walltime=`.
+    """
+    value = (value or "").strip()
+    if not _DURATION_PATTERN.match(value):
+        return None
+    seconds = 0
+    for part in value.split(":"):
+        seconds = seconds * 60 + int(float(part))
+    return seconds
+
+
+def resource_value(key: str, value: str):
+    """Typed value of a resource: seconds, bytes or an int (None if invalid).
+
+    Resources of unknown type are returned as strings.
+    """
+    if key in DURATION_RESOURCES:
+        return parse_walltime(value)
+    if key in SIZE_RESOURCES:
+        size = parse_size(value)
+        return None if size < 0 else size
+    if key in INT_RESOURCES:
+        return int(value) if value.isdigit() else None
+    return value
+
+
+def _resource_issue(key: str, value: str) -> Optional[str]:
+    if not value:
+        return f"resource {key} has no value"
+    if resource_value(key, value) is None:
+        if key in DURATION_RESOURCES:
+            return f"{key}={value} is not a duration of the form [[HH:]MM:]SS"
+        if key in SIZE_RESOURCES:
+            return f"{key}={value} is not a size such as 46gb"
+        return f"{key}={value} is not a non-negative integer"
+    return None
+
+
+@dataclass(frozen=True)
+class Directive:
+    """One `qsub` option from a `#PBS` line (line 0 for overrides)."""
+
+    line: int
+    option: str
+    value: Optional[str] = None
+
+    def args(self) -> List[str]:
+        return [self.option] if self.value is None else [self.option, self.value]
+
+    def __str__(self):
+        return " ".join(shlex.quote(a) for a in self.args())
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """One chunk of a `select` statement, e.g. `1:ncpus=6:ngpus=1:mem=46gb`."""
+
+    count: int = 1
+    resources: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, spec: str) -> Tuple["Chunk", List[str]]:
+        """Parse a chunk and return it with the problems found in it."""
+        issues = []
+        parts = spec.split(":")
+        count = 1
+        if parts and "=" not in parts[0]:
+            head = parts.pop(0)
+            if head.isdigit() and int(head) > 0:
+                count = int(head)
+            else:
+                issues.append(f"chunk count {head!r} in select={spec} is not a positive integer")
+        resources = {}
+        for part in parts:
+            key, _, value = part.partition("=")
+            issue = _resource_issue(key, value)
+            if issue:
+                issues.append(issue)
+            resources[key] = value
+        return cls(count, resources), issues
+
+    def get(self, key: str, default=0):
+        """Typed value of a resource of this chunk."""
+        value = resource_value(key, self.resources[key]) if key in self.resources else None
+        return default if value is None else value
+
+    def __str__(self):
+        return ":".join([str(self.count)] + [f"{k}={v}" for k, v in self.resources.items()])
+
+
+@dataclass(frozen=True)
+class ResourceRequest:
+    """The resources and options requested by a job script.
+
+    Parameters
+    ----------
+    directives : tuple of Directive
+        All options in the order given; later ones take precedence.
+    select : tuple of Chunk
+        Chunks of the last `-l select=` statement.
+    resources : dict
+        Other `-l` resources (e.g. `walltime`) as strings.
+    options : dict
+        Last value of each other option (None for flags).
+    issues : tuple of str
+        Problems found while parsing, which `qsub` would reject.
+
+    """
+
+    directives: Tuple[Directive, ...] = ()
+    select: Tuple[Chunk, ...] = ()
+    resources: Dict[str, str] = field(default_factory=dict)
+    options: Dict[str, Optional[str]] = field(default_factory=dict)
+    issues: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_directives(
+        cls,
+        directives: List[Directive],
+        issues: List[str] = (),
+    ) -> "ResourceRequest":
+        """Build a request, checking the value of each directive.
+
+        `issues` are problems already found in the script (e.g. unknown
+        options); all issues are kept in line order.
+        """
+        select, resources, options, issues = (), {}, {}, list(issues)
+
+        def issue(directive, message):
+            # e.g. a bad chunk in the script is not reported again when
+            # the select statement is overridden
+            if any(i.endswith(f": {message}") for i in issues):
+                return
+            where = f"line {directive.line}" if directive.line else "override"
+            issues.append(f"{where}: {message}")
+
+        for d in directives:
+            if d.option == "-l":
+                for item in d.value.split(","):
+                    key, _, value = item.partition("=")
+                    if key != "select":
+                        message = _resource_issue(key, value)
+                        if message:
+                            issue(d, message)
+                        resources[key] = value
+                        continue
+                    chunks = []
+                    for spec in value.split("+"):
+                        chunk, chunk_issues = Chunk.parse(spec)
+                        chunks.append(chunk)
+                        for message in chunk_issues:
+                            issue(d, message)
+                    select = tuple(chunks)
+                continue
+            if d.option == "-I":
+                issue(d, "interactive jobs (-I) cannot be submitted without a TTY")
+            pattern = _OPTION_PATTERNS.get(d.option)
+            if pattern and not re.match(pattern[0], d.value):
+                issue(d, f"{d.option} {d.value}: {pattern[1]}")
+            options[d.option] = d.value
+        issues = sorted(dict.fromkeys(issues), key=_issue_line)
+        return cls(tuple(directives), select, resources, options, tuple(issues))
+
+    @property
+    def queue(self) -> Optional[str]:
+        return self.options.get("-q")
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.options.get("-N")
+
+    @property
+    def walltime(self) -> Optional[int]:
+        """Requested walltime in seconds, or None."""
+        return resource_value("walltime", self.resources.get("walltime", ""))
+
+    def total(self, key: str) -> Optional[int]:
+        """Total of a numeric resource over all chunks (or job-wide), or None."""
+        if key == "nodect":
+            return sum(c.count for c in self.select) or None
+        if any(key in c.resources for c in self.select):
+            return sum(c.count * c.get(key) for c in self.select)
+        if key in self.resources:
+            return resource_value(key, self.resources[key])
+        return None
+
+    def totals(self) -> Dict[str, int]:
+        """Known totals of the resources that queues usually limit."""
+        totals = dict(walltime=self.walltime)
+        for key in ("ncpus", "ngpus", "mem", "nodect"):
+            totals[key] = self.total(key)
+        return {k: v for k, v in totals.items() if v is not None}
+
+    def merge(
+        self,
+        walltime: str = None,
+        ncpus: int = None,
+        ngpus: int = None,
+        mem: str = None,
+        queue: str = None,
+        **resources,
+    ) -> "ResourceRequest":
+        """A new request with overrides applied on top of this one.
+
+        CPU, GPU and memory overrides, and any other `resources` (e.g.
+        `gpu_model="A100"`), apply to every chunk of the select statement
+        (a single chunk is created if there is none).
+        """
+        overrides = []
+        if walltime is not None:
+            overrides.append(Directive(0, "-l", f"walltime={walltime}"))
+        chunk_overrides = {
+            k: str(v)
+            for k, v in dict(ncpus=ncpus, ngpus=ngpus, mem=mem, **resources).items()
+            if v is not None
+        }
+        if chunk_overrides:
+            chunks = self.select or (Chunk(),)
+            select = "+".join(
+                str(Chunk(c.count, {**c.resources, **chunk_overrides})) for c in chunks
+            )
+            overrides.append(Directive(0, "-l", f"select={select}"))
+        if queue is not None:
+            overrides.append(Directive(0, "-q", queue))
+        if not overrides:
+            return self
+        return ResourceRequest.from_directives(
+            list(self.directives) + overrides, self.issues
+        )
+
+    @property
+    def overrides(self) -> Tuple[Directive, ...]:
+        """Options that were merged in rather than read from the script."""
+        return tuple(d for d in self.directives if d.line == 0)
+
+    def qsub_args(self) -> str:
+        """The overrides as (quoted) `qsub` command line options.
+
+        Only the last override of each option (or `-l` resource) is kept.
+        """
+        last = {}
+        for d in self.overrides:
+            key = (d.option, d.value.split("=")[0] if d.option == "-l" else None)
+            last.pop(key, None)
+            last[key] = d
+        return " ".join(str(d) for d in last.values())
+
+    def validate(self, limits=None, source: str = None):
+        """Raise `DirectiveError` if `qsub` would reject this request.
+
+        If `limits` (an `inventory.ClusterLimits`) is given, the request is
+        also checked against the queue limits and node inventory.
+        """
+        issues = list(self.issues)
+        if limits is not None and not issues:
+            issues += limits.check(self)
+        if issues:
+            raise DirectiveError(issues, source)
+
+
+def script_digest(text: str) -> str:
+    """Short content hash of a job script."""
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def iter_directives(text: str):
+    """Yield `(line, directive, issue)` for each option in a script's header.
+
+    Like `qsub`, this stops at the first line that is neither blank nor a
+    comment.  Options that cannot be parsed (unknown, or missing a value)
+    are yielded with `directive` None and a description in `issue`.
+    """
+    for number, line in enumerate(text.splitlines(), start=1):
+        stripped = line.strip()
+        if not stripped.startswith("#"):
+            if stripped:
+                return
+            continue
+        if not stripped.startswith("#PBS"):
+            continue
+        try:
+            tokens = shlex.split(stripped[len("#PBS") :], comments=True)
+        except ValueError as e:
+            yield number, None, f"cannot parse {stripped!r}: {e}"
+            continue
+        while tokens:
+            token = tokens.pop(0)
+            option, value = token[:2], token[2:] or None
+            if option in FLAG_OPTIONS and value is None:
+                yield number, Directive(number, option), None
+            elif option in VALUE_OPTIONS:
+                if value is None and tokens:
+                    value = tokens.pop(0)
+                if value is None:
+                    yield number, None, f"option {option} has no value"
+                else:
+                    yield number, Directive(number, option, value), None
+            else:
+                yield number, None, f"unknown option {token!r}"
+                break
+
+
+def _issue_line(issue: str) -> float:
+    match = re.match(r"^line (\d+):", issue)
+    return int(match.group(1)) if match else float("inf")
+
+
+def _parse(text: str) -> ResourceRequest:
+    directives, issues = [], []
+    for number, directive, issue in iter_directives(text):
+        if directive is None:
+            issues.append(f"line {number}: {issue}")
+        else:
+            directives.append(directive)
+    return ResourceRequest.from_directives(directives, issues)
+
+
+_parsed: "OrderedDict[str, ResourceRequest]" = OrderedDict()
+
+
+def parse_script(text: str) -> ResourceRequest:
+    """Parse the `#PBS` header of a job script.
+
+    Results are cached by script hash, so submitting the same script many
+    times parses it once.  Requests are immutable, so cached ones are
+    shared.
+    """
+    digest = script_digest(text)
+    request = _parsed.get(digest)
+    if request is None:
+        request = _parsed[digest] = _parse(text)
+        if len(_parsed) > PARSE_CACHE_SIZE:
+            _parsed.popitem(last=False)
+    else:
+        _parsed.move_to_end(digest)
+    return request
+
+
+def load_request(
+    job_script: Path,
+    location: str = "local",
+    overrides: dict = None,
+) -> ResourceRequest:
+    """Parse a job script and merge `overrides` into it.
+
+    Remote scripts are not read, so only overrides of the walltime and
+    queue (which do not depend on the script's own directives) are allowed.
+    """
+    overrides = {k: v for k, v in (overrides or {}).items() if v is not None}
+    if location == "local":
+        return parse_script(Path(job_script).read_text()).merge(**overrides)
+    unsupported = set(overrides) - {"walltime", "queue"}
+    if unsupported:
+        raise DirectiveError(
+            [f"cannot override {', '.join(sorted(unsupported))} of a remote job script"],
+            str(job_script),
+        )
+    return ResourceRequest().merge(**overrides)
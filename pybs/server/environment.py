@@ -0,0 +1,134 @@
+"""The login node's environment, cached locally for expanding remote paths.
+
+Remote paths such as `~/project` or `$SCRATCH/data` used to be expanded by
+running `echo <path>` over SSH, once per path and launch, which also
+applied the remote shell's globbing and command substitution to user
+input.  Instead, the home directory and the path-valued variables of the
+login node are captured once per host (see
+`remote_helper.select_variables`) and kept in
+`CACHE_DIR/environment/<host>.json` for `ENV_CACHE_TTL` seconds.  Paths
+are then expanded locally, with no network call: only `~` and `$VAR` /
+`${VAR}` are replaced, and unknown variables are left as they are.
+
+Every response of the remote helper carries the fingerprint of the
+environment, so a changed environment is noticed (and captured again) the
+next time the helper is used.  `pybs env --refresh` captures it on demand.
+"""
+
+import json
+import re
+
+from time import time
+from typing import Dict
+from loguru import logger as log
+
+from pybs import CACHE_DIR
+from pybs.constants import ENV_CACHE_TTL
+from pybs.server.remote_helper import env_fingerprint, select_variables
+
+ROOT_VARIABLES = ("SCRATCH", "PROJECT", "WORK", "DATA", "TMPDIR")
+"""Variables that commonly point to a site's storage roots."""
+
+_VARIABLE = re.compile(r"\$(?:\{(\w+)\}|(\w+))")
+_NAME = re.compile(r"^[A-Za-z_]\w*$")
+
+
+def parse_env(stdout: str) -> Dict[str, str]:
+    """Parse `env` output into a dict (multi-line values are dropped)."""
+    environ = {}
+    for line in (stdout or "").splitlines():
+        name, sep, value = line.partition("=")
+        if sep and _NAME.match(name):
+            environ[name] = value
+    return environ
+
+
+class RemoteEnvironment:
+    """Home directory and path variables of a login node.
+
+    Parameters
+    ----------
+    variables : dict
+        Selected environment variables (see `remote_helper.select_variables`).
+    fingerprint : str
+        Fingerprint of `variables`, as reported by the remote helper.
+    fetched_at : float
+        When the environment was captured (seconds since the epoch).
+
+    """
+
+    def __init__(self, variables: Dict[str, str], fingerprint: str = None, fetched_at: float = None):
+        self.variables = variables
+        self.fingerprint = fingerprint or env_fingerprint(variables)
+        self.fetched_at = time() if fetched_at is None else fetched_at
+
+    @property
+    def home(self) -> str:
+        return self.variables.get("HOME", "")
+
+    @property
+    def roots(self) -> Dict[str, str]:
+        """Storage roots defined on the login node (see `ROOT_VARIABLES`)."""
+        return {name: self.variables[name] for name in ROOT_VARIABLES if name in self.variables}
+
+    def expand(self, path) -> str:
+        """Expand `~` and `$VAR` in a remote path, without a shell."""
+        path = str(path)
+        if self.home and (path == "~" or path.startswith("~/")):
+            path = self.home + path[1:]
+        return _VARIABLE.sub(
+            lambda m: self.variables.get(m.group(1) or m.group(2), m.group(0)), path
+        )
+
+    @staticmethod
+    def cache_path(host: str):
+        return CACHE_DIR / "environment" / f"{host}.json"
+
+    @classmethod
+    def fetch(cls, server) -> "RemoteEnvironment":
+        """Capture the environment of a server's login node."""
+        results = server.helper_query([dict(op="env")])
+        if results is not None:
+            return cls(results[0]["variables"], results[0]["fingerprint"])
+        stdout, _ = server.ssh_execute("env", idempotent=True)
+        return cls(select_variables(parse_env(stdout)))
+
+    @classmethod
+    def load(cls, host: str, max_age: float = ENV_CACHE_TTL) -> "RemoteEnvironment":
+        """Cached environment of a host, or None if missing or older than `max_age`."""
+        try:
+            data = json.loads(cls.cache_path(host).read_text())
+        except (OSError, ValueError):
+            return None
+        if time() - data["fetched_at"] > max_age:
+            return None
+        return cls(data["variables"], data["fingerprint"], data["fetched_at"])
+
+    def save(self, host: str):
+        path = self.cache_path(host)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps(
+                dict(
+                    variables=self.variables,
+                    fingerprint=self.fingerprint,
+                    fetched_at=self.fetched_at,
+                )
+            )
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def invalidate(cls, host: str):
+        cls.cache_path(host).unlink(missing_ok=True)
+
+    @classmethod
+    def cached(cls, server, max_age: float = ENV_CACHE_TTL) -> "RemoteEnvironment":
+        """Cached environment of a server, captured again once it is too old."""
+        environment = cls.load(server.remotehost, max_age)
+        if environment is None:
+            log.debug(f"Capturing the environment of {server.remotehost}.")
+            environment = cls.fetch(server)
+            environment.save(server.remotehost)
+        return environment
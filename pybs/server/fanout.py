@@ -0,0 +1,146 @@
+"""Run a command on every node of a job at once.
+
+Like `pdsh`, `FanOut` runs one command concurrently on many compute nodes
+(each over a jump connection through the login node), at most `fanout` at a
+time, and streams their output line by line prefixed with the node name.
+Each node has its own deadline, so a hanging node only delays its own
+result, and its own circuit breaker, so nodes that are down do not stop
+calls to the other nodes (or to the login node).
+"""
+
+import subprocess
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List
+from loguru import logger as log
+
+from pybs.constants import FANOUT_LIMIT
+from pybs.server.resilience import SSHError
+
+TIMED_OUT = 124
+"""Exit status reported for nodes that did not finish in time (as `timeout`)."""
+
+_READER_JOIN_TIMEOUT = 2.0
+
+
+@dataclass
+class NodeResult:
+    """Outcome of a command on one node.
+
+    `returncode` is the command's exit status, 255 if ssh failed, or
+    `TIMED_OUT` if the node did not finish within its deadline.
+    """
+
+    node: str
+    returncode: int = None
+    stdout: List[str] = field(default_factory=list)
+    stderr: List[str] = field(default_factory=list)
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+class FanOut:
+    """Run commands on many nodes concurrently, streaming prefixed output.
+
+    Parameters
+    ----------
+    server : PBSServer
+        The server whose login node is used as the jump host.
+    fanout : int
+        Maximum number of nodes to run on at the same time.
+    timeout : float
+        Deadline in seconds for each node.  None waits forever.
+    out, err : file
+        Where to write the prefixed stdout and stderr lines (default: the
+        console).  None values are replaced by `sys.stdout` / `sys.stderr`.
+    stream : bool
+        Write output as it arrives.  If False, output is only collected.
+
+    """
+
+    def __init__(
+        self,
+        server,
+        fanout: int = FANOUT_LIMIT,
+        timeout: float = None,
+        out=None,
+        err=None,
+        stream: bool = True,
+    ):
+        self.server = server
+        self.fanout = max(1, fanout)
+        self.timeout = timeout
+        self.out = out if out is not None else sys.stdout
+        self.err = err if err is not None else sys.stderr
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._width = 0
+
+    def _emit(self, node: str, line: str, file):
+        if not self.stream:
+            return
+        with self._lock:
+            file.write(f"{node:<{self._width}}: {line}\n")
+            file.flush()
+
+    def _read(self, pipe, node: str, lines: List[str], file):
+        for raw in iter(pipe.readline, b""):
+            line = raw.decode(errors="replace").rstrip("\n")
+            lines.append(line)
+            self._emit(node, line, file)
+        pipe.close()
+
+    def run_node(self, cmd: str, node: str) -> NodeResult:
+        """Run `cmd` on one node, streaming its output."""
+        result = NodeResult(node)
+        try:
+            process = self.server.ssh_popen(
+                cmd,
+                target_node=node,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except SSHError as e:  # e.g. the node's circuit is open
+            result.returncode = 255
+            result.stderr.append(str(e))
+            self._emit(node, str(e), self.err)
+            return result
+        readers = [
+            threading.Thread(
+                target=self._read, args=(process.stdout, node, result.stdout, self.out), daemon=True
+            ),
+            threading.Thread(
+                target=self._read, args=(process.stderr, node, result.stderr, self.err), daemon=True
+            ),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            result.returncode = process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            result.returncode = TIMED_OUT
+            result.timed_out = True
+            self._emit(node, f"timed out after {self.timeout:.0f}s", self.err)
+        for reader in readers:
+            # the pipes may be held open by a jump connection for a moment
+            reader.join(_READER_JOIN_TIMEOUT)
+        return result
+
+    def run(self, cmd: str, nodes: Iterable[str]) -> Dict[str, NodeResult]:
+        """Run `cmd` on every node and return the results keyed by node."""
+        nodes = list(dict.fromkeys(nodes))
+        if not nodes:
+            return {}
+        self._width = max(len(n) for n in nodes)
+        log.debug(f"Running `{cmd}` on {len(nodes)} nodes ({self.fanout} at a time).")
+        with ThreadPoolExecutor(max_workers=min(self.fanout, len(nodes))) as pool:
+            results = list(pool.map(lambda node: self.run_node(cmd, node), nodes))
+        return {r.node: r for r in results}
@@ -0,0 +1,252 @@
+"""Parallel, compressed retrieval of job output directories.
+
+Output directories are resolved from the job records (`PBS_O_WORKDIR`,
+falling back to the directory of `Output_Path`).  All directories are
+listed in one remote call, files already present locally with the same
+size and modification time are skipped, and the rest are packed remotely
+into one `tar | gzip` stream per batch of jobs.  Batches are downloaded in
+parallel, up to a concurrency limit.
+
+Each file is extracted to a `.part` file and renamed once complete, so an
+interrupted fetch can simply be run again: finished files are skipped and
+partial ones are downloaded again.
+"""
+
+import os
+import shlex
+import subprocess
+import tarfile
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+from loguru import logger as log
+
+from pybs.server.qstat import parse_variable_list, short_job_id
+
+PART_SUFFIX = ".part"
+
+
+def output_dir(record: dict) -> str:
+    """The remote directory holding a job's outputs."""
+    workdir = parse_variable_list(record.get("Variable_List")).get("PBS_O_WORKDIR")
+    if workdir:
+        return workdir
+    output_path = record.get("Output_Path")
+    if output_path:
+        # `host:/path/to/file`
+        return os.path.dirname(output_path.split(":", 1)[-1])
+    return None
+
+
+class Fetcher:
+    """Download the output directories of jobs.
+
+    Parameters
+    ----------
+    server : PBSServer
+        The server the jobs ran on.
+    dest : Path
+        Local directory; each job's files go to `dest/<job_id>/`.
+    concurrency : int
+        Maximum number of simultaneous transfers.
+    batch_size : int
+        Maximum number of job directories packed into one stream.
+    include : list of str
+        If given, only fetch files whose path relative to the output
+        directory matches one of these glob patterns.
+
+    """
+
+    def __init__(
+        self,
+        server,
+        dest: Path,
+        concurrency: int = 4,
+        batch_size: int = 1,
+        include: Iterable[str] = (),
+    ):
+        self.server = server
+        self.dest = Path(dest)
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.include = list(include)
+
+    def resolve(self, job_ids: Iterable[str]) -> Dict[str, str]:
+        """Map each job ID to its remote output directory.
+
+        Jobs that share a directory (e.g. subjobs of an array job) are
+        only fetched once, into the directory of the first of them.
+        """
+        job_ids = [short_job_id(j) for j in job_ids]
+        records = self.server.job_records(job_ids)
+        dirs = {}
+        for job_id in job_ids:
+            if job_id not in records:
+                raise ValueError(f"Job ID {job_id} not found in qstat output.")
+            remote_dir = output_dir(records[job_id])
+            if remote_dir is None:
+                raise ValueError(f"Could not find output directory of job {job_id}.")
+            if remote_dir in dirs.values():
+                log.info(f"Job {job_id} shares output directory {remote_dir}.")
+                continue
+            dirs[job_id] = remote_dir.rstrip("/") or "/"
+        return dirs
+
+    def list_remote(self, dirs: Dict[str, str]) -> Dict[str, List[Tuple[str, int, int]]]:
+        """List `(relative path, size, mtime)` of the files in each directory.
+
+        All directories are listed in a single remote call.
+        """
+        quoted = " ".join(shlex.quote(d) for d in dirs.values())
+        cmd = f"find {quoted} -type f -printf '%p\\t%s\\t%T@\\n'"
+        stdout, stderr = self.server.ssh_execute(cmd, idempotent=True)
+        if stderr:
+            log.warning(stderr.strip())
+        files = {job_id: [] for job_id in dirs}
+        # Longest directory first, in case directories are nested
+        by_dir = sorted(dirs.items(), key=lambda item: -len(item[1]))
+        for line in (stdout or "").splitlines():
+            try:
+                path, size, mtime = line.rsplit("\t", 2)
+            except ValueError:
+                continue
+            for job_id, remote_dir in by_dir:
+                if path.startswith(remote_dir + "/"):
+                    rel = path[len(remote_dir) + 1 :]
+                    if not self.include or any(fnmatch(rel, p) for p in self.include):
+                        files[job_id].append((rel, int(size), int(float(mtime))))
+                    break
+        return files
+
+    def _is_present(self, job_id: str, rel: str, size: int, mtime: int) -> bool:
+        local = self.dest / job_id / rel
+        try:
+            st = local.stat()
+        except OSError:
+            return False
+        return st.st_size == size and int(st.st_mtime) == mtime
+
+    def plan(self, job_ids: Iterable[str]) -> Tuple[Dict[str, str], Dict[str, list]]:
+        """Work out which files still need to be downloaded."""
+        dirs = self.resolve(job_ids)
+        files = self.list_remote(dirs)
+        needed = {}
+        for job_id, entries in files.items():
+            missing = [e for e in entries if not self._is_present(job_id, *e)]
+            skipped = len(entries) - len(missing)
+            if skipped:
+                log.info(f"Job {job_id}: skipping {skipped} files already present.")
+            if missing:
+                needed[job_id] = missing
+        return dirs, needed
+
+    def _transfer(
+        self,
+        batch: List[str],
+        dirs: Dict[str, str],
+        needed: Dict[str, list],
+        on_file: Callable = None,
+    ):
+        """Download one batch of job directories as a single tar.gz stream."""
+        wanted = {}
+        for job_id in batch:
+            for rel, size, _ in needed[job_id]:
+                remote = f"{dirs[job_id]}/{rel}"
+                wanted[remote.lstrip("/")] = (job_id, rel, size)
+        names = "".join(name + "\0" for name in wanted).encode()
+        # stderr goes to a file: a full stderr pipe, read only after the
+        # archive, would block tar (and so the archive) forever
+        with tempfile.TemporaryFile() as errors:
+            process = self.server.ssh_popen(
+                "tar --null -czf - -C / -T -",
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=errors,
+            )
+            try:
+                self._extract(process, names, wanted, on_file)
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                status = process.wait()
+            errors.seek(0)
+            stderr = errors.read().decode(errors="replace")
+        # GNU tar exits with 1 if a file changed while it was being read
+        if status == 1:
+            log.warning(stderr.strip())
+        elif status != 0:
+            raise RuntimeError(f"Remote tar failed for jobs {batch}: {stderr.strip()}")
+
+    def _extract(self, process, names: bytes, wanted: dict, on_file: Callable = None):
+        """Write the file list to tar and unpack the archive it streams back."""
+        # Feed the file list from another thread: tar starts writing the
+        # archive before it has read all names.
+        def write_names():
+            process.stdin.write(names)
+            process.stdin.close()
+
+        writer = threading.Thread(target=write_names, daemon=True)
+        writer.start()
+        with tarfile.open(fileobj=process.stdout, mode="r|gz") as archive:
+            for member in archive:
+                if not member.isfile() or member.name not in wanted:
+                    continue
+                job_id, rel, size = wanted[member.name]
+                target = self.dest / job_id / rel
+                target.parent.mkdir(parents=True, exist_ok=True)
+                part = target.with_name(target.name + PART_SUFFIX)
+                with archive.extractfile(member) as src, open(part, "wb") as dst:
+                    while True:
+                        chunk = src.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                os.utime(part, (member.mtime, member.mtime))
+                os.replace(part, target)
+                if on_file is not None:
+                    on_file(job_id, rel, size)
+        writer.join()
+
+    def download(
+        self,
+        dirs: Dict[str, str],
+        needed: Dict[str, list],
+        on_file: Callable = None,
+    ):
+        """Download the files from `plan` in parallel batches.
+
+        `on_file(job_id, relative_path, size)` is called after each file is
+        written (from a worker thread).
+        """
+        job_ids = sorted(needed)
+        batches = [
+            job_ids[i : i + self.batch_size]
+            for i in range(0, len(job_ids), self.batch_size)
+        ]
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [
+                executor.submit(self._transfer, batch, dirs, needed, on_file)
+                for batch in batches
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    log.error(e)
+                    errors.append(e)
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {len(batches)} transfers failed.")
+
+    def fetch(self, job_ids: Iterable[str], on_file: Callable = None) -> Dict[str, int]:
+        """Fetch the outputs of jobs and return the number of files per job."""
+        dirs, needed = self.plan(job_ids)
+        if not needed:
+            log.info("All files are already present.")
+            return {}
+        self.download(dirs, needed, on_file)
+        return {job_id: len(entries) for job_id, entries in needed.items()}
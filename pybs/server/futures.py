@@ -0,0 +1,194 @@
+"""Job futures resolved from batched queue snapshots.
+
+A single `JobPoller` thread per server takes one `qstat` snapshot of every
+watched job per poll, so the number of SSH calls does not grow with the
+number of jobs being waited on.  `JobFuture` subclasses
+`concurrent.futures.Future`, so `concurrent.futures.wait`, `as_completed`,
+`add_done_callback` and `result(timeout=...)` work as usual.
+"""
+
+import threading
+
+from time import sleep
+from concurrent.futures import (
+    Future,
+    InvalidStateError,
+    as_completed,
+    wait,
+    FIRST_COMPLETED,
+    ALL_COMPLETED,
+)
+from typing import Dict, Iterable, List
+from loguru import logger as log
+
+from pybs.constants import POLL_INTERVAL
+from pybs.server.qstat import short_job_id
+
+__all__ = [
+    "JobFuture",
+    "JobPoller",
+    "as_completed",
+    "wait",
+    "FIRST_COMPLETED",
+    "ALL_COMPLETED",
+]
+
+
+class JobFuture(Future):
+    """Future for a submitted PBS job.
+
+    The future is *running* once the job has been seen in the `R` state,
+    and *done* once the job reaches a finished state or leaves the queue.
+    Its result is the last info dict observed for the job (see
+    `PBSServer.job_info`), with `status` set to the final state.
+
+    NOTE: callbacks added with `add_done_callback` run on the poller thread
+    and should return quickly.
+    """
+
+    def __init__(self, job_id: str, poller: "JobPoller" = None):
+        super().__init__()
+        self.job_id = short_job_id(job_id)
+        self.info = None
+        self._poller = poller
+
+    @property
+    def status(self) -> str:
+        """The last observed job status, or None if not yet seen."""
+        return None if self.info is None else self.info["status"]
+
+    @property
+    def node(self) -> str:
+        """The last observed node, or None if not yet assigned."""
+        return None if self.info is None else self.info.get("node")
+
+    def cancel(self) -> bool:
+        """Stop tracking the job.  This does not kill the job."""
+        cancelled = super().cancel()
+        if cancelled and self._poller is not None:
+            self._poller.unwatch(self.job_id)
+        return cancelled
+
+    def __repr__(self):
+        return f"<JobFuture {self.job_id} status={self.status} {self._state.lower()}>"
+
+
+class JobPoller:
+    """Resolve many `JobFuture`s from one shared polling thread.
+
+    The thread is started when the first job is watched and exits once no
+    unresolved futures remain.
+
+    Parameters
+    ----------
+    server : PBSServer
+        The server to take queue snapshots from.
+    interval : float
+        Seconds to wait between snapshots.
+
+    """
+
+    def __init__(self, server, interval: float = POLL_INTERVAL):
+        self.server = server
+        self.interval = interval
+        self._futures: Dict[str, JobFuture] = {}
+        self._watchers: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, job_id: str) -> JobFuture:
+        """Return the (shared) future for a job, starting the poller if needed."""
+        job_id = short_job_id(job_id)
+        with self._lock:
+            future = self._futures.get(job_id)
+            if future is None or future.cancelled():
+                future = JobFuture(job_id, poller=self)
+                self._futures[job_id] = future
+                self._watchers[job_id] = 0
+            self._watchers[job_id] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="pybs-job-poller", daemon=True
+                )
+                self._thread.start()
+        return future
+
+    def watch_many(self, job_ids: Iterable[str]) -> List[JobFuture]:
+        """Watch several jobs at once."""
+        return [self.watch(job_id) for job_id in job_ids]
+
+    def unwatch(self, job_id: str):
+        """Stop polling for a job."""
+        with self._lock:
+            self._futures.pop(short_job_id(job_id), None)
+            self._watchers.pop(short_job_id(job_id), None)
+
+    def detach(self, future: JobFuture):
+        """Stop waiting for a future returned by `watch`.
+
+        Unlike `JobFuture.cancel`, this also works once the job runs, and
+        does not touch the (shared) future: polling stops only when every
+        `watch` call for the job has been detached.
+        """
+        with self._lock:
+            if self._futures.get(future.job_id) is not future:
+                return
+            self._watchers[future.job_id] -= 1
+            if self._watchers[future.job_id] <= 0:
+                del self._futures[future.job_id]
+                del self._watchers[future.job_id]
+
+    def poll(self):
+        """Take one snapshot of all pending jobs and resolve their futures."""
+        with self._lock:
+            pending = {
+                job_id: future
+                for job_id, future in self._futures.items()
+                if not future.done()
+            }
+        if not pending:
+            return
+        snapshot = self.server.snapshot(pending)
+        for job_id, future in pending.items():
+            self._update(future, snapshot)
+
+    def _update(self, future: JobFuture, snapshot):
+        info = snapshot.get(future.job_id)
+        if info is not None:
+            future.info = info
+        elif future.job_id in snapshot.missing:
+            # Job has left the queue
+            future.info = dict(future.info or dict(node=None), status="F")
+        else:
+            return
+        try:
+            if snapshot.is_finished(future.job_id):
+                future.set_result(future.info)
+            elif future.status == "R" and not future.running():
+                future.set_running_or_notify_cancel()
+        except (InvalidStateError, RuntimeError):
+            pass  # cancelled concurrently
+
+    def _run(self):
+        log.debug("Job poller started.")
+        while True:
+            with self._lock:
+                self._futures = {
+                    job_id: future
+                    for job_id, future in self._futures.items()
+                    if not future.done()
+                }
+                self._watchers = {
+                    job_id: count
+                    for job_id, count in self._watchers.items()
+                    if job_id in self._futures
+                }
+                if not self._futures:
+                    self._thread = None
+                    log.debug("Job poller stopped: no jobs left to watch.")
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                log.warning(f"Job poller: failed to take queue snapshot: {e}")
+            sleep(self.interval)
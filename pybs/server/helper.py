@@ -0,0 +1,120 @@
+"""Deployment of, and queries to, the remote helper script.
+
+The helper (`remote_helper.py`, with the `qstat.py` parsers prepended) is
+copied to the login node once and cached there under its content hash, so
+a new pybs version deploys a new helper and old ones are never reused.
+A local marker file records that a host already has the current helper,
+so deploying costs no extra round trip afterwards.
+
+Queries are sent as one JSON request per remote call; see
+`remote_helper.py` for the supported operations.  Each response also
+carries the fingerprint of the login node's environment, which is used to
+notice when the cached environment (`environment.py`) is out of date.
+"""
+
+import hashlib
+import json
+
+from pathlib import Path
+from typing import List
+from loguru import logger as log
+
+from pybs import CACHE_DIR
+from pybs.server import qstat, remote_helper
+
+REMOTE_HELPER_DIR = "~/.cache/pybs"
+_HEREDOC = "PYBS_EOF"
+_MISSING_STATUS = 97
+
+SCHEDULER_OPS = ("jobs", "nodes", "queues", "estimates")
+"""Operations that query the PBS server (and so are rate-limited)."""
+
+
+class HelperError(Exception):
+    """The remote helper could not be run or returned an error."""
+
+
+def helper_source() -> str:
+    """Source of the deployable, self-contained helper script."""
+    parts = [Path(qstat.__file__).read_text(), Path(remote_helper.__file__).read_text()]
+    return "\n\n".join(parts)
+
+
+class RemoteHelper:
+    """Send batched JSON queries to the helper on a server's login node.
+
+    Parameters
+    ----------
+    server : PBSServer
+        The server whose login node runs the helper.
+
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.source = helper_source()
+        self.digest = hashlib.sha256(self.source.encode()).hexdigest()[:16]
+        self.remote_path = f"{REMOTE_HELPER_DIR}/helper-{self.digest}.py"
+        self.marker = CACHE_DIR / "helpers" / f"{server.remotehost}-{self.digest}"
+        self.env_fingerprint = None
+
+    @property
+    def deployed(self) -> bool:
+        """Whether this host is known to have the current helper."""
+        return self.marker.is_file()
+
+    def _deploy_cmd(self) -> str:
+        tmp = f"{self.remote_path}.$$"
+        return (
+            f"mkdir -p {REMOTE_HELPER_DIR} && cat > {tmp} << '{_HEREDOC}'\n"
+            f"{self.source}\n{_HEREDOC}\n"
+            f"mv {tmp} {self.remote_path}"
+        )
+
+    def _query_cmd(self, request: dict, deploy: bool) -> str:
+        payload = json.dumps(request)
+        if deploy:
+            prefix = self._deploy_cmd() + " && "
+        else:
+            prefix = f"test -f {self.remote_path} || exit {_MISSING_STATUS}; "
+        return (
+            prefix + f"python3 {self.remote_path} << '{_HEREDOC}'\n{payload}\n{_HEREDOC}"
+        )
+
+    def _call(self, request: dict, deploy: bool):
+        result = self.server._run(
+            self._query_cmd(request, deploy),
+            idempotent=True,
+        )
+        return result.returncode, result.stdout.decode(), result.stderr.decode()
+
+    def query(self, queries: List[dict]) -> list:
+        """Run several queries in one remote call and return their results.
+
+        Raises HelperError if the helper cannot be run, or if any query
+        failed.
+        """
+        request = dict(version=remote_helper.HELPER_VERSION, queries=queries)
+        deploy = not self.deployed
+        status, stdout, stderr = self._call(request, deploy)
+        if status == _MISSING_STATUS and not deploy:
+            log.debug("Remote helper missing on login node: deploying again.")
+            deploy = True
+            status, stdout, stderr = self._call(request, deploy)
+        if status != 0:
+            raise HelperError(f"Remote helper failed ({status}): {stderr.strip()}")
+        if deploy:
+            log.debug(f"Deployed remote helper to {self.remote_path}.")
+            self.marker.parent.mkdir(parents=True, exist_ok=True)
+            self.marker.touch()
+        try:
+            response = json.loads(stdout)
+        except ValueError:
+            raise HelperError(f"Invalid response from remote helper: {stdout[:200]!r}")
+        self.env_fingerprint = response.get("env")
+        results = []
+        for query, result in zip(queries, response["results"]):
+            if not result["ok"]:
+                raise HelperError(f"Helper query {query['op']} failed: {result['error']}")
+            results.append(result["result"])
+        return results
@@ -0,0 +1,196 @@
+"""Queue limits and node inventory of a cluster, cached locally.
+
+Limits change rarely, so they are fetched in one remote call (`qstat -Qf`
+and `pbsnodes -a`) and kept in `CACHE_DIR/limits/<host>.json` for
+`LIMITS_CACHE_TTL` seconds.  Nodes are stored as distinct shapes (CPUs,
+GPUs and memory available, with the number of nodes of each shape) rather
+than one entry per node.
+"""
+
+import json
+
+from collections import Counter
+from time import time
+from typing import Dict, List
+from loguru import logger as log
+
+from pybs import CACHE_DIR
+from pybs.constants import LIMITS_CACHE_TTL
+from pybs.server.directives import ResourceRequest, parse_walltime, resource_value
+from pybs.server.qstat import parse_size
+
+LIMITED_RESOURCES = ("walltime", "ncpus", "ngpus", "mem", "nodect")
+"""Resources checked against `resources_min` / `resources_max` of queues."""
+
+
+def _limit_value(key: str, value: str):
+    if key == "walltime":
+        return parse_walltime(value)
+    if key == "mem":
+        size = parse_size(value)
+        return None if size < 0 else size
+    return int(value) if value.isdigit() else None
+
+
+def _format(key: str, value: int) -> str:
+    if key == "walltime":
+        return f"{value // 3600}:{value // 60 % 60:02d}:{value % 60:02d}"
+    if key == "mem":
+        return f"{value / 1024**3:.0f}gb"
+    return str(value)
+
+
+def node_shapes(nodes: Dict[str, dict]) -> List[dict]:
+    """Count the distinct shapes of `pbsnodes` nodes."""
+    shapes = Counter()
+    for attributes in nodes.values():
+        shape = tuple(
+            max(resource_value(key, attributes.get(f"resources_available.{key}", "0")) or 0, 0)
+            for key in ("ncpus", "ngpus", "mem")
+        )
+        shapes[shape] += 1
+    return [
+        dict(ncpus=ncpus, ngpus=ngpus, mem=mem, count=count)
+        for (ncpus, ngpus, mem), count in shapes.most_common()
+    ]
+
+
+class ClusterLimits:
+    """Queue limits and node shapes of a cluster.
+
+    Parameters
+    ----------
+    queues : dict
+        `qstat -Qf` attributes keyed by queue name.
+    nodes : list of dict
+        Distinct node shapes, see `node_shapes`.
+    fetched_at : float
+        When the limits were fetched (seconds since the epoch).
+
+    """
+
+    def __init__(self, queues: Dict[str, dict], nodes: List[dict], fetched_at: float = None):
+        self.queues = queues
+        self.nodes = nodes
+        self.fetched_at = time() if fetched_at is None else fetched_at
+
+    @staticmethod
+    def cache_path(host: str):
+        return CACHE_DIR / "limits" / f"{host}.json"
+
+    @classmethod
+    def fetch(cls, server) -> "ClusterLimits":
+        """Fetch the limits of a server (in one call if the helper is used)."""
+        results = server.helper_query([dict(op="queues"), dict(op="nodes", nodes=None)])
+        if results is None:
+            results = server.queue_info(), server.node_info()
+        queues, nodes = results
+        return cls(queues, node_shapes(nodes))
+
+    @classmethod
+    def load(cls, host: str, max_age: float = LIMITS_CACHE_TTL) -> "ClusterLimits":
+        """Cached limits of a host, or None if missing or older than `max_age`."""
+        path = cls.cache_path(host)
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if time() - data["fetched_at"] > max_age:
+            return None
+        return cls(data["queues"], data["nodes"], data["fetched_at"])
+
+    def save(self, host: str):
+        path = self.cache_path(host)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps(dict(queues=self.queues, nodes=self.nodes, fetched_at=self.fetched_at))
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def cached(cls, server, max_age: float = LIMITS_CACHE_TTL) -> "ClusterLimits":
+        """Cached limits of a server, fetched again once they are too old."""
+        limits = cls.load(server.remotehost, max_age)
+        if limits is None:
+            log.debug(f"Fetching queue limits and node inventory of {server.remotehost}.")
+            limits = cls.fetch(server)
+            limits.save(server.remotehost)
+        return limits
+
+    def _destinations(self, name: str, seen=None) -> List[str]:
+        """Execution queues that jobs submitted to `name` may end up in."""
+        seen = set() if seen is None else seen
+        if name in seen or name not in self.queues:
+            return []
+        seen.add(name)
+        queue = self.queues[name]
+        if queue.get("queue_type", "").lower() != "route":
+            return [name]
+        destinations = []
+        for destination in queue.get("route_destinations", "").split(","):
+            destinations += self._destinations(destination.split("@")[0].strip(), seen)
+        return destinations
+
+    def queue_issues(self, name: str, request: ResourceRequest) -> List[str]:
+        """Reasons why an execution queue would reject a request."""
+        queue = self.queues[name]
+        if queue.get("enabled", "True") != "True":
+            return [f"queue {name} is disabled"]
+        issues = []
+        for key, requested in request.totals().items():
+            if key not in LIMITED_RESOURCES:
+                continue
+            maximum = _limit_value(key, queue.get(f"resources_max.{key}", ""))
+            minimum = _limit_value(key, queue.get(f"resources_min.{key}", ""))
+            if maximum is not None and requested > maximum:
+                issues.append(
+                    f"{key}={_format(key, requested)} exceeds the maximum "
+                    f"of queue {name} ({_format(key, maximum)})"
+                )
+            if minimum is not None and requested < minimum:
+                issues.append(
+                    f"{key}={_format(key, requested)} is below the minimum "
+                    f"of queue {name} ({_format(key, minimum)})"
+                )
+        return issues
+
+    def check(self, request: ResourceRequest) -> List[str]:
+        """Reasons why the cluster would not run a request (empty if none).
+
+        The requested queue (or, without `-q`, any execution queue) must
+        accept the request, and every chunk must fit on some node.
+        """
+        issues = []
+        if self.queues:
+            if request.queue is not None:
+                name = request.queue.split("@")[0]
+                if name not in self.queues:
+                    return [f"unknown queue {name} (known: {', '.join(sorted(self.queues))})"]
+                candidates = self._destinations(name)
+            else:
+                candidates = [
+                    q for q in self.queues if self._destinations(q) == [q]
+                ]
+            problems = {q: self.queue_issues(q, request) for q in candidates}
+            if candidates and all(problems.values()):
+                if len(candidates) == 1:
+                    issues += problems[candidates[0]]
+                else:
+                    issues.append(
+                        "no queue accepts this job: "
+                        + "; ".join(p[0] for p in problems.values())
+                    )
+        if self.nodes:
+            for chunk in request.select:
+                if not any(
+                    all(chunk.get(key) <= node[key] for key in ("ncpus", "ngpus", "mem"))
+                    for node in self.nodes
+                ):
+                    largest = max(self.nodes, key=lambda n: (n["ngpus"], n["ncpus"], n["mem"]))
+                    issues.append(
+                        f"chunk {chunk} does not fit on any node (largest: "
+                        f"ncpus={largest['ncpus']}:ngpus={largest['ngpus']}:"
+                        f"mem={_format('mem', largest['mem'])})"
+                    )
+        return issues
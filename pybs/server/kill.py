@@ -0,0 +1,101 @@
+"""Selection of jobs for bulk deletion, and the outcome of a bulk `qdel`.
+
+Jobs can be given as IDs, ranges of IDs (`1000-1050`) or ranges of array
+subjobs (`1234[1-10]`, `1234[1-10:2]`), or selected from a queue snapshot by
+owner, name pattern and state.  See `PBSServer.kill_jobs`.
+"""
+
+import re
+
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from typing import Iterable, List
+
+from pybs.server.qstat import QueueSnapshot, short_job_id
+
+_ID_RANGE = re.compile(r"^(\d+)-(\d+)$")
+_ARRAY_RANGE = re.compile(r"^(\d+)\[(\d+)-(\d+)(?::(\d+))?\]$")
+
+
+def expand_job_ids(specs: Iterable[str]) -> List[str]:
+    """Expand job ID ranges into (short) job IDs, keeping their order."""
+    job_ids = []
+    for spec in specs:
+        spec = short_job_id(spec)
+        match = _ID_RANGE.match(spec)
+        if match:
+            first, last = int(match.group(1)), int(match.group(2))
+            job_ids += [str(i) for i in range(first, last + 1)]
+            continue
+        match = _ARRAY_RANGE.match(spec)
+        if match:
+            parent, first, last, step = match.groups()
+            job_ids += [
+                f"{parent}[{i}]" for i in range(int(first), int(last) + 1, int(step or 1))
+            ]
+            continue
+        job_ids.append(spec)
+    return list(dict.fromkeys(job_ids))
+
+
+def _column_matches(column: str, value: str) -> bool:
+    """Compare a full value with a `qstat -a` column, which may be truncated."""
+    column = column or ""
+    if column.endswith("*"):
+        return value.startswith(column[:-1])
+    # usernames are cut to 8 characters without a marker
+    return value == column or (len(column) >= 8 and value.startswith(column))
+
+
+def match_jobs(
+    snapshot: QueueSnapshot,
+    owner: str = None,
+    name: str = None,
+    states: Iterable[str] = None,
+) -> List[str]:
+    """IDs of the jobs in a snapshot matching all of the given filters.
+
+    `name` is a shell-style pattern.  As `qstat -a` truncates job names,
+    jobs whose name cannot be matched fully are included too; check their
+    full `Job_Name` before acting on them (see `PBSServer.kill_jobs`).
+    """
+    states = set(states or ())
+    job_ids = []
+    for job_id, row in snapshot.items():
+        if owner is not None and not _column_matches(row.get("Username"), owner):
+            continue
+        if states and row.get("status") not in states:
+            continue
+        if name is not None:
+            jobname = row.get("Jobname", "")
+            if not jobname.endswith("*") and not fnmatchcase(jobname, name):
+                continue
+        job_ids.append(job_id)
+    return job_ids
+
+
+@dataclass
+class KillReport:
+    """Outcome of a bulk kill.
+
+    Parameters
+    ----------
+    sent : list of str
+        Jobs that `qdel` was sent for.
+    unknown : list of str
+        Jobs that had already left the queue (or never existed).
+    killed : list of str
+        Jobs confirmed to have left the queue or finished.
+    refused : list of str
+        Jobs still in the queue when the deadline passed.
+
+    """
+
+    sent: List[str] = field(default_factory=list)
+    unknown: List[str] = field(default_factory=list)
+    killed: List[str] = field(default_factory=list)
+    refused: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.refused
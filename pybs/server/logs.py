@@ -0,0 +1,340 @@
+"""Incremental tailing of job stdout/stderr.
+
+Output is read by a small follower script that runs remotely over one
+persistent SSH channel per host.  The follower tracks a byte offset per
+file and only sends bytes past that offset, in frames of at most
+`CHUNK_SIZE` bytes::
+
+    <file index> <offset> <length>\\n<length bytes>
+
+so neither side ever holds a whole log in memory.  A file whose inode
+changes or that shrinks below its offset (rotation or truncation) is read
+again from the start.
+
+While a job runs, its output lives in the PBS spool directory of its first
+execution node; once it finishes, the output is read from the job's
+`Output_Path` / `Error_Path` on the login node, continuing from the same
+offsets.  As output files are copied back after the job ends, missing
+final files are waited for up to `STAGEOUT_GRACE` seconds.
+"""
+
+import shlex
+import subprocess
+import sys
+import threading
+
+from time import sleep
+from typing import Dict, List, Optional
+from loguru import logger as log
+
+from pybs.constants import PBS_SPOOL_DIR
+from pybs.server.qstat import FINISHED_STATES, short_job_id
+
+CHUNK_SIZE = 64 * 1024
+STAGEOUT_GRACE = 30.0
+MAX_LINE_LENGTH = 1024 * 1024
+
+FOLLOWER_SCRIPT = r"""
+import os, sys, time
+follow = sys.argv[1] == "1"
+interval = float(sys.argv[2])
+chunk = int(sys.argv[3])
+deadline = time.time() + float(sys.argv[4])
+files = []
+for arg in sys.argv[5:]:
+    offset, path = arg.split(":", 1)
+    files.append([path, int(offset), None])
+out = sys.stdout.buffer
+while True:
+    idle = True
+    missing = False
+    for i, f in enumerate(files):
+        path, offset, inode = f
+        try:
+            st = os.stat(path)
+        except OSError:
+            missing = True
+            continue
+        if offset < 0:
+            offset = max(0, st.st_size + offset)
+        if (inode is not None and st.st_ino != inode) or st.st_size < offset:
+            offset = 0
+        f[2] = st.st_ino
+        if st.st_size > offset:
+            with open(path, "rb") as fh:
+                fh.seek(offset)
+                data = fh.read(chunk)
+            out.write(("%d %d %d\n" % (i, offset, len(data))).encode())
+            out.write(data)
+            out.flush()
+            offset += len(data)
+            idle = False
+        f[1] = offset
+    if idle:
+        if not follow and not (missing and time.time() < deadline):
+            break
+        time.sleep(interval)
+"""
+
+
+class LogStream:
+    """One output file of one job, written line by line to `out`.
+
+    Parameters
+    ----------
+    job_id : str
+        The job the output belongs to.
+    name : str
+        `"out"` or `"err"`.
+    offset : int
+        Byte offset to start reading from.  Negative values count from the
+        end of the file.
+
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        name: str,
+        offset: int = 0,
+        prefix: str = "",
+        out=None,
+        lock: threading.Lock = None,
+    ):
+        self.job_id = job_id
+        self.name = name
+        self.offset = offset
+        self.prefix = prefix
+        self.out = out if out is not None else sys.stdout
+        self.path = None
+        self.node = None
+        self._partial = b""
+        self._lock = lock if lock is not None else threading.Lock()
+
+    def feed(self, offset: int, data: bytes):
+        """Consume one frame read from `offset`."""
+        if 0 <= offset < self.offset:
+            log.info(f"Output of job {self.job_id} was rotated or truncated.")
+            self.flush()
+        self.offset = offset + len(data)
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        if len(self._partial) > MAX_LINE_LENGTH:
+            lines.append(self._partial)
+            self._partial = b""
+        self._write(lines)
+
+    def flush(self):
+        """Write out any incomplete last line."""
+        if self._partial:
+            self._write([self._partial])
+            self._partial = b""
+
+    def _write(self, lines: List[bytes]):
+        if not lines:
+            return
+        text = "".join(
+            self.prefix + line.decode(errors="replace") + "\n" for line in lines
+        )
+        with self._lock:
+            self.out.write(text)
+            self.out.flush()
+
+
+class _Channel:
+    """One SSH connection running the follower for some streams on one host."""
+
+    def __init__(
+        self,
+        server,
+        node: Optional[str],
+        streams: List[LogStream],
+        follow: bool,
+        interval: float,
+        grace: float = 0.0,
+    ):
+        self.node = node
+        self.streams = streams
+        args = ["1" if follow else "0", str(interval), str(CHUNK_SIZE), str(grace)]
+        args += [f"{s.offset}:{s.path}" for s in streams]
+        cmd = "python3 -u -c " + " ".join(
+            shlex.quote(a) for a in [FOLLOWER_SCRIPT] + args
+        )
+        self.process = server.ssh_popen(
+            cmd,
+            target_node=node,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        stdout = self.process.stdout
+        while True:
+            header = stdout.readline()
+            if not header:
+                break
+            index, offset, length = (int(x) for x in header.split())
+            data = stdout.read(length)
+            self.streams[index].feed(offset, data)
+        stderr = self.process.stderr.read().decode(errors="replace")
+        if self.process.wait() not in (0, -15) and stderr:
+            log.warning(f"Log channel to {self.node or 'login node'}: {stderr.strip()}")
+
+    def alive(self) -> bool:
+        return self.thread.is_alive()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.thread.join()
+        for stream in self.streams:
+            stream.flush()
+
+
+class LogFollower:
+    """Tail the stdout/stderr of several jobs at once.
+
+    Parameters
+    ----------
+    server : PBSServer
+        The server the jobs run on.
+    follow : bool
+        Keep reading new output until the jobs finish.
+    tail : int
+        Start this many bytes before the end of each file, or from the
+        start if None.
+    interval : float
+        Seconds between checks for new output.
+    spool_dir : str
+        PBS spool directory on the execution nodes.
+
+    """
+
+    def __init__(
+        self,
+        server,
+        follow: bool = True,
+        tail: int = None,
+        interval: float = 1.0,
+        spool_dir: str = PBS_SPOOL_DIR,
+        out=None,
+    ):
+        self.server = server
+        self.follow = follow
+        self.tail = tail
+        self.interval = interval
+        self.spool_dir = spool_dir
+        self.out = out if out is not None else sys.stdout
+        self._lock = threading.Lock()
+        self.streams: Dict[str, List[LogStream]] = {}
+
+    def add_jobs(self, job_ids: List[str]):
+        """Register jobs to tail.  Lines are prefixed when tailing more than one file."""
+        job_ids = [short_job_id(j) for j in job_ids]
+        records = self.server.job_records(job_ids)
+        for job_id in job_ids:
+            if job_id not in records:
+                raise ValueError(f"Job ID {job_id} not found in qstat output.")
+            record = records[job_id]
+            names = ["out"] if record.get("Join_Path", "n") != "n" else ["out", "err"]
+            offset = 0 if self.tail is None else -abs(self.tail)
+            self.streams[job_id] = [
+                LogStream(job_id, name, offset=offset, out=self.out, lock=self._lock)
+                for name in names
+            ]
+            self._locate(job_id, record)
+            if not self.follow and record.get("job_state") in ("Q", "H", "W"):
+                log.warning(f"Job {job_id} has not started yet: no output to show.")
+        all_streams = [s for streams in self.streams.values() for s in streams]
+        if len(all_streams) > 1:
+            for stream in all_streams:
+                stream.prefix = f"[{stream.job_id} {stream.name}] "
+
+    def _locate(self, job_id: str, record: dict):
+        """Point a job's streams at its spool files or final output files."""
+        for stream in self.streams[job_id]:
+            if record.get("job_state") in FINISHED_STATES:
+                key = "Output_Path" if stream.name == "out" else "Error_Path"
+                stream.node = None
+                # `host:/path/to/file`
+                stream.path = record.get(key, "").split(":", 1)[-1]
+            else:
+                suffix = "OU" if stream.name == "out" else "ER"
+                stream.node = record.get("exec_host", "").split("/")[0] or None
+                stream.path = f"{self.spool_dir}/{record['Job_Id']}.{suffix}"
+
+    def _channels(
+        self,
+        job_ids: List[str],
+        follow: bool,
+        grace: float = 0.0,
+    ) -> List[_Channel]:
+        by_node = {}
+        for job_id in job_ids:
+            for stream in self.streams[job_id]:
+                if stream.path:
+                    by_node.setdefault(stream.node, []).append(stream)
+        return [
+            _Channel(self.server, node, streams, follow, self.interval, grace)
+            for node, streams in by_node.items()
+        ]
+
+    def _wait_until_started(self, futures: dict):
+        while True:
+            queued = [j for j, f in futures.items() if not (f.running() or f.done())]
+            if not queued:
+                return
+            log.info(f"Waiting for jobs to start: {' '.join(queued)}")
+            sleep(max(self.interval, 1.0))
+
+    def run(self):
+        """Print output until done (or until interrupted when following)."""
+        job_ids = list(self.streams)
+        if not self.follow:
+            channels = self._channels(job_ids, follow=False)
+            for channel in channels:
+                channel.thread.join()
+                channel.close()
+            return
+
+        futures = dict(zip(job_ids, self.server.watch_many(job_ids)))
+        self._wait_until_started(futures)
+        records = self.server.job_records(job_ids)
+        for job_id in job_ids:
+            self._locate(job_id, records.get(job_id, {}))
+        live = [j for j in job_ids if not futures[j].done()]
+        finished = [j for j in job_ids if futures[j].done()]
+        channels = self._channels(live, follow=True)
+        final = self._channels(finished, follow=False, grace=STAGEOUT_GRACE)
+        try:
+            while live:
+                sleep(self.interval)
+                done = [j for j in live if futures[j].done()]
+                for channel in list(channels):
+                    if channel.alive() and not any(
+                        s.job_id in done for s in channel.streams
+                    ):
+                        continue
+                    # Reconnect dropped channels, and move finished jobs over
+                    # to their final output files on the login node.
+                    channel.close()
+                    channels.remove(channel)
+                    remaining = {s.job_id for s in channel.streams} - set(done)
+                    if remaining:
+                        log.debug(f"Reconnecting log channel to {channel.node}.")
+                        channels += self._channels(sorted(remaining), follow=True)
+                if done:
+                    records = self.server.job_records(done)
+                    for job_id in done:
+                        record = records.get(job_id, {})
+                        record.setdefault("job_state", "F")
+                        self._locate(job_id, record)
+                    final += self._channels(done, follow=False, grace=STAGEOUT_GRACE)
+                    live = [j for j in live if j not in done]
+            for channel in final:
+                channel.thread.join()
+        finally:
+            for channel in channels + final:
+                channel.close()
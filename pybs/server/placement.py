@@ -0,0 +1,342 @@
+"""Choose the resource shape of a job that is predicted to start soonest.
+
+A `Shape` is one way of asking for resources, e.g. `ngpus=1,walltime=2:00:00`
+or `queue=gpu,ngpus=2,gpu_type=A100`, applied as overrides on top of the job
+script's `#PBS` directives.  `Placement` ranks candidate shapes by their
+predicted wait, using (in this order):
+
+1. the free-node inventory: a shape that fits on free nodes now should
+   start right away;
+2. the scheduler's estimated start times of queued jobs of the same size
+   in the same queue (`estimated.start_time`, as shown by `qstat -T`);
+3. the waits observed for the same shape by earlier placements on this
+   host, kept in `CACHE_DIR/placement/<host>.jsonl`.
+
+It then submits the best shape, or races the best few and deletes the
+losers as soon as one of them starts running.
+"""
+
+import json
+import statistics
+
+from dataclasses import dataclass
+from time import monotonic, sleep, time
+from typing import Dict, List, Optional, Tuple
+from loguru import logger as log
+
+from pybs import CACHE_DIR
+from pybs.constants import GPU_TYPE_RESOURCE, POLL_INTERVAL
+from pybs.server.directives import (
+    Chunk,
+    DirectiveError,
+    ResourceRequest,
+    load_request,
+    resource_value,
+)
+from pybs.server.futures import JobFuture
+
+HISTORY_SIZE = 20
+"""Number of recent waits per shape used to predict the next one."""
+
+
+@dataclass(frozen=True)
+class Shape:
+    """A candidate resource shape for a job (unset fields keep the script's values)."""
+
+    queue: str = None
+    ngpus: int = None
+    walltime: str = None
+    gpu_type: str = None
+
+    @classmethod
+    def parse(cls, spec: str) -> "Shape":
+        """Parse a shape such as `queue=gpu,ngpus=2,walltime=4:00:00`."""
+        fields = {}
+        for item in spec.split(","):
+            key, _, value = item.strip().partition("=")
+            if key not in cls.__dataclass_fields__ or not value:
+                raise ValueError(
+                    f"Invalid shape {spec!r}: expected comma-separated "
+                    f"key=value pairs with keys {', '.join(cls.__dataclass_fields__)}"
+                )
+            fields[key] = int(value) if key == "ngpus" else value
+        return cls(**fields)
+
+    def overrides(self) -> dict:
+        """The shape as overrides for `directives.load_request`."""
+        overrides = dict(queue=self.queue, ngpus=self.ngpus, walltime=self.walltime)
+        overrides[GPU_TYPE_RESOURCE] = self.gpu_type
+        return {k: v for k, v in overrides.items() if v is not None}
+
+    def __str__(self):
+        return ",".join(f"{k}={v}" for k, v in self.__dict__.items() if v is not None)
+
+
+@dataclass
+class Prediction:
+    """Predicted wait of a shape: `wait` is in seconds, None if unknown."""
+
+    shape: Shape
+    request: ResourceRequest
+    wait: Optional[float]
+    source: str
+
+    def sort_key(self):
+        # unknown waits last; on ties prefer smaller requests
+        return (
+            self.wait is None,
+            self.wait or 0,
+            self.request.total("ngpus") or 0,
+            self.request.walltime or 0,
+        )
+
+
+class WaitHistory:
+    """Queue waits observed for each shape on one host.
+
+    Parameters
+    ----------
+    host : str
+        The ssh config alias of the host.
+
+    """
+
+    def __init__(self, host: str):
+        self.path = CACHE_DIR / "placement" / f"{host}.jsonl"
+
+    def _records(self) -> List[dict]:
+        try:
+            lines = self.path.read_text().splitlines()
+        except OSError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # partly written line
+        return records
+
+    def add(self, shape: Shape, wait: float):
+        """Record the wait of a job submitted with `shape`."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        record = dict(shape.__dict__, wait=round(wait, 1), time=time())
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def estimate(self, shape: Shape) -> Optional[float]:
+        """Median of the recent waits of `shape`, or of shapes in the same
+        queue with the same GPUs if it was never used.  None if unknown."""
+        records = self._records()
+        for fields in (shape.__dict__, dict(shape.__dict__, walltime=None)):
+            waits = [
+                r["wait"]
+                for r in records
+                if all(r.get(k) == v for k, v in fields.items() if v is not None)
+            ]
+            if waits:
+                return statistics.median(waits[-HISTORY_SIZE:])
+        return None
+
+
+def _free(attributes: dict, key: str):
+    """Unassigned amount of a numeric resource on a node."""
+    available = resource_value(key, attributes.get(f"resources_available.{key}", "0"))
+    assigned = resource_value(key, attributes.get(f"resources_assigned.{key}", "0"))
+    if not isinstance(available, int):
+        return 0
+    return available - (assigned if isinstance(assigned, int) else 0)
+
+
+def fits_free_node(chunk: Chunk, attributes: dict, queue: str = None) -> bool:
+    """Whether a chunk fits in the unassigned resources of a `pbsnodes` node."""
+    if "free" not in attributes.get("state", ""):
+        return False
+    if queue is not None and attributes.get("queue", queue) != queue:
+        return False
+    for key, value in chunk.resources.items():
+        requested = resource_value(key, value)
+        if isinstance(requested, int):
+            if _free(attributes, key) < requested:
+                return False
+        elif attributes.get(f"resources_available.{key}") != requested:
+            return False
+    return True
+
+
+class Placement:
+    """Rank resource shapes for a job script and submit the best.
+
+    Parameters
+    ----------
+    server : PBSServer
+        The server to submit to.
+    job_script : Path
+        The job script.  Shapes that change the GPUs of a remote script are
+        skipped, as remote scripts are not parsed.
+    location : str
+        Where the job script is, "local" or "remote".
+    overrides : dict
+        Overrides applied to every shape (see `PBSServer.submit_job`).
+    validate : bool
+        Skip shapes that exceed the cached queue limits or node inventory.
+
+    """
+
+    def __init__(
+        self,
+        server,
+        job_script,
+        location: str = "local",
+        overrides: dict = None,
+        validate: bool = True,
+    ):
+        self.server = server
+        self.job_script = job_script
+        self.location = location
+        self.overrides = dict(overrides or {})
+        self.validate = validate
+        self.history = WaitHistory(server.remotehost)
+
+    def _shape_overrides(self, shape: Shape) -> dict:
+        return {**self.overrides, **shape.overrides()}
+
+    def candidates(self, shapes: List[Shape]) -> List[Tuple[Shape, ResourceRequest]]:
+        """The shapes (with their requests) that the cluster would accept."""
+        limits = self.server.cluster_limits() if self.validate else None
+        candidates = []
+        for shape in shapes:
+            try:
+                request = load_request(
+                    self.job_script, self.location, self._shape_overrides(shape)
+                )
+                request.validate(limits, source=str(shape))
+            except DirectiveError as e:
+                log.warning(f"Skipping shape {shape}: {e}")
+                continue
+            candidates.append((shape, request))
+        return candidates
+
+    def _fetch_state(self) -> Tuple[Dict[str, dict], List[dict]]:
+        results = self.server.helper_query([dict(op="nodes", nodes=None), dict(op="estimates")])
+        if results is None:
+            results = self.server.node_info(), self.server.queued_estimates()
+        return results
+
+    def _predict(
+        self,
+        shape: Shape,
+        request: ResourceRequest,
+        nodes: Dict[str, dict],
+        estimates: List[dict],
+        now: float,
+    ) -> Prediction:
+        chunks = request.select or (Chunk(),)
+        if all(
+            sum(fits_free_node(c, n, request.queue) for n in nodes.values()) >= c.count
+            for c in chunks
+        ):
+            return Prediction(shape, request, 0.0, "free nodes")
+        ngpus = request.total("ngpus") or 0
+        starts = [
+            e["start"]
+            for e in estimates
+            if e["start"] is not None
+            and e["ngpus"] == ngpus
+            and (request.queue is None or e["queue"] == request.queue)
+        ]
+        if starts:
+            # a new job of this size queues behind the similar ones
+            return Prediction(shape, request, max(max(starts) - now, 0.0), "estimates")
+        wait = self.history.estimate(shape)
+        if wait is not None:
+            return Prediction(shape, request, wait, "history")
+        return Prediction(shape, request, None, "unknown")
+
+    def rank(self, shapes: List[Shape]) -> List[Prediction]:
+        """Predict the wait of each valid shape, soonest first."""
+        candidates = self.candidates(shapes)
+        if not candidates:
+            return []
+        nodes, estimates = self._fetch_state()
+        now = time()
+        predictions = [
+            self._predict(shape, request, nodes, estimates, now)
+            for shape, request in candidates
+        ]
+        return sorted(predictions, key=Prediction.sort_key)
+
+    def _kill(self, futures: List[JobFuture]):
+        if not futures:
+            return
+        ids = " ".join(f.job_id for f in futures)
+        log.info(f"Deleting jobs that lost the race: {ids}")
+        self.server.ssh_execute(f"qdel {ids}", idempotent=True)
+        for future in futures:
+            self.server.detach(future)
+
+    def _succeeded(self, futures: List[JobFuture]) -> set:
+        """IDs of finished jobs that ran and exited with status 0."""
+        records = self.server.job_records(f.job_id for f in futures)
+        return {
+            f.job_id for f in futures if records.get(f.job_id, {}).get("Exit_status") == "0"
+        }
+
+    def submit(self, shapes: List[Shape], race: int = 1) -> Tuple[Prediction, JobFuture]:
+        """Submit the best shape, or race the best `race` shapes.
+
+        Blocks until one of the submitted jobs starts running; the others
+        are then deleted.  The observed wait is added to the history.
+        Returns the winning prediction and the future of its job.
+
+        A job that finishes before it is seen running wins only if it
+        succeeded (its wait is then unknown and not recorded); a job that
+        failed is dropped from the race.  Raises RuntimeError if every job
+        failed.
+        """
+        predictions = self.rank(shapes)
+        if not predictions:
+            raise DirectiveError(["none of the shapes can run on the cluster"])
+        entries = []
+        try:
+            for prediction in predictions[: max(race, 1)]:
+                job_id = self.server.submit_job(
+                    self.job_script,
+                    self.location,
+                    overrides=self._shape_overrides(prediction.shape),
+                    validate=False,
+                )
+                log.info(f"Submitted job {job_id} with shape {prediction.shape}.")
+                entries.append((prediction, self.server.watch(job_id), monotonic()))
+            pending = list(entries)
+            winner, wait = None, None
+            while winner is None:
+                running = [e for e in pending if e[1].running()]
+                if running:
+                    winner = running[0]
+                    wait = monotonic() - winner[2]
+                    break
+                finished = [e for e in pending if e[1].done()]
+                if finished:
+                    succeeded = self._succeeded([f for _, f, _ in finished])
+                    for entry in finished:
+                        pending.remove(entry)
+                        if entry[1].job_id in succeeded:
+                            winner = winner or entry
+                        else:
+                            log.warning(
+                                f"Job {entry[1].job_id} with shape {entry[0].shape} "
+                                "ended without running successfully."
+                            )
+                    if winner is None and not pending:
+                        raise RuntimeError("Every submitted job failed before running.")
+                    continue
+                sleep(POLL_INTERVAL)
+        except BaseException:
+            self._kill([f for _, f, _ in entries if not f.done()])
+            raise
+        prediction, future, _ = winner
+        if wait is not None:
+            self.history.add(prediction.shape, wait)
+        self._kill([f for _, f, _ in entries if f is not future and not f.done()])
+        return prediction, future
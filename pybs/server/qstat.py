@@ -0,0 +1,293 @@
+"""Parsers for the output of PBS commands (`qstat`, `pbsnodes`).
+
+NOTE: this module only uses the standard library, so that it can also be
+shipped to (and run on) the login node.
+"""
+
+import re
+import time
+
+FINISHED_STATES = ("C", "F", "X")
+"""Job states in which a job will not run again."""
+
+_SIZE_UNITS = {"b": 1, "w": 8, "kb": 1024, "mb": 1024**2, "gb": 1024**3, "tb": 1024**4}
+_GONE_MARKERS = ("Unknown Job Id", "has finished")
+_JOB_ID_PATTERN = re.compile(r"^\d+(\[\d*\])?(\.\S+)?$")
+
+
+def short_job_id(job_id):
+    """Strip the server suffix from a job ID, e.g. `1234.kman.restech` -> `1234`."""
+    return str(job_id).strip().split(".")[0]
+
+
+def parse_duration(value):
+    """Convert a PBS duration (`[[HH:]MM:]SS` or `HH:MM` in tables) to seconds.
+
+    Returns -1 for missing values such as `--`.  Two-field values are read
+    as `HH:MM`, as printed in the `qstat -a` columns.
+    """
+    value = (value or "").strip()
+    if not value or value.startswith("-"):
+        return -1
+    try:
+        parts = [int(float(p)) for p in value.split(":")]
+    except ValueError:
+        return -1
+    if len(parts) == 2:
+        parts = parts + [0]
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def parse_size(value):
+    """Convert a PBS size such as `46gb` or `1024kb` to bytes (-1 if missing)."""
+    value = (value or "").strip().lower()
+    match = re.match(r"^(\d+(?:\.\d+)?)([kmgt]?[bw]?)$", value)
+    if not match:
+        return -1
+    number, unit = match.groups()
+    if unit in ("", "k", "m", "g", "t"):
+        unit += "b"
+    return int(float(number) * _SIZE_UNITS.get(unit, 1))
+
+
+class QueueSnapshot(dict):
+    """Jobs seen in one `qstat` call, keyed by short job ID.
+
+    Jobs that were explicitly requested but that `qstat` reported as unknown
+    or finished are listed in `missing`.
+    """
+
+    def __init__(self, rows=None, missing=None):
+        super().__init__(rows or {})
+        self.missing = set(missing or ())
+
+    def is_finished(self, job_id):
+        """Whether the job has left the queue or reached a finished state."""
+        job_id = short_job_id(job_id)
+        if job_id in self.missing:
+            return True
+        row = self.get(job_id)
+        return row is not None and row["status"] in FINISHED_STATES
+
+
+def _header_keys(header_line):
+    """Normalise the column names of a `qstat -a` header line."""
+    header = header_line.replace("Job ID", "Job_ID").split()
+    status_index = header.index("S") if "S" in header else len(header)
+    keys = []
+    for i, key in enumerate(header):
+        # `Time` appears twice: requested walltime, then elapsed time.
+        if key == "Time":
+            key = "Req_Time" if i < status_index else "Elap_Time"
+        keys.append(key)
+    return keys
+
+
+def _parse_exec_host(node_line):
+    """Split an `exec_host` line such as `k092/0*6+k093/0*6`."""
+    node_line = node_line.strip()
+    if not node_line or node_line == "--":
+        return node_line, [], None
+    chunks = node_line.split("+")
+    nodes = []
+    for chunk in chunks:
+        host = chunk.split("/")[0]
+        if host not in nodes:
+            nodes.append(host)
+    first = chunks[0].split("/", 1)
+    resources = first[1] if len(first) > 1 else None
+    return nodes[0], nodes, resources
+
+
+def _finish_row(row, node_lines):
+    node, nodes, resources = _parse_exec_host("".join(node_lines))
+    row["node"] = node
+    row["nodes"] = nodes
+    row["resources"] = resources
+    return row
+
+
+def iter_qstat_table(lines):
+    """Yield one info dict per job from `qstat -n` (alternate format) output.
+
+    Each dict contains `job_id`, `status`, `node`, `nodes` and `resources`
+    plus the raw table columns under their (normalised) header names.
+    Multiple header blocks, e.g. from several chained `qstat` calls, are
+    supported.
+    """
+    keys = None
+    previous = None
+    row = None
+    node_lines = []
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("Job ID"):
+            previous = line
+            continue
+        if line.startswith("---") and previous is not None:
+            keys = _header_keys(previous)
+            previous = None
+            continue
+        previous = None
+        if keys is None or not line.strip():
+            continue
+        if line[0].isspace():
+            # exec_host line(s) belonging to the current row
+            if row is not None:
+                node_lines.append(line.strip())
+            continue
+        fields = line.split()
+        if len(fields) != len(keys):
+            # Trailing text such as a server name line before the next header.
+            continue
+        if row is not None:
+            yield _finish_row(row, node_lines)
+        row = dict(zip(keys, fields))
+        row["job_id"] = short_job_id(fields[0])
+        row["status"] = row.get("S")
+        node_lines = []
+    if row is not None:
+        yield _finish_row(row, node_lines)
+
+
+def parse_qstat_missing(stderr):
+    """Return the short IDs of jobs `qstat` reported as unknown or finished."""
+    missing = set()
+    for line in (stderr or "").splitlines():
+        if not any(marker in line for marker in _GONE_MARKERS):
+            continue
+        for token in line.replace(":", " ").split():
+            if _JOB_ID_PATTERN.match(token):
+                missing.add(short_job_id(token))
+    return missing
+
+
+def parse_qstat_table(stdout, stderr=""):
+    """Parse `qstat -n` output into a `QueueSnapshot`."""
+    rows = {row["job_id"]: row for row in iter_qstat_table((stdout or "").splitlines())}
+    return QueueSnapshot(rows, parse_qstat_missing(stderr))
+
+
+def _iter_attribute_blocks(lines, header, id_key):
+    """Yield attribute dicts from `qstat -f` style output.
+
+    Each block starts with a `<header> <id>` line, followed by indented
+    `key = value` lines; long values continue on tab-indented lines.
+    """
+    record = None
+    key = None
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith(header):
+            if record is not None:
+                yield record
+            record = {id_key: line[len(header) :].strip()}
+            key = None
+            continue
+        if record is None or not line.strip():
+            continue
+        if line.startswith("\t") and key is not None:
+            # continuation of a long value
+            record[key] += line.strip()
+            continue
+        if " = " in line:
+            key, value = line.strip().split(" = ", 1)
+            record[key] = value
+    if record is not None:
+        yield record
+
+
+def iter_qstat_full(lines):
+    """Yield one attribute dict per job from `qstat -f` output.
+
+    Attribute names are kept as printed (e.g. `Resource_List.walltime`),
+    values are strings with continuation lines joined.  `Job_Id` holds the
+    full job ID and `job_id` the short one.
+    """
+    for record in _iter_attribute_blocks(lines, "Job Id:", "Job_Id"):
+        record["job_id"] = short_job_id(record["Job_Id"])
+        yield record
+
+
+def parse_qstat_full(stdout):
+    """Parse `qstat -f` output into a dict of job records keyed by short job ID."""
+    return {r["job_id"]: r for r in iter_qstat_full((stdout or "").splitlines())}
+
+
+def parse_variable_list(value):
+    """Parse a `Variable_List` attribute (`K=V,K=V,...`) into a dict.
+
+    Commas inside values are escaped with a backslash.
+    """
+    variables = {}
+    for item in re.split(r"(?<!\\),", value or ""):
+        if "=" in item:
+            key, val = item.split("=", 1)
+            variables[key.strip()] = val.replace("\\,", ",")
+    return variables
+
+
+def iter_pbsnodes(lines):
+    """Yield one attribute dict per node from `pbsnodes -a` output.
+
+    The node name is stored under `name`; attributes are kept as printed
+    (e.g. `resources_available.ngpus`).
+    """
+    node = None
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            if node is not None:
+                yield node
+            node = {"name": line.strip()}
+        elif node is not None and " = " in line:
+            key, value = line.strip().split(" = ", 1)
+            node[key] = value
+    if node is not None:
+        yield node
+
+
+def parse_pbsnodes(stdout):
+    """Parse `pbsnodes -a` output into a dict of node attributes keyed by name."""
+    return {n["name"]: n for n in iter_pbsnodes((stdout or "").splitlines())}
+
+
+def parse_qstat_queues(stdout):
+    """Parse `qstat -Qf` output into a dict of queue attributes keyed by name."""
+    lines = (stdout or "").splitlines()
+    return {q["name"]: q for q in _iter_attribute_blocks(lines, "Queue:", "name")}
+
+
+def parse_ctime(value):
+    """Convert a PBS timestamp such as `Mon Oct 19 15:00:00 2026` to epoch seconds.
+
+    Returns None for missing or unparseable values.
+    """
+    try:
+        return time.mktime(time.strptime((value or "").strip(), "%a %b %d %H:%M:%S %Y"))
+    except ValueError:
+        return None
+
+
+def iter_queued_estimates(lines):
+    """Yield the scheduler's start estimate of each queued job in `qstat -f -i` output.
+
+    Each item has `job_id`, `queue`, `ngpus`, `ncpus`, `walltime` (seconds,
+    -1 if unknown) and `start` (epoch seconds, None if not estimated).
+    """
+    for record in iter_qstat_full(lines):
+        if record.get("job_state") != "Q":
+            continue
+        yield {
+            "job_id": record["job_id"],
+            "queue": record.get("queue", ""),
+            "ngpus": int(record.get("Resource_List.ngpus", "0") or 0),
+            "ncpus": int(record.get("Resource_List.ncpus", "0") or 0),
+            "walltime": parse_duration(record.get("Resource_List.walltime")),
+            "start": parse_ctime(record.get("estimated.start_time")),
+        }
@@ -0,0 +1,159 @@
+"""Helper that runs on the login node and answers batched JSON queries.
+
+NOTE: this script is deployed to the login node together with
+`pybs/server/qstat.py` (prepended to it), so it may only use the standard
+library and must stay compatible with older Python 3 versions.
+
+It reads one JSON request from stdin::
+
+    {"version": 1, "queries": [{"op": "jobs", "ids": ["1234"]}, ...]}
+
+and writes one JSON response to stdout, with one result per query and
+the fingerprint of the environment variables (see `env`)::
+
+    {"version": 1, "env": "...", "results": [{"ok": true, "result": ...}, ...]}
+
+Supported operations:
+
+- `jobs`: queue snapshot (`qstat -n`) of `ids`, or the whole queue.
+- `paths`: expand `~` and `$VARS` in `paths` and check what they point to.
+- `nodes`: `pbsnodes` attributes of `nodes`, or of all nodes.
+- `queues`: `qstat -Qf` attributes of all queues.
+- `estimates`: estimated start times of queued jobs (`qstat -f -i`).
+- `env`: the variables used to expand paths (`select_variables`) and
+  their fingerprint.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+try:
+    from pybs.server.qstat import (
+        iter_pbsnodes,
+        iter_qstat_table,
+        iter_queued_estimates,
+        parse_qstat_missing,
+        parse_qstat_queues,
+    )
+except ImportError:
+    pass  # deployed: the parsers are defined above this module
+
+HELPER_VERSION = 1
+BATCH_SIZE = 500
+ENV_NAMES = ("HOME", "USER", "LOGNAME", "SHELL")
+VOLATILE_NAMES = ("PWD", "OLDPWD", "_", "SHLVL")
+
+
+def _run(args):
+    process = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    return process.communicate()
+
+
+def select_variables(environ):
+    """The user names and path-valued variables of an environment.
+
+    Per-connection variables (`SSH_*`, the working directory) are left out,
+    so the selection only changes when the user's setup does.
+    """
+    return dict(
+        (name, value)
+        for name, value in environ.items()
+        if name in ENV_NAMES
+        or (
+            value.startswith("/")
+            and ":" not in value
+            and name not in VOLATILE_NAMES
+            and not name.startswith("SSH_")
+        )
+    )
+
+
+def env_fingerprint(variables):
+    payload = json.dumps(variables, sort_keys=True).encode()
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def op_jobs(query):
+    ids = query.get("ids")
+    rows = {}
+    missing = set()
+    batches = [None] if ids is None else [
+        ids[i : i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)
+    ]
+    for batch in batches:
+        stdout, stderr = _run(["qstat", "-n"] + list(batch or []))
+        for row in iter_qstat_table(stdout.splitlines()):
+            rows[row["job_id"]] = row
+        missing |= parse_qstat_missing(stderr)
+    return {"rows": rows, "missing": sorted(missing)}
+
+
+def op_paths(query):
+    result = {}
+    for path in query["paths"]:
+        expanded = os.path.expandvars(os.path.expanduser(path))
+        result[path] = {
+            "expanded": expanded,
+            "exists": os.path.exists(expanded),
+            "is_file": os.path.isfile(expanded),
+            "is_dir": os.path.isdir(expanded),
+        }
+    return result
+
+
+def op_nodes(query):
+    nodes = query.get("nodes")
+    args = ["pbsnodes"] + (list(nodes) if nodes else ["-a"])
+    stdout, _ = _run(args)
+    return dict((n["name"], n) for n in iter_pbsnodes(stdout.splitlines()))
+
+
+def op_queues(query):
+    stdout, _ = _run(["qstat", "-Qf"])
+    return parse_qstat_queues(stdout)
+
+
+def op_estimates(query):
+    stdout, _ = _run(["qstat", "-f", "-i"])
+    return list(iter_queued_estimates(stdout.splitlines()))
+
+
+def op_env(query):
+    variables = select_variables(os.environ)
+    return {"variables": variables, "fingerprint": env_fingerprint(variables)}
+
+
+OPS = {
+    "jobs": op_jobs,
+    "paths": op_paths,
+    "nodes": op_nodes,
+    "queues": op_queues,
+    "estimates": op_estimates,
+    "env": op_env,
+}
+
+
+def main():
+    request = json.load(sys.stdin)
+    results = []
+    for query in request.get("queries", []):
+        try:
+            results.append({"ok": True, "result": OPS[query["op"]](query)})
+        except Exception as e:
+            results.append({"ok": False, "error": "%s: %s" % (type(e).__name__, e)})
+    fingerprint = env_fingerprint(select_variables(os.environ))
+    json.dump(
+        {"version": HELPER_VERSION, "env": fingerprint, "results": results}, sys.stdout
+    )
+
+
+if __name__ == "__main__":
+    main()
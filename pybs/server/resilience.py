@@ -0,0 +1,186 @@
+"""Timeouts, retries and circuit breaking for remote calls."""
+
+import random
+import subprocess
+import threading
+
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, Iterator
+from loguru import logger as log
+
+
+class SSHError(Exception):
+    """A remote call failed before the remote command could complete."""
+
+
+class SSHTimeoutError(SSHError, TimeoutError):
+    """A remote call did not finish within its deadline."""
+
+
+class SSHCancelledError(SSHError):
+    """A remote call was stopped by us, e.g. because a hedged call answered first."""
+
+
+class CircuitOpenError(SSHError):
+    """A host has failed repeatedly, so calls to it fail fast for a while."""
+
+
+def backoff_delays(
+    retries: int,
+    base: float = 0.5,
+    cap: float = 8.0,
+) -> Iterator[float]:
+    """Delays before each retry: exponential backoff with full jitter."""
+    for attempt in range(retries):
+        yield random.uniform(0, min(cap, base * 2**attempt))
+
+
+class CircuitBreaker:
+    """Fail fast while a host is down.
+
+    After `threshold` consecutive failures the circuit *opens* and calls
+    are refused for `cooldown` seconds.  After that, one trial call is let
+    through: if it succeeds the circuit closes again, otherwise it stays
+    open for another cooldown.
+
+    Parameters
+    ----------
+    host : str
+        Name of the host, for messages.
+    threshold : int
+        Number of consecutive failures that opens the circuit.
+    cooldown : float
+        Seconds to refuse calls for once open.
+
+    """
+
+    def __init__(self, host: str, threshold: int = 3, cooldown: float = 30.0):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self):
+        """Raise `CircuitOpenError` if calls to the host should fail fast."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - monotonic()
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(
+                    f"{self.host} is unreachable ({self.failures} failed calls); "
+                    f"not retrying for {max(remaining, 0):.0f}s."
+                )
+            # Half-open: let one trial call through
+            self._trial = True
+
+    def release(self):
+        """End a trial call without an outcome (e.g. it was cancelled)."""
+        with self._lock:
+            self._trial = False
+
+    @contextmanager
+    def attempt(self):
+        """Guard one call: fail fast if open, then always record the outcome.
+
+        `SSHError`s count as failures, other exceptions (and cancelled
+        calls) release the trial without an outcome.
+        """
+        self.check()
+        try:
+            yield
+        except SSHCancelledError:
+            self.release()
+            raise
+        except SSHError:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                log.info(f"{self.host} is reachable again.")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    log.warning(f"{self.host} is failing: failing fast for {self.cooldown:.0f}s.")
+                self.opened_at = monotonic()
+                self._trial = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host: str, target_node: str = None) -> CircuitBreaker:
+    """The circuit breaker shared by all calls to `host` in this process.
+
+    Calls to a `target_node` through `host` as the jump host have a breaker
+    of their own, so that compute nodes that are down (or still booting)
+    do not cut off every call to the login node.
+    """
+    key = host if target_node is None else f"{target_node} via {host}"
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(key)
+        return _breakers[key]
+
+
+class BreakerPopen(subprocess.Popen):
+    """An `ssh` process that reports its outcome to a circuit breaker.
+
+    The outcome is recorded once the exit status is known (`wait`, `poll`
+    or `communicate`): exit status 255 (ssh failed) is a failure, processes
+    we killed release the trial, anything else is a success.
+    """
+
+    SSH_CONNECTION_ERROR = 255
+
+    def __init__(self, args, breaker: CircuitBreaker, **kwargs):
+        self.breaker = breaker
+        self._recorded = False
+        breaker.check()
+        try:
+            super().__init__(args, **kwargs)
+        except BaseException:
+            breaker.release()
+            raise
+
+    def _record(self):
+        if self.returncode is None or self._recorded:
+            return
+        self._recorded = True
+        if self.returncode == self.SSH_CONNECTION_ERROR:
+            self.breaker.record_failure()
+        elif self.returncode < 0:
+            self.breaker.release()
+        else:
+            self.breaker.record_success()
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        self._record()
+        return returncode
+
+    def poll(self):
+        returncode = super().poll()
+        self._record()
+        return returncode
@@ -0,0 +1,129 @@
+"""Sessions of `pybs code`, so that a running job can be attached to again.
+
+Each launch records its host, job, node, workspace and job script in
+`CACHE_DIR/sessions/<host>.json`.  If the laptop sleeps or the `code`
+process dies, `pybs code --attach` finds the session whose job is still
+queued or running (for the same job script and workspace, or the job given
+with `--job`) and reuses it instead of submitting another job.  A running
+job is reattached to at once, skipping queue polling and the GPU check; a
+queued one is waited for as if it had just been submitted.
+
+Job scripts are matched by content for local scripts (`script_digest`), so
+an edited script does not attach to a job started from an older version,
+and by path for remote scripts.
+"""
+
+import json
+
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from time import time
+from typing import Iterable, List
+from loguru import logger as log
+
+from pybs import CACHE_DIR
+from pybs.server.directives import script_digest
+from pybs.server.qstat import short_job_id
+
+
+def script_key(job_script: Path, location: str) -> str:
+    """Identify a job script: its content if local, its path if remote."""
+    if location == "local":
+        return script_digest(Path(job_script).read_text())
+    return script_digest(f"remote:{job_script}")
+
+
+@dataclass
+class Session:
+    """One `pybs code` launch."""
+
+    host: str
+    job_id: str
+    node: str = None
+    workspace: List[str] = field(default_factory=list)
+    job_script: str = ""
+    script_key: str = ""
+    created_at: float = field(default_factory=time)
+
+
+class SessionStore:
+    """The recorded sessions of one host.
+
+    Parameters
+    ----------
+    host : str
+        The ssh config alias of the host.
+
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.path = CACHE_DIR / "sessions" / f"{host}.json"
+
+    def sessions(self) -> List[Session]:
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return []
+        return [Session(**s) for s in data]
+
+    def _write(self, sessions: List[Session]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps([asdict(s) for s in sessions], indent=1))
+        tmp.replace(self.path)
+
+    def save(self, session: Session):
+        """Record a session, replacing any earlier one for the same job."""
+        others = [s for s in self.sessions() if s.job_id != session.job_id]
+        self._write(others + [session])
+
+    def remove(self, job_id: str):
+        self._write([s for s in self.sessions() if s.job_id != short_job_id(job_id)])
+
+    def find(
+        self,
+        job_id: str = None,
+        script_key: str = None,
+        workspace: Iterable[str] = None,
+    ) -> List[Session]:
+        """Sessions matching all given fields, most recent first."""
+        workspace = None if not workspace else [str(p) for p in workspace]
+        matches = [
+            s
+            for s in self.sessions()
+            if (job_id is None or s.job_id == short_job_id(job_id))
+            and (script_key is None or s.script_key == script_key)
+            and (workspace is None or s.workspace == workspace)
+        ]
+        return sorted(matches, key=lambda s: -s.created_at)
+
+    def attach(
+        self,
+        server,
+        job_id: str = None,
+        script_key: str = None,
+        workspace: Iterable[str] = None,
+    ) -> Session:
+        """The most recent matching session whose job is queued or running, or None.
+
+        The session's `node` is set if the job runs, and None otherwise.
+        With a `job_id`, that job is attached to even if it was not
+        started by `pybs code` here.  Sessions of finished jobs are removed.
+        """
+        if job_id is not None:
+            candidates = self.find(job_id) or [Session(self.host, short_job_id(job_id))]
+        else:
+            candidates = self.find(script_key=script_key, workspace=workspace)
+        if not candidates:
+            return None
+        snapshot = server.snapshot([s.job_id for s in candidates])
+        for session in candidates:
+            row = snapshot.get(session.job_id)
+            if row is None or snapshot.is_finished(session.job_id):
+                log.debug(f"Job {session.job_id} has finished; forgetting its session.")
+                self.remove(session.job_id)
+                continue
+            session.node = row["node"] if row["status"] == "R" and row["node"] else None
+            return session
+        return None
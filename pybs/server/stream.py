@@ -0,0 +1,145 @@
+"""Streaming the output of large remote commands.
+
+`ssh_execute` buffers the whole output of a command before returning,
+which for `pbsnodes -a` or `qstat -f` on a busy cluster can be hundreds of
+MB.  A `RemoteStream` instead yields stdout line by line as it arrives:
+
+- stdout is read in chunks of `CHUNK_SIZE` bytes and decoded incrementally,
+  so memory use is bounded by the chunk size and the longest line;
+- the pipe provides back-pressure: while the consumer is busy, `ssh` (and
+  the remote command) block on the full pipe instead of filling memory;
+- stderr is drained by a thread, keeping only its last `STDERR_TAIL` lines,
+  so a chatty stderr cannot stall the command.
+
+The `qstat` parsers consume lines, so they parse records on the fly:
+
+    with server.ssh_stream("qstat -f") as lines:
+        for record in iter_qstat_full(lines):
+            ...
+
+Streams are not retried: their output may already have been consumed.
+"""
+
+import codecs
+import subprocess
+import threading
+
+from collections import deque
+from typing import Iterator, List
+from loguru import logger as log
+
+from pybs.server.resilience import SSHError, SSHTimeoutError
+
+CHUNK_SIZE = 64 * 1024
+STDERR_TAIL = 100
+"""Number of stderr lines kept."""
+
+SSH_CONNECTION_ERROR = 255
+_DRAIN_JOIN_TIMEOUT = 2.0
+
+
+class RemoteStream:
+    """Lines of a running remote command's stdout, read lazily.
+
+    Iterate over it (once) to get the lines without their newline.  Once
+    exhausted, `returncode` and `stderr` are set.  Closing the stream
+    early (or leaving its `with` block) kills the command.
+
+    Parameters
+    ----------
+    args : list of str
+        The `ssh` command line.
+    timeout : float
+        Deadline in seconds for the whole command.  None waits forever.
+    breaker : CircuitBreaker
+        Circuit breaker of the host, told whether `ssh` succeeded.
+
+    """
+
+    def __init__(self, args: List[str], timeout: float = None, breaker=None):
+        self.args = args
+        self.breaker = breaker
+        self.returncode = None
+        self._stderr = deque(maxlen=STDERR_TAIL)
+        self._timed_out = False
+        self.process = subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=False,
+        )
+        self._drain = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._drain.start()
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._expire, args=(timeout,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def stderr(self) -> str:
+        return "\n".join(self._stderr)
+
+    def _drain_stderr(self):
+        for raw in iter(self.process.stderr.readline, b""):
+            self._stderr.append(raw.decode(errors="replace").rstrip("\n"))
+        self.process.stderr.close()
+
+    def _expire(self, timeout: float):
+        if self.process.poll() is None:
+            self._timed_out = timeout
+            self.process.kill()
+
+    def _lines(self) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
+        while True:
+            chunk = self.process.stdout.read1(CHUNK_SIZE)
+            text = decoder.decode(chunk, final=not chunk)
+            if text:
+                *lines, pending = (pending + text).split("\n")
+                yield from lines
+            if not chunk:
+                break
+        if pending:
+            yield pending
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            yield from self._lines()
+            self.process.wait()
+        finally:
+            self.close()
+        if self._timed_out:
+            raise SSHTimeoutError(
+                f"Remote call to {self.args[-2]} timed out after {self._timed_out}s"
+            )
+        if self.returncode == SSH_CONNECTION_ERROR:
+            raise SSHError(self.stderr.strip() or "SSH failed")
+        if self.returncode:
+            log.debug(f"`{self.args[-1]}` exited with status {self.returncode}.")
+
+    def close(self):
+        """Stop the command (if still running) and collect its exit status."""
+        if self.returncode is not None:
+            return
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.returncode = self.process.wait()
+        if self._timer is not None:
+            self._timer.cancel()
+        # stderr may be held open by a jump connection for a moment
+        self._drain.join(_DRAIN_JOIN_TIMEOUT)
+        if self.breaker is not None:
+            if self._timed_out or self.returncode == SSH_CONNECTION_ERROR:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+    def __enter__(self) -> "RemoteStream":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,281 @@
+"""Columnar queue snapshots for large-scale analytics.
+
+`QueueTable` holds a queue snapshot as one NumPy array per column instead
+of one dict per job: strings that repeat (state, user, queue) are stored
+as categorical integer codes, times as int64 seconds and memory as int64
+bytes.  Rows are consumed one at a time while parsing, so no per-job dicts
+are kept around.
+
+This module requires numpy (plus pandas or pyarrow for the conversions),
+which come with the `analytics` extra of pybs::
+
+    pip install "pythonpbs[analytics]"
+
+"""
+
+from array import array
+from typing import Dict, Iterable
+
+from pybs.server.qstat import parse_duration, parse_size, short_job_id
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+INSTALL_HINT = 'pip install "pythonpbs[analytics]"'
+
+CATEGORICAL = ("state", "user", "queue")
+NUMERIC = {
+    "nodes": "i",
+    "ncpus": "i",
+    "ngpus": "i",
+    "mem": "q",
+    "walltime": "q",
+    "elapsed": "q",
+}
+"""Numeric columns and their `array` typecodes (32 or 64 bit integers)."""
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError(f"Queue tables require numpy: {INSTALL_HINT}")
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+class _Categorical:
+    """Incrementally dictionary-encode a string column."""
+
+    def __init__(self):
+        self.codes = array("i")
+        self.categories = []
+        self._index = {}
+
+    def append(self, value: str):
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.categories)
+            self.categories.append(value)
+        self.codes.append(code)
+
+
+class QueueTable:
+    """A queue snapshot stored column-wise.
+
+    Columns
+    -------
+    job_id, name : object arrays of str
+    state, user, queue : categorical; `table.codes[col]` holds int32 codes
+        into `table.categories[col]`
+    nodes, ncpus, ngpus : int32 (-1 if unknown)
+    mem : int64 bytes requested (-1 if unknown)
+    walltime, elapsed : int64 seconds requested / used (-1 if unknown)
+
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, "np.ndarray"],
+        codes: Dict[str, "np.ndarray"],
+        categories: Dict[str, list],
+    ):
+        _require_numpy()
+        self.columns = columns
+        self.codes = codes
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.columns["job_id"])
+
+    def __repr__(self):
+        return f"<QueueTable {len(self)} jobs>"
+
+    @classmethod
+    def _build(cls, rows: Iterable[dict], extract) -> "QueueTable":
+        _require_numpy()
+        job_ids, names = [], []
+        categorical = {col: _Categorical() for col in CATEGORICAL}
+        numeric = {col: array(code) for col, code in NUMERIC.items()}
+        for row in rows:
+            values = extract(row)
+            job_ids.append(values["job_id"])
+            names.append(values["name"])
+            for col in CATEGORICAL:
+                categorical[col].append(values[col])
+            for col in NUMERIC:
+                numeric[col].append(values[col])
+        columns = dict(
+            job_id=np.array(job_ids, dtype=object),
+            name=np.array(names, dtype=object),
+        )
+        for col, values in numeric.items():
+            dtype = np.int32 if NUMERIC[col] == "i" else np.int64
+            # zero-copy view of the array buffer
+            columns[col] = np.frombuffer(values, dtype=dtype) if values else np.zeros(0, dtype)
+        codes = {
+            col: np.frombuffer(c.codes, dtype=np.int32) if c.codes else np.zeros(0, np.int32)
+            for col, c in categorical.items()
+        }
+        categories = {col: c.categories for col, c in categorical.items()}
+        return cls(columns, codes, categories)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> "QueueTable":
+        """Build from `qstat -n` rows (see `qstat.iter_qstat_table`).
+
+        NOTE: the table format has no GPU count, so `ngpus` is -1 and
+        `ncpus` is the task count.
+        """
+
+        def extract(row):
+            return dict(
+                job_id=row["job_id"],
+                name=row.get("Jobname", ""),
+                state=row.get("status") or "",
+                user=row.get("Username", ""),
+                queue=row.get("Queue", ""),
+                nodes=_int(row.get("NDS")),
+                ncpus=_int(row.get("TSK")),
+                ngpus=-1,
+                mem=parse_size(row.get("Memory")),
+                walltime=parse_duration(row.get("Req_Time")),
+                elapsed=parse_duration(row.get("Elap_Time")),
+            )
+
+        return cls._build(rows, extract)
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "QueueTable":
+        """Build from `qstat -f` records (see `qstat.iter_qstat_full`)."""
+
+        def extract(record):
+            return dict(
+                job_id=short_job_id(record["Job_Id"]),
+                name=record.get("Job_Name", ""),
+                state=record.get("job_state", ""),
+                user=record.get("Job_Owner", "").split("@")[0],
+                queue=record.get("queue", ""),
+                nodes=_int(record.get("Resource_List.nodect")),
+                ncpus=_int(record.get("Resource_List.ncpus")),
+                ngpus=_int(record.get("Resource_List.ngpus", 0)),
+                mem=parse_size(record.get("Resource_List.mem")),
+                walltime=parse_duration(record.get("Resource_List.walltime")),
+                elapsed=parse_duration(record.get("resources_used.walltime")),
+            )
+
+        return cls._build(records, extract)
+
+    def __getitem__(self, col: str) -> "np.ndarray":
+        """A column; categorical columns are decoded to an object array."""
+        if col in self.codes:
+            categories = np.array(self.categories[col], dtype=object)
+            return categories[self.codes[col]] if len(categories) else categories
+        return self.columns[col]
+
+    def mask(self, **conditions) -> "np.ndarray":
+        """Boolean mask of rows where each categorical column equals a value.
+
+        Values may also be lists, meaning any of them, e.g.
+        `table.mask(state=["Q", "H"], user="z1234567")`.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for col, wanted in conditions.items():
+            if isinstance(wanted, str):
+                wanted = [wanted]
+            if col in self.codes:
+                wanted_codes = [
+                    self.categories[col].index(w)
+                    for w in wanted
+                    if w in self.categories[col]
+                ]
+                mask &= np.isin(self.codes[col], wanted_codes)
+            else:
+                mask &= np.isin(self.columns[col], list(wanted))
+        return mask
+
+    def filter(self, mask: "np.ndarray" = None, **conditions) -> "QueueTable":
+        """Rows matching a boolean mask and/or `mask(**conditions)`."""
+        if mask is None:
+            mask = np.ones(len(self), dtype=bool)
+        if conditions:
+            mask = mask & self.mask(**conditions)
+        return QueueTable(
+            {col: values[mask] for col, values in self.columns.items()},
+            {col: codes[mask] for col, codes in self.codes.items()},
+            self.categories,
+        )
+
+    def group_sum(self, values: "np.ndarray", by: str) -> Dict[str, float]:
+        """Sum `values` per category of the column `by`."""
+        totals = np.bincount(
+            self.codes[by],
+            weights=values,
+            minlength=len(self.categories[by]),
+        )
+        return {
+            category: float(total)
+            for category, total in zip(self.categories[by], totals)
+            if total
+        }
+
+    def count(self, by: str) -> Dict[str, int]:
+        """Number of jobs per category of the column `by`."""
+        counts = np.bincount(self.codes[by], minlength=len(self.categories[by]))
+        return {c: int(n) for c, n in zip(self.categories[by], counts) if n}
+
+    def gpu_hours(self, by: str = "user", requested: bool = False) -> Dict[str, float]:
+        """GPU hours per user or queue.
+
+        By default this is the elapsed time of each job times its GPUs;
+        with `requested=True` the requested walltime is used instead.
+        Jobs with unknown GPU count or time are skipped.
+        """
+        seconds = self.columns["walltime" if requested else "elapsed"]
+        ngpus = self.columns["ngpus"]
+        known = (seconds >= 0) & (ngpus >= 0)
+        hours = np.where(known, seconds.astype(np.float64) * ngpus, 0.0) / 3600
+        return self.group_sum(hours, by)
+
+    def to_pandas(self):
+        """Hand the columns to a pandas DataFrame without copying them.
+
+        Categorical columns become `pandas.Categorical`s over the same codes.
+        """
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError(f"Converting to pandas requires pandas: {INSTALL_HINT}")
+
+        data = dict(job_id=self.columns["job_id"], name=self.columns["name"])
+        for col in CATEGORICAL:
+            data[col] = pd.Categorical.from_codes(
+                self.codes[col], categories=self.categories[col], validate=False
+            )
+        for col in NUMERIC:
+            data[col] = self.columns[col]
+        return pd.DataFrame(data, copy=False)
+
+    def to_arrow(self):
+        """Convert to a `pyarrow.Table`, sharing the numeric buffers."""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError(f"Converting to Arrow requires pyarrow: {INSTALL_HINT}")
+
+        arrays = dict(
+            job_id=pa.array(self.columns["job_id"], type=pa.string()),
+            name=pa.array(self.columns["name"], type=pa.string()),
+        )
+        for col in CATEGORICAL:
+            arrays[col] = pa.DictionaryArray.from_arrays(
+                pa.array(self.codes[col]), pa.array(self.categories[col], type=pa.string())
+            )
+        for col in NUMERIC:
+            arrays[col] = pa.array(self.columns[col])
+        return pa.table(arrays)
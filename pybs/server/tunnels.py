@@ -0,0 +1,245 @@
+"""Port forwards to the node of a running job.
+
+A `TunnelManager` keeps one multiplexed ssh connection (an OpenSSH
+*ControlMaster*) to the job's first node, jumping through the login node.
+Every port forward is added to that connection (`ssh -O forward`) instead
+of starting a new `ssh -L` per port, so adding a tunnel takes no new
+handshake.  While the job runs, the manager
+
+- discovers Jupyter servers on the node (`jupyter server list --json`)
+  and forwards their ports, printing their local URLs;
+- checks the connection every `interval` seconds and, if it dropped,
+  reconnects and restores all forwards;
+
+and once the job ends (or the manager is stopped) it closes the connection.
+"""
+
+import hashlib
+import json
+import socket
+import subprocess
+import threading
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+from loguru import logger as log
+
+from pybs import CACHE_DIR
+from pybs.constants import SSH_CONNECT_TIMEOUT, TUNNEL_CHECK_INTERVAL
+from pybs.server.resilience import SSHError
+
+JUPYTER_LIST = "jupyter server list --json 2>/dev/null || jupyter notebook list --json 2>/dev/null"
+
+_CONTROL_TIMEOUT = 30.0
+
+
+@dataclass
+class Forward:
+    """A local port forwarded to a port on the node."""
+
+    remote_port: int
+    local_port: int
+    name: str = ""
+    url: str = None
+
+    @property
+    def spec(self) -> str:
+        return f"{self.local_port}:localhost:{self.remote_port}"
+
+    def __str__(self):
+        label = f" ({self.name})" if self.name else ""
+        return f"localhost:{self.local_port} -> {self.remote_port}{label}"
+
+
+def parse_jupyter_servers(stdout: str) -> List[dict]:
+    """Parse `jupyter server list --json` output (one JSON object per line)."""
+    servers = []
+    for line in (stdout or "").splitlines():
+        try:
+            info = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(info, dict) and "port" in info:
+            servers.append(info)
+    return servers
+
+
+def free_local_port(preferred: int = None) -> int:
+    """`preferred` if it is free on localhost, otherwise any free port."""
+    for port in ((preferred, 0) if preferred else (0,)):
+        with socket.socket() as s:
+            try:
+                s.bind(("127.0.0.1", port))
+            except OSError:
+                continue
+            return s.getsockname()[1]
+    raise OSError("No free local port")
+
+
+class ControlMaster:
+    """A multiplexed ssh connection to a compute node, through the login node.
+
+    Parameters
+    ----------
+    server : PBSServer
+        The server whose login node is used as the jump host.
+    node : str
+        The compute node.
+
+    """
+
+    def __init__(self, server, node: str):
+        self.server = server
+        self.node = node
+        self.target = f"{server.username}@{node}"
+        # control socket paths are limited to ~100 characters
+        digest = hashlib.sha1(f"{server.remotehost}:{node}".encode()).hexdigest()[:12]
+        self.socket = CACHE_DIR / "tunnels" / f"{digest}.sock"
+
+    def _control(self, *args, check: bool = True) -> subprocess.CompletedProcess:
+        cmd = ["ssh", "-o", f"ConnectTimeout={SSH_CONNECT_TIMEOUT}", "-S", str(self.socket)]
+        try:
+            result = subprocess.run(
+                cmd + list(args),
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                timeout=_CONTROL_TIMEOUT,
+            )
+        except subprocess.TimeoutExpired:
+            raise SSHError(f"ssh to {self.node} timed out after {_CONTROL_TIMEOUT:.0f}s")
+        if check and result.returncode != 0:
+            raise SSHError(result.stderr.decode(errors="replace").strip() or "SSH failed")
+        return result
+
+    def start(self):
+        """Open the connection in the background."""
+        self.socket.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket.exists():
+            self.socket.unlink()  # left behind by a dropped connection
+        self._control(
+            "-M",
+            "-fN",
+            "-o", "ServerAliveInterval=15",
+            "-o", "ExitOnForwardFailure=no",
+            "-J", self.server.remotehost,
+            self.target,
+        )  # fmt: skip
+
+    def alive(self) -> bool:
+        return self._control("-O", "check", self.target, check=False).returncode == 0
+
+    def forward(self, forward: Forward):
+        self._control("-O", "forward", "-L", forward.spec, self.target)
+
+    def cancel(self, forward: Forward):
+        self._control("-O", "cancel", "-L", forward.spec, self.target, check=False)
+
+    def execute(self, cmd: str) -> str:
+        """Run a command on the node over the connection and return its stdout."""
+        return self._control(self.target, cmd).stdout.decode(errors="replace")
+
+    def stop(self):
+        self._control("-O", "exit", self.target, check=False)
+        if self.socket.exists():
+            self.socket.unlink()
+
+
+class TunnelManager:
+    """Keep port forwards to a job's node open until the job ends.
+
+    Parameters
+    ----------
+    server : PBSServer
+        The server the job runs on.
+    job_id : str
+        The job.  It must be running.
+    ports : list of (int, int)
+        `(remote, local)` ports to forward.  A local port of None uses the
+        remote port if it is free locally, otherwise any free port.
+    jupyter : bool
+        Also forward the ports of Jupyter servers found on the node.
+    interval : float
+        Seconds between connection checks and Jupyter discovery.
+
+    """
+
+    def __init__(
+        self,
+        server,
+        job_id: str,
+        ports: Iterable[Tuple[int, int]] = (),
+        jupyter: bool = True,
+        interval: float = TUNNEL_CHECK_INTERVAL,
+    ):
+        self.server = server
+        self.job_id = job_id
+        self.ports = list(ports)
+        self.jupyter = jupyter
+        self.interval = interval
+        self.forwards: Dict[int, Forward] = {}
+        self.master = None
+        self._stop = threading.Event()
+
+    def _add(self, remote_port: int, local_port: int = None, name: str = "", url: str = None):
+        forward = Forward(remote_port, free_local_port(local_port or remote_port), name, url)
+        self.master.forward(forward)
+        self.forwards[remote_port] = forward
+        log.success(f"Forwarding {forward}" + (f": {forward.url}" if forward.url else ""))
+
+    def discover(self):
+        """Forward new Jupyter servers, and drop those that have stopped."""
+        servers = {
+            int(s["port"]): s
+            for s in parse_jupyter_servers(self.master.execute(JUPYTER_LIST))
+        }
+        requested = {remote for remote, _ in self.ports}
+        for port, forward in list(self.forwards.items()):
+            if forward.name == "jupyter" and port not in servers and port not in requested:
+                log.info(f"Jupyter server on port {port} stopped.")
+                self.master.cancel(forward)
+                del self.forwards[port]
+        for port, info in servers.items():
+            if port in self.forwards:
+                continue
+            local = free_local_port(port)
+            url = f"http://localhost:{local}{info.get('base_url', '/')}"
+            if info.get("token"):
+                url += f"?token={info['token']}"
+            self._add(port, local, name="jupyter", url=url)
+
+    def _ensure_connected(self):
+        if self.master.alive():
+            return
+        if self.forwards:
+            log.warning(f"Connection to {self.master.node} dropped; reconnecting.")
+        self.master.start()
+        # a new connection has none of the forwards
+        for forward in self.forwards.values():
+            self.master.forward(forward)
+        for remote, local in self.ports:
+            if remote not in self.forwards:
+                self._add(remote, local)
+
+    def run(self):
+        """Keep the forwards open until the job ends or `stop` is called."""
+        node = self.server.job_nodes(self.job_id)[0]
+        future = self.server.watch(self.job_id)
+        future.add_done_callback(lambda _: self._stop.set())
+        self.master = ControlMaster(self.server, node)
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._ensure_connected()
+                    if self.jupyter:
+                        self.discover()
+                except (SSHError, OSError) as e:
+                    log.warning(f"Tunnels to {node}: {e}")
+                self._stop.wait(self.interval)
+            if future.done():
+                log.info(f"Job {self.job_id} ended; closing tunnels.")
+        finally:
+            self.master.stop()
+            self.server.detach(future)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,306 @@
+"""Dependency-graph (DAG) workflows of PBS jobs.
+
+A `Workflow` is a set of named job scripts with `afterok` dependencies
+between them.  The whole graph is submitted in a single remote call: one
+shell script runs `qsub` for every job in topological order, passing the
+job IDs of its parents to `qsub -W depend=afterok:...`.  Job states are
+tracked from batched queue snapshots, and `retry` resubmits only the jobs
+that failed plus everything downstream of them.
+
+Example spec file::
+
+    {
+        "jobs": {
+            "preprocess": {"script": "pre.pbs"},
+            "train": {"script": "train.pbs", "after": ["preprocess"]},
+            "evaluate": {"script": "eval.pbs", "after": ["train"]}
+        }
+    }
+
+"""
+
+import re
+import json
+import shlex
+
+from pathlib import Path
+from typing import Dict, Iterable, List
+from loguru import logger as log
+
+from pybs.constants import QSUB_TIMEOUT
+from pybs.server.directives import parse_script
+from pybs.server.qstat import short_job_id
+
+WAITING = "waiting"
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_HEREDOC = "PYBS_EOF"
+_NAME_PATTERN = re.compile(r"^[\w.-]+$")
+
+
+class Workflow:
+    """A DAG of PBS jobs.
+
+    Parameters
+    ----------
+    jobs : dict
+        Mapping of job name to a dict with keys `script` (path to the job
+        script), `after` (names of jobs that must succeed first) and
+        optionally `location` (`"local"` or `"remote"`).
+    state : dict
+        Mapping of job name to `{"job_id": ..., "state": ...}`, as
+        produced by a previous `submit`.
+
+    """
+
+    def __init__(self, jobs: Dict[str, dict] = None, state: Dict[str, dict] = None):
+        self.jobs = {}
+        self.state = {}
+        for name, job in (jobs or {}).items():
+            self.add(name, job["script"], job.get("after", ()), job.get("location"))
+        for name, node in (state or {}).items():
+            if name in self.state:
+                self.state[name].update(node)
+
+    def add(
+        self,
+        name: str,
+        script: Path,
+        after: Iterable[str] = (),
+        location: str = None,
+    ):
+        """Add a job to the graph.
+
+        If `location` is None, the script is treated as local if it exists
+        on this machine, and as a remote path otherwise.
+        """
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid job name: {name!r}")
+        if name in self.jobs:
+            raise ValueError(f"Duplicate job name: {name}")
+        script = Path(script)
+        if location is None:
+            location = "local" if script.is_file() else "remote"
+        if location not in ("local", "remote"):
+            raise ValueError(f"Invalid location: {location}")
+        self.jobs[name] = dict(script=script, after=list(after), location=location)
+        self.state[name] = dict(job_id=None, state=WAITING)
+
+    @classmethod
+    def from_spec(cls, spec_path: Path, state_path: Path = None) -> "Workflow":
+        """Load a workflow from a JSON spec, and its state if it exists.
+
+        Relative local script paths are resolved against the spec's directory.
+        """
+        spec_path = Path(spec_path)
+        with open(spec_path, "r") as f:
+            spec = json.load(f)
+        jobs = {}
+        for name, job in spec["jobs"].items():
+            job = dict(job)
+            local = spec_path.parent / job["script"]
+            if job.get("location") != "remote" and local.is_file():
+                job["script"] = local.resolve()
+            jobs[name] = job
+        state = None
+        if state_path is not None and Path(state_path).is_file():
+            with open(state_path, "r") as f:
+                state = json.load(f)
+        return cls(jobs, state)
+
+    def save_state(self, state_path: Path):
+        """Write job IDs and states to a JSON file."""
+        with open(state_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+
+    def order(self) -> List[str]:
+        """Return job names in topological order.
+
+        Raises ValueError on unknown dependencies or cycles.
+        """
+        for name, job in self.jobs.items():
+            for parent in job["after"]:
+                if parent not in self.jobs:
+                    raise ValueError(f"Job {name} depends on unknown job {parent}")
+        n_parents = {name: len(set(job["after"])) for name, job in self.jobs.items()}
+        ready = [name for name, n in n_parents.items() if n == 0]
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for child in self.children(name):
+                n_parents[child] -= 1
+                if n_parents[child] == 0:
+                    ready.append(child)
+        if len(order) != len(self.jobs):
+            cycle = sorted(set(self.jobs) - set(order))
+            raise ValueError(f"Dependency cycle between jobs: {cycle}")
+        return order
+
+    def children(self, name: str) -> List[str]:
+        """Jobs that directly depend on `name`."""
+        return [child for child, job in self.jobs.items() if name in job["after"]]
+
+    def descendants(self, names: Iterable[str]) -> set:
+        """All jobs downstream of `names`, including `names` themselves."""
+        found = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name not in found:
+                found.add(name)
+                stack.extend(self.children(name))
+        return found
+
+    def job_ids(self) -> Dict[str, str]:
+        """Job IDs of submitted jobs, keyed by job name."""
+        return {
+            name: node["job_id"]
+            for name, node in self.state.items()
+            if node["job_id"] is not None
+        }
+
+    def _qsub_line(self, index: int, name: str, depend: List[str], limits=None) -> str:
+        job = self.jobs[name]
+        cmd = "qsub"
+        if depend:
+            cmd += " -W depend=afterok:" + ":".join(depend)
+        if job["location"] == "remote":
+            line = f"J{index}=$({cmd} {shlex.quote(str(job['script']))})"
+        else:
+            with open(job["script"], "r") as f:
+                script = f.read()
+            parse_script(script).validate(limits, source=str(job["script"]))
+            line = f"J{index}=$({cmd} << '{_HEREDOC}'\n{script}\n{_HEREDOC}\n)"
+        return (
+            line
+            + f" || {{ echo 'qsub failed for job {name}' >&2; exit 1; }}\n"
+            + f'echo "{name} $J{index}"'
+        )
+
+    def batch_script(self, names: Iterable[str] = None, limits=None) -> str:
+        """Shell script that submits `names` (default: all jobs) in one call.
+
+        Dependencies on jobs outside `names` are kept if those jobs are
+        still queued or running, and dropped if they already succeeded.
+        The `#PBS` directives of local scripts are checked first (against
+        `limits`, an `inventory.ClusterLimits`, if given), raising
+        `DirectiveError` before anything is submitted.
+        """
+        names = set(self.jobs if names is None else names)
+        order = [name for name in self.order() if name in names]
+        index = {name: i for i, name in enumerate(order)}
+        lines = []
+        for name in order:
+            depend = []
+            for parent in self.jobs[name]["after"]:
+                node = self.state[parent]
+                if parent in index:
+                    depend.append(f"$J{index[parent]}")
+                elif node["state"] in (QUEUED, RUNNING):
+                    depend.append(node["job_id"])
+                elif node["state"] != SUCCEEDED:
+                    raise ValueError(
+                        f"Cannot submit {name}: dependency {parent} is {node['state']}"
+                    )
+            lines.append(self._qsub_line(index[name], name, depend, limits))
+        return "\n".join(lines)
+
+    def submit(
+        self,
+        server,
+        names: Iterable[str] = None,
+        delete: Iterable[str] = (),
+    ) -> Dict[str, str]:
+        """Submit jobs (default: the whole graph) in a single remote call.
+
+        Job IDs in `delete` are `qdel`-ed at the start of the same call.
+        Returns the new job IDs keyed by job name.  If a `qsub` fails part
+        way, the jobs submitted before it are still recorded.
+
+        The output is streamed, so each job ID is recorded as soon as its
+        `qsub` returns: if the call times out (after `QSUB_TIMEOUT` seconds
+        per job, on top of the server's timeout), the jobs already
+        submitted are recorded before `SSHTimeoutError` is raised.  The
+        call is never retried, as `qsub` is not idempotent.
+        """
+        names = list(self.jobs if names is None else names)
+        script = self.batch_script(names, limits=server.cluster_limits())
+        delete = list(delete)
+        if delete:
+            script = f"qdel {' '.join(delete)} 2>/dev/null\n" + script
+        timeout = None if server.timeout is None else server.timeout + QSUB_TIMEOUT * len(names)
+        submitted = {}
+        stream = server.ssh_stream(script, timeout=timeout)
+        try:
+            with stream as lines:
+                for line in lines:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[0] in self.jobs:
+                        name, job_id = parts
+                        submitted[name] = short_job_id(job_id)
+                        self.state[name] = dict(job_id=submitted[name], state=QUEUED)
+        finally:
+            log.info(f"Submitted {len(submitted)} workflow jobs: {submitted}")
+            if stream.stderr:
+                log.error(stream.stderr)
+        return submitted
+
+    def refresh(self, server) -> Dict[str, str]:
+        """Update job states from one queue snapshot.
+
+        Finished jobs are then checked for their exit status in one more
+        batched call.  A job succeeds only if it exited with status 0.
+        Returns the states keyed by job name.
+        """
+        active = {
+            name: node["job_id"]
+            for name, node in self.state.items()
+            if node["state"] in (QUEUED, RUNNING)
+        }
+        snapshot = server.snapshot(active.values())
+        finished = {}
+        for name, job_id in active.items():
+            if snapshot.is_finished(job_id):
+                finished[name] = job_id
+            elif job_id in snapshot:
+                status = snapshot[job_id]["status"]
+                self.state[name]["state"] = RUNNING if status == "R" else QUEUED
+
+        records = server.job_records(finished.values())
+        for name, job_id in finished.items():
+            # NOTE: jobs with no recorded exit status (e.g. deleted because a
+            # dependency failed, or expired from the server history) are
+            # treated as failed, so that `retry` resubmits them.
+            exit_status = records.get(job_id, {}).get("Exit_status")
+            self.state[name]["state"] = SUCCEEDED if exit_status == "0" else FAILED
+        return self.states()
+
+    def states(self) -> Dict[str, str]:
+        """Current state of each job, keyed by job name."""
+        return {name: node["state"] for name, node in self.state.items()}
+
+    def retry(self, server) -> Dict[str, str]:
+        """Resubmit failed jobs and everything downstream of them.
+
+        Jobs that succeeded are not resubmitted.  Downstream jobs that are
+        still queued (e.g. held on a failed dependency) are deleted first,
+        in the same remote call.
+        """
+        failed = [name for name, state in self.states().items() if state == FAILED]
+        unsubmitted = [n for n, state in self.states().items() if state == WAITING]
+        targets = self.descendants(failed + unsubmitted)
+        if not targets:
+            log.info("No failed jobs to retry.")
+            return {}
+        stale = [
+            self.state[name]["job_id"]
+            for name in targets
+            if self.state[name]["state"] in (QUEUED, RUNNING)
+        ]
+        for name in targets:
+            self.state[name] = dict(job_id=None, state=WAITING)
+        return self.submit(server, targets, delete=stale)
@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the files that pybs caches under a temporary directory."""
+    from pybs.server import coordination, environment
+
+    for module in (coordination, environment):
+        monkeypatch.setattr(module, "CACHE_DIR", tmp_path)
+    return tmp_path
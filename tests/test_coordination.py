@@ -0,0 +1,60 @@
+import pytest
+
+from pybs.server import coordination
+from pybs.server.coordination import Coordinator
+
+pytestmark = pytest.mark.skipif(
+    not Coordinator.available, reason="coordination needs fcntl"
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake wall clock for the token bucket."""
+    now = [1000.0]
+    monkeypatch.setattr(coordination, "time", lambda: now[0])
+    return now
+
+
+def take(coordinator):
+    with coordinator.locked():
+        return coordinator._take_token()
+
+
+def test_token_bucket_burst(cache_dir, clock):
+    coordinator = Coordinator("katana", rate=2.0, burst=3)
+    assert coordinator.directory == cache_dir / "coordination" / "katana"
+    assert [take(coordinator) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # then one token every 1 / rate seconds, queued behind each other
+    assert [take(coordinator) for _ in range(3)] == [0.5, 1.0, 1.5]
+
+
+def test_token_bucket_refills(cache_dir, clock):
+    coordinator = Coordinator("katana", rate=2.0, burst=2)
+    for _ in range(2):
+        take(coordinator)
+    clock[0] += 0.5
+    assert take(coordinator) == 0.0
+    assert take(coordinator) == 0.5
+    # never more than `burst` tokens, however long the bucket was idle
+    clock[0] += 3600
+    assert [take(coordinator) for _ in range(3)] == [0.0, 0.0, 0.5]
+
+
+def test_token_bucket_is_shared(cache_dir, clock):
+    first = Coordinator("katana", rate=1.0, burst=1)
+    second = Coordinator("katana", rate=1.0, burst=1)
+    other = Coordinator("gadi", rate=1.0, burst=1)
+    assert take(first) == 0.0
+    assert take(second) == 1.0
+    assert take(other) == 0.0
+
+
+def test_throttled_waits_for_a_token(cache_dir, clock, monkeypatch):
+    waits = []
+    monkeypatch.setattr(coordination, "sleep", waits.append)
+    coordinator = Coordinator("katana", rate=4.0, burst=1)
+    for _ in range(3):
+        with coordinator.throttled():
+            pass
+    assert waits == [0.25, 0.5]
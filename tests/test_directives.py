@@ -0,0 +1,110 @@
+import pytest
+
+from pybs import DEFAULT_PBS_SCRIPT_PATH
+from pybs.server.directives import DirectiveError, ResourceRequest, parse_script
+
+SCRIPT = """\
+#!/bin/bash
+#PBS -N train
+#PBS -l select=2:ncpus=6:ngpus=1:mem=46gb
+#PBS -l walltime=9:00:00
+#PBS -j oe
+
+#PBS -q gpu
+cd $PBS_O_WORKDIR
+#PBS -q ignored
+"""
+
+
+def test_parse_script():
+    request = parse_script(SCRIPT)
+    assert request.issues == ()
+    assert request.name == "train"
+    assert request.queue == "gpu"  # directives after the first command are ignored
+    assert request.walltime == 9 * 3600
+    assert len(request.select) == 1
+    assert request.select[0].count == 2
+    assert request.totals() == dict(
+        walltime=9 * 3600, ncpus=12, ngpus=2, mem=92 * 1024**3, nodect=2
+    )
+
+
+def test_parse_script_is_cached():
+    assert parse_script(SCRIPT) is parse_script(SCRIPT)
+
+
+def test_parse_default_script():
+    request = parse_script(DEFAULT_PBS_SCRIPT_PATH.read_text())
+    assert request.issues == ()
+    assert request.total("ngpus") == 1
+
+
+@pytest.mark.parametrize(
+    "line, message",
+    [
+        ("#PBS -l walltime=nine", "walltime=nine is not a duration"),
+        ("#PBS -l select=1:ncpus=six", "ncpus=six is not a non-negative integer"),
+        ("#PBS -l select=0:ncpus=6", "chunk count '0'"),
+        ("#PBS -l mem=lots", "mem=lots is not a size"),
+        ("#PBS -j both", "-j both: must be one of oe, eo or n"),
+        ("#PBS -Z", "unknown option '-Z'"),
+        ("#PBS -N", "option -N has no value"),
+        ("#PBS -I", "interactive jobs"),
+    ],
+)
+def test_parse_script_issues(line, message):
+    request = parse_script(f"#!/bin/bash\n{line}\n")
+    assert len(request.issues) == 1
+    assert request.issues[0].startswith("line 2: ")
+    assert message in request.issues[0]
+
+
+def test_merge():
+    request = parse_script(SCRIPT).merge(walltime="2:00:00", ngpus=2, queue="debug")
+    assert request.walltime == 2 * 3600
+    assert request.queue == "debug"
+    assert request.total("ngpus") == 4
+    # other resources of the chunk are kept
+    assert request.total("ncpus") == 12
+    assert request.qsub_args() == (
+        "-l walltime=2:00:00 -l select=2:ncpus=6:ngpus=2:mem=46gb -q debug"
+    )
+
+
+def test_merge_without_select():
+    request = ResourceRequest().merge(ngpus=1, gpu_model="A100")
+    assert [str(c) for c in request.select] == ["1:ngpus=1:gpu_model=A100"]
+
+
+def test_merge_nothing():
+    request = parse_script(SCRIPT)
+    assert request.merge() is request
+
+
+def test_merge_keeps_last_override():
+    request = parse_script(SCRIPT).merge(walltime="1:00:00").merge(walltime="3:00:00")
+    assert request.walltime == 3 * 3600
+    assert request.qsub_args() == "-l walltime=3:00:00"
+
+
+def test_merge_reports_override_issues():
+    request = parse_script(SCRIPT).merge(walltime="soon")
+    assert request.issues == ("override: walltime=soon is not a duration of the form [[HH:]MM:]SS",)
+
+
+def test_validate():
+    parse_script(SCRIPT).validate()
+    with pytest.raises(DirectiveError) as excinfo:
+        parse_script("#PBS -l walltime=nine\n").validate(source="job.pbs")
+    assert excinfo.value.source == "job.pbs"
+    assert len(excinfo.value.issues) == 1
+    assert "in job.pbs" in str(excinfo.value)
+
+
+def test_validate_against_limits():
+    class Limits:
+        def check(self, request):
+            return [f"queue {request.queue} allows at most 1 GPU"]
+
+    with pytest.raises(DirectiveError, match="allows at most 1 GPU"):
+        parse_script(SCRIPT).validate(Limits())
@@ -0,0 +1,45 @@
+from pybs.server.environment import RemoteEnvironment, parse_env
+
+ENV = """\
+HOME=/home/z123
+SCRATCH=/srv/scratch/z123
+BASH_FUNC_module%%=() {  eval `/usr/bin/modulecmd bash $*`
+}
+PS1=$ 
+"""
+
+
+def test_parse_env():
+    environ = parse_env(ENV)
+    assert environ["HOME"] == "/home/z123"
+    assert environ["SCRATCH"] == "/srv/scratch/z123"
+    assert "BASH_FUNC_module%%" not in environ
+    assert "}" not in environ
+
+
+def test_expand():
+    env = RemoteEnvironment(dict(HOME="/home/z123", SCRATCH="/srv/scratch/z123"))
+    assert env.expand("~") == "/home/z123"
+    assert env.expand("~/project") == "/home/z123/project"
+    assert env.expand("$SCRATCH/data") == "/srv/scratch/z123/data"
+    assert env.expand("${SCRATCH}_old") == "/srv/scratch/z123_old"
+    # no shell: unknown variables, other users' homes and substitutions are kept
+    assert env.expand("$UNKNOWN/data") == "$UNKNOWN/data"
+    assert env.expand("~other/data") == "~other/data"
+    assert env.expand("$(rm -rf ~)") == "$(rm -rf ~)"
+
+
+def test_roots():
+    env = RemoteEnvironment(dict(HOME="/home/z123", SCRATCH="/srv/scratch/z123"))
+    assert env.roots == {"SCRATCH": "/srv/scratch/z123"}
+
+
+def test_cache(cache_dir):
+    env = RemoteEnvironment(dict(HOME="/home/z123"), fetched_at=1000.0)
+    env.save("katana")
+    assert RemoteEnvironment.cache_path("katana").parent == cache_dir / "environment"
+    loaded = RemoteEnvironment.load("katana", max_age=float("inf"))
+    assert loaded.variables == env.variables
+    assert loaded.fingerprint == env.fingerprint
+    assert RemoteEnvironment.load("katana", max_age=60) is None
+    assert RemoteEnvironment.load("other") is None
@@ -0,0 +1,16 @@
+from pybs.server.kill import expand_job_ids
+
+
+def test_expand_job_ids():
+    assert expand_job_ids(["1000-1003"]) == ["1000", "1001", "1002", "1003"]
+    assert expand_job_ids(["1234[1-3]"]) == ["1234[1]", "1234[2]", "1234[3]"]
+    assert expand_job_ids(["1234[1-10:4]"]) == ["1234[1]", "1234[5]", "1234[9]"]
+
+
+def test_expand_job_ids_strips_server_and_deduplicates():
+    specs = ["1001.kman.restech.unsw.edu.au", "1000-1002", "1001"]
+    assert expand_job_ids(specs) == ["1001", "1000", "1002"]
+
+
+def test_expand_job_ids_keeps_other_ids():
+    assert expand_job_ids(["1234[]", "abc"]) == ["1234[]", "abc"]
@@ -0,0 +1,119 @@
+import pytest
+
+from pybs.server.qstat import (
+    iter_pbsnodes,
+    iter_qstat_full,
+    parse_duration,
+    parse_qstat_table,
+    parse_size,
+    parse_variable_list,
+)
+
+QSTAT_TABLE = """\
+
+kman.restech.unsw.edu.au:
+                                                            Req'd  Req'd   Elap
+Job ID               Username Queue    Jobname    SessID NDS TSK Memory Time  S Time
+-------------------- -------- -------- ---------- ------ --- --- ------ ----- - -----
+100.kman.restech.un* z123     gpu      train      123456   2  12   92gb 12:00 R 01:30
+   k092/0*6+k093/0*6
+211.kman.restech.un* z123     cpu      prep          --    1   1    4gb 01:00 Q   --
+   --
+"""
+
+QSTAT_STDERR = """\
+qstat: Unknown Job Id 299.kman.restech.unsw.edu.au
+qstat: 300.kman.restech.unsw.edu.au Job has finished, use -x or -H to obtain historical job information
+"""
+
+QSTAT_FULL = """\
+Job Id: 100.kman.restech.unsw.edu.au
+    Job_Name = train
+    job_state = R
+    Resource_List.walltime = 12:00:00
+    Variable_List = PBS_O_HOME=/home/z123,PBS_O_PATH=/usr/bin:/bin,
+\tLIST=a\\,b
+
+Job Id: 211.kman.restech.unsw.edu.au
+    Job_Name = prep
+    job_state = Q
+"""
+
+PBSNODES = """\
+k092
+     Mom = k092.kman.restech.unsw.edu.au
+     state = job-busy
+     resources_available.ngpus = 2
+     resources_available.mem = 376gb
+
+k093
+     state = free
+     resources_available.ngpus = 2
+"""
+
+
+def test_parse_duration():
+    assert parse_duration("12:00:00") == 43200
+    assert parse_duration("01:30") == 5400  # HH:MM in qstat -a tables
+    assert parse_duration("45") == 45
+    assert parse_duration("--") == -1
+    assert parse_duration("") == -1
+    assert parse_duration(None) == -1
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("46gb", 46 * 1024**3),
+        ("1024kb", 1024**2),
+        ("2w", 16),
+        ("512", 512),
+        ("4g", 4 * 1024**3),
+        ("1.5TB", int(1.5 * 1024**4)),
+        ("--", -1),
+        ("", -1),
+    ],
+)
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+def test_parse_qstat_table():
+    snapshot = parse_qstat_table(QSTAT_TABLE, QSTAT_STDERR)
+    assert list(snapshot) == ["100", "211"]
+    running = snapshot["100"]
+    assert running["status"] == "R"
+    assert running["Jobname"] == "train"
+    assert running["Req_Time"] == "12:00"
+    assert running["Elap_Time"] == "01:30"
+    assert running["node"] == "k092"
+    assert running["nodes"] == ["k092", "k093"]
+    assert running["resources"] == "0*6"
+    queued = snapshot["211"]
+    assert queued["status"] == "Q"
+    assert queued["nodes"] == []
+    assert snapshot.missing == {"299", "300"}
+
+
+def test_parse_qstat_table_without_header():
+    assert parse_qstat_table("100.kman z123 gpu train 1 2 12 92gb 12:00 R 01:30") == {}
+
+
+def test_iter_qstat_full():
+    jobs = list(iter_qstat_full(QSTAT_FULL.splitlines()))
+    assert [j["job_id"] for j in jobs] == ["100", "211"]
+    assert jobs[0]["Job_Id"] == "100.kman.restech.unsw.edu.au"
+    assert jobs[0]["Resource_List.walltime"] == "12:00:00"
+    assert jobs[1]["job_state"] == "Q"
+    # tab-indented continuation lines are joined to the value
+    variables = parse_variable_list(jobs[0]["Variable_List"])
+    assert variables["PBS_O_PATH"] == "/usr/bin:/bin"
+    assert variables["LIST"] == "a,b"
+
+
+def test_iter_pbsnodes():
+    nodes = list(iter_pbsnodes(PBSNODES.splitlines()))
+    assert [n["name"] for n in nodes] == ["k092", "k093"]
+    assert nodes[0]["state"] == "job-busy"
+    assert nodes[0]["resources_available.mem"] == "376gb"
+    assert nodes[1] == {"name": "k093", "state": "free", "resources_available.ngpus": "2"}
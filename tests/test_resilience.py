@@ -0,0 +1,126 @@
+import pytest
+
+from pybs.server import resilience
+from pybs.server.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    SSHCancelledError,
+    SSHError,
+    backoff_delays,
+    get_breaker,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake `monotonic` clock for the breakers, moved with `clock.advance`."""
+
+    class Clock:
+        now = 1000.0
+
+        def __call__(self):
+            return self.now
+
+        def advance(self, seconds):
+            self.now += seconds
+
+    clock = Clock()
+    monkeypatch.setattr(resilience, "monotonic", clock)
+    return clock
+
+
+def fail(breaker, error=SSHError):
+    with pytest.raises(error):
+        with breaker.attempt():
+            raise error("ssh failed")
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker("katana", threshold=3, cooldown=30.0)
+    fail(breaker)
+    fail(breaker)
+    assert not breaker.is_open
+    fail(breaker)
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError, match="not retrying for 30s"):
+        breaker.check()
+
+
+def test_success_resets_failures(clock):
+    breaker = CircuitBreaker("katana", threshold=2)
+    fail(breaker)
+    with breaker.attempt():
+        pass
+    fail(breaker)
+    assert not breaker.is_open
+
+
+def test_half_open_trial(clock):
+    breaker = CircuitBreaker("katana", threshold=1, cooldown=30.0)
+    fail(breaker)
+    clock.advance(29)
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    clock.advance(1)
+    breaker.check()  # the trial call
+    # only one trial at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.record_success()
+    assert not breaker.is_open
+    breaker.check()
+
+
+def test_failed_trial_reopens(clock):
+    breaker = CircuitBreaker("katana", threshold=3, cooldown=30.0)
+    for _ in range(3):
+        fail(breaker)
+    clock.advance(30)
+    fail(breaker)
+    assert breaker.is_open
+    clock.advance(29)
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_other_errors_release_the_trial(clock):
+    breaker = CircuitBreaker("katana", threshold=1, cooldown=30.0)
+    fail(breaker)
+    clock.advance(30)
+    for error in (SSHCancelledError, KeyboardInterrupt):
+        fail(breaker, error)
+        assert breaker.failures == 1
+        assert breaker.is_open
+    # released trials let the next call through
+    with breaker.attempt():
+        pass
+    assert not breaker.is_open
+
+
+def test_get_breaker_is_shared_per_host(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    assert get_breaker("katana") is get_breaker("katana")
+    assert get_breaker("katana") is not get_breaker("gadi")
+
+
+def test_get_breaker_per_target_node(clock, monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    login = get_breaker("katana")
+    node = get_breaker("katana", "k092")
+    assert node is get_breaker("katana", "k092")
+    assert node is not login
+    assert node is not get_breaker("katana", "k093")
+    assert node is not get_breaker("gadi", "k092")
+    # compute nodes that are down do not cut off the login node
+    for _ in range(node.threshold):
+        fail(node)
+    assert node.is_open
+    assert not login.is_open
+    login.check()
+
+
+def test_backoff_delays():
+    delays = list(backoff_delays(5, base=0.5, cap=2.0))
+    assert len(delays) == 5
+    for attempt, delay in enumerate(delays):
+        assert 0 <= delay <= min(2.0, 0.5 * 2**attempt)
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from pybs.server.workflow import WAITING, Workflow
+
+
+def remote_jobs(**after):
+    return {
+        name: dict(script=f"/scratch/{name}.pbs", after=parents, location="remote")
+        for name, parents in after.items()
+    }
+
+
+def test_order():
+    workflow = Workflow(
+        remote_jobs(report=["train", "eval"], eval=["train"], train=["prep"], prep=[])
+    )
+    assert workflow.order() == ["prep", "train", "eval", "report"]
+
+
+def test_order_keeps_independent_jobs_in_spec_order():
+    workflow = Workflow(remote_jobs(b=[], a=[], c=["a", "b"]))
+    assert workflow.order() == ["b", "a", "c"]
+
+
+def test_order_unknown_dependency():
+    with pytest.raises(ValueError, match="unknown job missing"):
+        Workflow(remote_jobs(a=["missing"])).order()
+
+
+def test_order_cycle():
+    workflow = Workflow(remote_jobs(a=[], b=["a", "c"], c=["b"]))
+    with pytest.raises(ValueError, match=r"cycle between jobs: \['b', 'c'\]"):
+        workflow.order()
+
+
+def test_descendants():
+    workflow = Workflow(remote_jobs(a=[], b=["a"], c=["b"], d=[]))
+    assert workflow.descendants(["b"]) == {"b", "c"}
+
+
+def test_add_rejects_bad_names():
+    workflow = Workflow()
+    with pytest.raises(ValueError, match="Invalid job name"):
+        workflow.add("a b", "/scratch/a.pbs", location="remote")
+    workflow.add("a", "/scratch/a.pbs", location="remote")
+    with pytest.raises(ValueError, match="Duplicate job name"):
+        workflow.add("a", "/scratch/a.pbs", location="remote")
+
+
+def test_from_spec(tmp_path):
+    (tmp_path / "prep.pbs").write_text("#!/bin/bash\n")
+    spec = dict(
+        jobs=dict(
+            prep=dict(script="prep.pbs"),
+            train=dict(script="/scratch/train.pbs", after=["prep"]),
+        )
+    )
+    (tmp_path / "workflow.json").write_text(json.dumps(spec))
+    state_path = tmp_path / "state.json"
+    state_path.write_text(json.dumps(dict(prep=dict(job_id="100", state="queued"))))
+    workflow = Workflow.from_spec(tmp_path / "workflow.json", state_path)
+    assert workflow.jobs["prep"]["location"] == "local"
+    assert workflow.jobs["prep"]["script"] == (tmp_path / "prep.pbs").resolve()
+    assert workflow.jobs["train"]["location"] == "remote"
+    assert workflow.job_ids() == {"prep": "100"}
+    assert workflow.state["train"]["state"] == WAITING